@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict
+
+from fastapi import HTTPException, status
+
+import env
+
+class ConcurrencyLimiter:
+    def __init__(self, route_class: str, max_concurrency: int, max_queue_size: int, queue_deadline_ms: int, retry_after: int) -> None:
+        self.route_class = route_class
+        self.max_queue_size = max_queue_size
+        self.queue_deadline = queue_deadline_ms / 1000
+        self.retry_after = retry_after
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+
+    def overloaded(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Too many {self.route_class} requests in progress, please retry later.",
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    async def acquire(self) -> None:
+        if self.slots.locked() and self.waiting >= self.max_queue_size:
+            raise self.overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=self.queue_deadline)
+        except asyncio.TimeoutError:
+            raise self.overloaded()
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self.slots.release()
+
+limiters: Dict[str, ConcurrencyLimiter] = {
+    "heavy": ConcurrencyLimiter(
+        "heavy",
+        env.HEAVY_ROUTES_CONCURRENCY,
+        env.HEAVY_ROUTES_QUEUE_SIZE,
+        env.HEAVY_ROUTES_QUEUE_DEADLINE_MS,
+        env.HEAVY_ROUTES_RETRY_AFTER
+    ),
+}
+
+def limit_concurrency(route_class: str):
+    limiter = limiters[route_class]
+    async def admit_request():
+        await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
+    return admit_request
+
+# Population stats, average day and range queries
+heavy_route = limit_concurrency("heavy")
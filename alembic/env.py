@@ -5,24 +5,32 @@ from logging.config import fileConfig
 
 
 from sqlalchemy import engine_from_config
+from sqlalchemy import inspect
 from sqlalchemy import pool
 
 from alembic import context
 
+import env
+from models.database import Base
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# Not when the app runs the migrations itself (db_engine.upgrade_schema)
+if config.config_file_name is not None and "connection" not in config.attributes:
     fileConfig(config.config_file_name)
 
+# The app and the migrations use the same database
+config.set_main_option("sqlalchemy.url", env.SQLALCHEMY_DATABASE_URL)
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-target_metadata = None
+target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -61,6 +69,11 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        do_run_migrations(connection)
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
@@ -68,12 +81,27 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        do_run_migrations(connection)
+
+
+def do_run_migrations(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata
+    )
+
+    if not inspect(connection).has_table("user"):
+        # Fresh database : create the current schema and mark it as up to date,
+        # the first revisions alter tables that would not exist yet
+        if connection.dialect.name == "sqlite":
+            # Only takes effect before the first table is created
+            connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        target_metadata.create_all(connection)
+        context.get_context().stamp(context.script, "head")
+        connection.commit()
+        return
 
-        with context.begin_transaction():
-            context.run_migrations()
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
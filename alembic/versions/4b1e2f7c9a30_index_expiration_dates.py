@@ -0,0 +1,26 @@
+"""Index expiration dates of tokens and password requests
+
+Revision ID: 4b1e2f7c9a30
+Revises: dd05df28db8e
+Create Date: 2026-10-19 10:12:41.207113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e2f7c9a30'
+down_revision = 'dd05df28db8e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_auth_expiration_date', 'auth', ['expiration_date'])
+    op.create_index('ix_new_password_req_expiration_date', 'new_password_req', ['expiration_date'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_new_password_req_expiration_date', table_name='new_password_req')
+    op.drop_index('ix_auth_expiration_date', table_name='auth')
@@ -0,0 +1,33 @@
+"""Switch SQLite databases to incremental auto-vacuum
+
+Revision ID: 8c3d5e1a7b42
+Revises: 4b1e2f7c9a30
+Create Date: 2026-10-20 09:41:27.318450
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3d5e1a7b42'
+down_revision = '4b1e2f7c9a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    # The mode of a database which has tables only changes with a VACUUM, which can not run in a transaction
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        op.execute("VACUUM")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA auto_vacuum=NONE")
+        op.execute("VACUUM")
@@ -0,0 +1,213 @@
+"""In-process load test of the whole API.
+
+Drives the ASGI application directly through httpx against a temporary SQLite database
+and synthetic users data, then reports throughput and latency percentiles per route.
+
+    python -m benchmarks.loadtest --users 20 --requests 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERS_DATA_COLUMNS = [
+    "Appareil", "Numéro de série", "Horodatage de l'appareil", "Type d'enregistrement",
+    "Historique de la glycémie mg/dL", "Numérisation de la glycémie mg/dL",
+    "Insuline à action rapide sans valeur numérique", "Insuline à action rapide (unités)",
+    "Alimentation sans valeur numérique", "Glucides (grammes)", "Glucides (portions)",
+    "Insuline à action longue sans valeur numérique", "Insuline à action longue (unités)",
+    "Remarques", "Glycémie par bandelette mg/dL", "Cétone mmol/L", "Insuline repas (unités)",
+    "Correction insuline (unités)", "Insuline modifiée par l'utilisateur (unités)"
+]
+
+DEFAULT_MIX = "samples=6,samples_latest=6,average_day=1,user_stats=4,trend=2,users_stats=1,doc_resources=1,doc_information=1,token=1"
+
+def write_synthetic_user_data(filepath: str, days: int, rng: random.Random) -> None:
+    now = datetime.now()
+    end = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    serial = f"{rng.randrange(16**8):08X}-{rng.randrange(16**4):04X}"
+    with open(filepath, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Données de glycémie", "Date de création", end.strftime("%d-%m-%Y %H:%M"), "Créé par", "loadtest"])
+        writer.writerow(USERS_DATA_COLUMNS)
+        sampling_date = start
+        while sampling_date <= end:
+            hour = sampling_date.hour + sampling_date.minute / 60
+            value = 130 + 45 * math.sin((hour - 8) / 24 * 2 * math.pi) + rng.gauss(0, 18)
+            row = [""] * len(USERS_DATA_COLUMNS)
+            row[0], row[1], row[2], row[3] = "FreeStyle LibreLink", serial, sampling_date.strftime("%d-%m-%Y %H:%M"), "0"
+            row[4] = str(int(min(max(value, 40), 400)))
+            writer.writerow(row)
+            # Some meals and rapid insulin injections between the glucose records
+            if sampling_date.minute == 0 and sampling_date.hour in (8, 12, 20):
+                meal = [""] * len(USERS_DATA_COLUMNS)
+                meal[0], meal[1], meal[2], meal[3] = row[0], row[1], row[2], "5"
+                meal[9] = str(rng.randrange(20, 90))
+                writer.writerow(meal)
+                injection = [""] * len(USERS_DATA_COLUMNS)
+                injection[0], injection[1], injection[2], injection[3] = row[0], row[1], row[2], "4"
+                injection[7] = str(rng.randrange(2, 10))
+                writer.writerow(injection)
+            sampling_date += timedelta(minutes=15)
+
+def seed_database(n_users: int) -> List[Tuple[str, str, str]]:
+    from router_dependencies import SessionLocal, engine
+    from db_engine import upgrade_schema
+    from models import database as db_models
+    import utils
+
+    upgrade_schema(engine)
+    db = SessionLocal()
+    try:
+        db.add(db_models.SecretSignature(secret_value=os.urandom(16).hex(), generation_date=datetime.now()))
+        resource = db_models.DocResource(resource_name="samples", description="Blood glucose samples", admin_privilege=False)
+        db.add(resource)
+        for title in ("description", "authentification", "rights"):
+            section = db_models.DocSection(title=title)
+            db.add(section)
+            db.flush()
+            db.add(db_models.DocContentBlock(doc_section_id=section.id, title=f"{title} block", content=f"{title} content"))
+        db.commit()
+        users = []
+        for i in range(n_users):
+            firstname, lastname, password = f"Load{i}", f"Tester{i}", f"password{i}"
+            utils.add_new_user(db, firstname, lastname, f"load{i}@example.com", password)
+            tk = utils.add_new_token(db, firstname, lastname, password, True, True, True, True)
+            users.append((f"{firstname}_{lastname}", password, tk.access_token))
+        return users
+    finally:
+        db.close()
+
+def request_builders(users_days: int) -> Dict[str, Callable[[str, str, str], Tuple[str, str, dict]]]:
+    today = datetime.now()
+    last_week = today - timedelta(days=min(users_days, 7))
+    return {
+        "samples": lambda u, p, tk: ("GET", f"/user/{u}/samples", {}),
+        "samples_latest": lambda u, p, tk: ("GET", f"/user/{u}/samples/latest", {"params": {"n_latest": 20}}),
+        "average_day": lambda u, p, tk: ("POST", f"/user/{u}/samples/average_day", {"json": {"hours": ["08:00", "12:00", "20:00"], "error": 15}}),
+        "user_stats": lambda u, p, tk: ("GET", f"/user/{u}/stats", {}),
+        "trend": lambda u, p, tk: ("GET", f"/user/{u}/trend/days_interval", {"params": {
+            "day1_string": last_week.strftime("%d/%m/%Y"), "day2_string": today.strftime("%d/%m/%Y"), "error": 10
+        }}),
+        "users_stats": lambda u, p, tk: ("GET", "/users/stats", {}),
+        "doc_resources": lambda u, p, tk: ("GET", "/doc/resources", {}),
+        "doc_information": lambda u, p, tk: ("GET", "/doc/general_information", {}),
+        "token": lambda u, p, tk: ("POST", "/token", {"data": {"username": u, "password": p, "scope": "profile samples goals stats"}}),
+    }
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = int(weight)
+    return weights
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return float("nan")
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+async def replay_traffic(app, users, builders, weights: Dict[str, int], n_requests: int, concurrency: int, seed: int):
+    import httpx
+
+    rng = random.Random(seed)
+    names = list(weights)
+    plan = rng.choices(names, weights=[weights[n] for n in names], k=n_requests)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    next_request = iter(range(n_requests))
+
+    async def run_client(client: httpx.AsyncClient):
+        for i in next_request:
+            name = plan[i]
+            username, password, token = users[i % len(users)]
+            method, url, kwargs = builders[name](username, password, token)
+            headers = {"Authorization": f"Bearer {token}"} if name != "token" else {}
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies[name].append((time.perf_counter() - start) * 1000)
+            statuses[name][response.status_code] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[run_client(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+def build_report(latencies, statuses, elapsed: float) -> dict:
+    report = {"elapsed_s": round(elapsed, 3), "total_requests": sum(len(v) for v in latencies.values()), "routes": {}}
+    report["rps"] = round(report["total_requests"] / elapsed, 1)
+    for name in sorted(latencies):
+        values = sorted(latencies[name])
+        report["routes"][name] = {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "statuses": dict(statuses[name]),
+        }
+    return report
+
+def print_report(report: dict) -> None:
+    print(f"{report['total_requests']} requests in {report['elapsed_s']} s : {report['rps']} req/s")
+    print(f"{'route':<16}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for name, r in report["routes"].items():
+        print(f"{name:<16}{r['requests']:>10}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}  {r['statuses']}")
+
+async def main(args) -> dict:
+    from main import app
+
+    users = seed_database(args.users)
+    for username, _, _ in users:
+        write_synthetic_user_data(os.path.join("users_data", f"{username}.csv"), args.days, random.Random(username))
+    weights = parse_mix(args.mix)
+    builders = request_builders(args.days)
+    unknown = set(weights) - set(builders)
+    if unknown:
+        raise SystemExit(f"Unknown routes in traffic mix : {', '.join(sorted(unknown))}")
+    await app.router.startup()
+    try:
+        latencies, statuses, elapsed = await replay_traffic(app, users, builders, weights, args.requests, args.concurrency, args.seed)
+    finally:
+        await app.router.shutdown()
+    return build_report(latencies, statuses, elapsed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a synthetic traffic mix against the ASGI application.")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--days", type=int, default=90, help="Days of synthetic history per user")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Route weights (default : {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the report as JSON to this file, to compare builds")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    work_dir = tempfile.mkdtemp(prefix="flapi_loadtest_")
+    # The application reads its database URL at import time and its data relatively to the working directory
+    os.environ["DB_URL"] = f"sqlite:///{os.path.join(work_dir, 'loadtest.sqlite')}"
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(work_dir)
+    os.makedirs("users_data")
+    report = asyncio.run(main(args))
+    print_report(report)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,54 @@
+"""Queries and time spent by the login path (POST /token) on an in-memory database.
+
+Compares the former path (user fetched again by add_new_token, signature read on every
+token) with the current one (authenticated user handed over, cached signature).
+
+    python -m benchmarks.login_queries --logins 2000
+"""
+import argparse
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models.database import Base, SecretSignature
+import utils
+
+def login(db, username: str, password: str, reuse_user: bool):
+    user = utils.get_user(db, username, password)
+    firstname, lastname = username.split("_")
+    if reuse_user:
+        return utils.add_new_token(db, firstname, lastname, password, True, True, True, True, user=user)
+    utils.invalidate_signature_cache()
+    return utils.add_new_token(db, firstname, lastname, password, True, True, True, True)
+
+def measure(n_logins: int, reuse_user: bool):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    db.add(SecretSignature(secret_value="benchmark", generation_date=datetime.now()))
+    db.commit()
+    utils.add_new_user(db, "Bench", "Mark", "bench@example.com", "password")
+    utils.invalidate_signature_cache()
+    executed = []
+    event.listen(engine, "before_cursor_execute", lambda *args: executed.append(1))
+    start = time.perf_counter()
+    for _ in range(n_logins):
+        login(db, "Bench_Mark", "password", reuse_user)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return len(executed) / n_logins, elapsed / n_logins * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the database work of the login path.")
+    parser.add_argument("--logins", type=int, default=1000)
+    args = parser.parse_args()
+
+    before_queries, before_ms = measure(args.logins, reuse_user=False)
+    after_queries, after_ms = measure(args.logins, reuse_user=True)
+    print(f"{'':<28}{'queries/login':>15}{'ms/login':>10}")
+    print(f"{'user re-fetched, no cache':<28}{before_queries:>15.2f}{before_ms:>10.3f}")
+    print(f"{'user reused, cached secret':<28}{after_queries:>15.2f}{after_ms:>10.3f}")
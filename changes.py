@@ -0,0 +1,87 @@
+import fcntl
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from series import SampleSeries
+
+# A sample is identified by its date and its device, its value is part of the key so a corrected value is logged again
+KEY_DTYPE = np.dtype([("timestamp", np.int64), ("device", np.int32), ("value", np.float64)])
+
+class ChangeLog:
+    """Samples of a user as (sampling date, device, value), in the order they were first ingested.
+
+    The sequence number of a sample is its position in the log + 1, so the samples
+    ingested after a cursor are a slice of the log. A sample whose value is changed by an
+    upload is logged again, its former entry no longer matches any sample and is skipped
+    like the samples removed by an upload.
+    """
+    def __init__(self, keys: np.ndarray, devices: List[Tuple[str, str]]) -> None:
+        self.keys = keys
+        # (device name, serial number) of the device codes of the keys
+        self.devices = devices
+
+    @property
+    def cursor(self) -> int:
+        return len(self.keys)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.keys["timestamp"]
+
+    def since(self, cursor: int, limit: Optional[int] = None) -> "ChangeLog":
+        return ChangeLog(self.keys[cursor:] if limit is None else self.keys[cursor:cursor + limit], self.devices)
+
+def read_change_log(path: str) -> ChangeLog:
+    try:
+        with np.load(path) as f:
+            return ChangeLog(f["keys"], [tuple(d) for d in f["devices"].tolist()])
+    except FileNotFoundError:
+        return ChangeLog(np.empty(0, dtype=KEY_DTYPE), [])
+
+def series_keys(series: SampleSeries, devices: List[Tuple[str, str]]) -> np.ndarray:
+    # Keys of the samples of the series, the devices missing from the log are appended to it
+    codes = {device: i for i, device in enumerate(devices)}
+    log_codes = np.array([codes.setdefault(device, len(codes)) for device in series.devices], dtype=np.int32)
+    devices[:] = list(codes)
+    keys = np.empty(len(series), dtype=KEY_DTYPE)
+    keys["timestamp"] = series.timestamps
+    keys["device"] = log_codes[series.device_codes] if len(log_codes) else 0
+    keys["value"] = series.values
+    return keys
+
+def update_change_log(path: str, series: SampleSeries) -> ChangeLog:
+    """Appends the samples never ingested before, in date order."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Server workers may load or ingest the data of the same user at the same time
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        log = read_change_log(path)
+        devices = list(log.devices)
+        keys = series_keys(series, devices)
+        new = np.unique(keys[~np.isin(keys, log.keys)])
+        if len(new) == 0:
+            return log
+        log = ChangeLog(np.concatenate((log.keys, new)), devices)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, keys=log.keys, devices=np.array(devices, dtype=str).reshape(-1, 2))
+        os.replace(path + ".tmp", path)
+    return log
+
+def lookup(series: SampleSeries, log: ChangeLog) -> np.ndarray:
+    # Index in the series of each entry of the log, -1 for the samples since removed or changed by an upload
+    res = np.full(len(log.keys), -1)
+    if len(series) == 0:
+        return res
+    series_codes = {device: i for i, device in enumerate(series.devices)}
+    device_codes = np.array([series_codes.get(device, -1) for device in log.devices], dtype=np.int32)
+    timestamps, devices, values = log.keys["timestamp"], device_codes[log.keys["device"]], log.keys["value"]
+    lo = np.searchsorted(series.timestamps, timestamps, side="left")
+    hi = np.searchsorted(series.timestamps, timestamps, side="right")
+    # Samples of several devices may share a sampling date, each of them is tried
+    for offset in range(int((hi - lo).max(initial=0))):
+        indices = np.minimum(lo + offset, len(series) - 1)
+        found = (res < 0) & (lo + offset < hi) & (series.device_codes[indices] == devices) & (series.values[indices] == values)
+        res[found] = indices[found]
+    return res
@@ -8,27 +8,78 @@ from pandera.errors import SchemaError
 
 from models.resources import BloodGlucoseSample, Stats
 from data_validation import convert_insulin, user_data_schema
+import tracing
 class SourceType(Enum):
     CSVfile = 'CSVfile'
     sourceUri = 'sourceUri'
 
-def samples_from_csv(data_from: str = SourceType.CSVfile, **query_parameters) -> Optional[List[BloodGlucoseSample]]:
-    res: List[BloodGlucoseSample] = []
-    if data_from == SourceType.CSVfile:
-        df = pd.read_csv(query_parameters["filepath"], sep=',', header=1, parse_dates=[2], date_format="%d-%m-%Y %H:%M", low_memory=False, converters={
-        "Insuline à action longue (unités)": convert_insulin,
-        "Insuline à action rapide (unités)": convert_insulin,
-        })
+# Normalized names of the record columns kept in memory and exported
+RECORD_COLUMNS = {
+    "Horodatage de l'appareil": "sampling_date",
+    "Appareil": "device_name",
+    "Numéro de série": "device_serial_number",
+    "Type d'enregistrement": "record_type",
+    "Historique de la glycémie mg/dL": "glucose_history",
+    "Numérisation de la glycémie mg/dL": "glucose_scan",
+    "Glycémie par bandelette mg/dL": "strip_glucose",
+    "Cétone mmol/L": "ketone",
+    "Insuline à action rapide (unités)": "rapid_insulin",
+    "Insuline à action rapide sans valeur numérique": "rapid_insulin_no_value",
+    "Insuline à action longue (unités)": "long_insulin",
+    "Insuline à action longue sans valeur numérique": "long_insulin_no_value",
+    "Insuline repas (unités)": "meal_insulin",
+    "Correction insuline (unités)": "correction_insulin",
+    "Insuline modifiée par l'utilisateur (unités)": "user_modified_insulin",
+    "Glucides (grammes)": "carbohydrates",
+    "Glucides (portions)": "carbohydrate_portions",
+    "Alimentation sans valeur numérique": "food_no_value",
+    "Remarques": "notes",
+}
+# Columns holding the value of a record, the others describe it
+RECORD_IDENTITY_COLUMNS = ["sampling_date", "device_name", "device_serial_number", "record_type"]
+
+@tracing.traced("csv_data.read_csv")
+def parse_user_frame(filepath) -> pd.DataFrame:
+    return pd.read_csv(filepath, sep=',', header=1, parse_dates=[2], date_format="%d-%m-%Y %H:%M", low_memory=False, converters={
+    "Insuline à action longue (unités)": convert_insulin,
+    "Insuline à action rapide (unités)": convert_insulin,
+    })
+
+def read_user_frame(filepath) -> Optional[pd.DataFrame]:
+    df = parse_user_frame(filepath)
+    with tracing.span("data_validation.validate", rows=len(df)):
         try:
             user_data_schema.validate(df)
         except SchemaError:
             return None
-        glucose_samples = df.iloc[:, :5].dropna()
-        glucose_samples.sort_values(inplace=True, by="Horodatage de l'appareil")
-        return [
-            BloodGlucoseSample(device_name=s[0], device_serial_number=s[1], sampling_date=s[2].to_pydatetime(), value=s[4])
-            for s in glucose_samples.values.tolist()
-        ]
+    return df
+
+@tracing.traced("csv_data.samples_from_frame")
+def samples_from_frame(df: pd.DataFrame) -> List[BloodGlucoseSample]:
+    glucose_samples = df.iloc[:, :5].dropna()
+    glucose_samples = glucose_samples.sort_values(by="Horodatage de l'appareil")
+    return [
+        BloodGlucoseSample(device_name=s[0], device_serial_number=s[1], sampling_date=s[2].to_pydatetime(), value=s[4])
+        for s in glucose_samples.values.tolist()
+    ]
+
+@tracing.traced("csv_data.records_from_frame")
+def records_from_frame(df: pd.DataFrame) -> pd.DataFrame:
+    records = df[list(RECORD_COLUMNS)].rename(columns=RECORD_COLUMNS)
+    # Sensor history first, scans otherwise
+    records.insert(4, "glucose", records["glucose_history"].fillna(records["glucose_scan"]))
+    records["ketone"] = pd.to_numeric(records["ketone"].astype("string").str.replace(",", "."), errors="coerce")
+    value_columns = [c for c in records.columns if c not in RECORD_IDENTITY_COLUMNS]
+    records = records.dropna(subset=value_columns, how="all")
+    return records.sort_values(by="sampling_date", kind="stable").reset_index(drop=True)
+
+def samples_from_csv(data_from: str = SourceType.CSVfile, **query_parameters) -> Optional[List[BloodGlucoseSample]]:
+    res: List[BloodGlucoseSample] = []
+    if data_from == SourceType.CSVfile:
+        df = read_user_frame(query_parameters["filepath"])
+        if df is None:
+            return None
+        return samples_from_frame(df)
     elif data_from == SourceType.sourceUri:
         pass
     else:
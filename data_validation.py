@@ -1,3 +1,5 @@
+from typing import Dict, List, Optional
+
 from fastapi import HTTPException, UploadFile, status
 import numpy as np
 import pandas as pd
@@ -5,6 +7,8 @@ import pandera as pa
 from pandera.errors import SchemaError, SchemaErrors
 from io import BytesIO
 
+import tracing
+
 class InvalidDataException(Exception):
     """Exception class for invalid data :
     - invalid syntax
@@ -46,24 +50,34 @@ def convert_insulin(value: str) -> np.float64:
         v_formatted = value.replace(",", ".")
         return np.float64(float(v_formatted))
 
-async def validate_data_from_upload(file: UploadFile):
-    bytes_data = await file.read()
-    df = pd.read_csv(BytesIO(bytes_data), header=1, low_memory=False, converters={
+@tracing.traced("data_validation.read_csv")
+def dataframe_from_bytes(bytes_data: bytes) -> pd.DataFrame:
+    return pd.read_csv(BytesIO(bytes_data), header=1, low_memory=False, converters={
         "Insuline à action longue (unités)": convert_insulin,
         "Insuline à action rapide (unités)": convert_insulin,
         }
     )
+
+@tracing.traced("data_validation.validate")
+def validation_errors(df: pd.DataFrame) -> Optional[Dict[str, list]]:
     try:
         user_data_schema.validate(df, lazy=True)
     except SchemaErrors as e:
         column_names: List[str] = list(e.failure_cases['column'])
+        return {
+            "column_name": column_names,
+            "errors": [err.value for err in e.error_counts],
+            "failure_cases": [str(err.failure_cases['failure_case'][0]) for err in e.schema_errors],
+        }
+    return None
+
+async def validate_data_from_upload(file: UploadFile):
+    bytes_data = await file.read()
+    errors = validation_errors(dataframe_from_bytes(bytes_data))
+    if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail={
-                "column_name": column_names,
-                "errors": [err.value for err in e.error_counts],
-                "failure_cases": [str(err.failure_cases['failure_case'][0]) for err in e.schema_errors],
-            }
+            detail=errors
         )
     return bytes_data
 
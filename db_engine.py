@@ -0,0 +1,59 @@
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+
+import env
+
+ALEMBIC_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Only takes effect on a new database, and must come before WAL (see maintenance.incremental_vacuum)
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # WAL lets readers go on while a request commits, NORMAL is durable enough with WAL
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(env.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(env.SQLITE_MMAP_SIZE)}")
+    cursor.close()
+
+def create_db_engine(url: str = env.SQLALCHEMY_DATABASE_URL) -> Engine:
+    db_url = make_url(url)
+    if db_url.get_backend_name() == "sqlite":
+        if db_url.database in (None, "", ":memory:"):
+            # Every connection would get its own in-memory database
+            return create_engine(url, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": env.SQLITE_BUSY_TIMEOUT_MS / 1000},
+            poolclass=QueuePool,
+            pool_size=env.DB_POOL_SIZE,
+            max_overflow=env.DB_MAX_OVERFLOW,
+            pool_timeout=env.DB_POOL_TIMEOUT_S,
+        )
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        return engine
+    # Server databases : connections can be dropped by the server or a proxy
+    return create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=env.DB_POOL_SIZE,
+        max_overflow=env.DB_MAX_OVERFLOW,
+        pool_timeout=env.DB_POOL_TIMEOUT_S,
+        pool_recycle=env.DB_POOL_RECYCLE_S,
+        pool_pre_ping=True,
+    )
+
+def upgrade_schema(engine: Engine) -> None:
+    # Same as `alembic upgrade head`, a fresh database gets the current schema
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_CONFIG_PATH)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_CONFIG_PATH), "alembic"))
+    with engine.connect() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+        connection.commit()
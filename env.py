@@ -4,4 +4,62 @@ from typing import Literal
 PORT = os.getenv('PORT', "8000")
 SQLALCHEMY_DATABASE_URL = os.getenv('DB_URL', "sqlite:///./db.sqlite")
 FRONT_END_APP_URI = os.getenv('FRONT_END_APP_URI', "http://localhost:3000")
-ENVIRONNEMENT: Literal['DEV', 'PROD'] = os.getenv('FLAPI_ENV', 'DEV')
\ No newline at end of file
+ENVIRONNEMENT: Literal['DEV', 'PROD'] = os.getenv('FLAPI_ENV', 'DEV')
+WORKER_PROCESSES = int(os.getenv('FLAPI_WORKER_PROCESSES', "2"))
+WARMUP_ENABLED = os.getenv('FLAPI_WARMUP', "false").lower() == "true"
+WARMUP_USERS = int(os.getenv('FLAPI_WARMUP_USERS', "20"))
+WORKER_QUEUE_SIZE = int(os.getenv('FLAPI_WORKER_QUEUE_SIZE', "16"))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv('FLAPI_LOOP_LAG_THRESHOLD_MS', "100"))
+LOOP_LAG_HISTORY = int(os.getenv('FLAPI_LOOP_LAG_HISTORY', "200"))
+HEAVY_ROUTES_CONCURRENCY = int(os.getenv('FLAPI_HEAVY_ROUTES_CONCURRENCY', str(os.cpu_count() or 2)))
+HEAVY_ROUTES_QUEUE_SIZE = int(os.getenv('FLAPI_HEAVY_ROUTES_QUEUE_SIZE', "8"))
+HEAVY_ROUTES_QUEUE_DEADLINE_MS = int(os.getenv('FLAPI_HEAVY_ROUTES_QUEUE_DEADLINE_MS', "2000"))
+HEAVY_ROUTES_RETRY_AFTER = int(os.getenv('FLAPI_HEAVY_ROUTES_RETRY_AFTER', "5"))
+PURGE_INTERVAL_HOURS = float(os.getenv('FLAPI_PURGE_INTERVAL_HOURS', "24"))
+PURGE_BATCH_SIZE = int(os.getenv('FLAPI_PURGE_BATCH_SIZE', "500"))
+PURGE_VACUUM_PAGES = int(os.getenv('FLAPI_PURGE_VACUUM_PAGES', "2000"))
+SIGNATURE_CACHE_TTL_S = float(os.getenv('FLAPI_SIGNATURE_CACHE_TTL_S', "300"))
+EPISODE_LOW_THRESHOLD = float(os.getenv('FLAPI_EPISODE_LOW_THRESHOLD', "70"))
+EPISODE_HIGH_THRESHOLD = float(os.getenv('FLAPI_EPISODE_HIGH_THRESHOLD', "180"))
+EPISODE_MIN_DURATION_MINUTES = int(os.getenv('FLAPI_EPISODE_MIN_DURATION_MINUTES', "15"))
+EPISODE_MAX_GAP_MINUTES = int(os.getenv('FLAPI_EPISODE_MAX_GAP_MINUTES', "30"))
+DB_POOL_SIZE = int(os.getenv('FLAPI_DB_POOL_SIZE', "5"))
+DB_MAX_OVERFLOW = int(os.getenv('FLAPI_DB_MAX_OVERFLOW', "10"))
+DB_POOL_TIMEOUT_S = float(os.getenv('FLAPI_DB_POOL_TIMEOUT_S', "30"))
+DB_POOL_RECYCLE_S = int(os.getenv('FLAPI_DB_POOL_RECYCLE_S', "1800"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('FLAPI_SQLITE_BUSY_TIMEOUT_MS', "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv('FLAPI_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+TRACING_ENABLED = os.getenv('FLAPI_TRACING', "false").lower() == "true"
+# Spans are kept in memory for /admin/traces, and also appended to this JSONL file when set
+TRACING_FILE = os.getenv('FLAPI_TRACING_FILE', "")
+TRACING_RING_SIZE = int(os.getenv('FLAPI_TRACING_RING_SIZE', "2000"))
+QUERY_STATS_ENABLED = os.getenv('FLAPI_QUERY_STATS', "true").lower() == "true"
+# Identical statements run at least this many times by one request are reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv('FLAPI_N_PLUS_ONE_THRESHOLD', "3"))
+BATCH_MAX_USERS = int(os.getenv('FLAPI_BATCH_MAX_USERS', "100"))
+# User data loaded at the same time by one batch request, the others wait for a slot
+BATCH_LOAD_CONCURRENCY = int(os.getenv('FLAPI_BATCH_LOAD_CONCURRENCY', str(WORKER_PROCESSES)))
+# Samples of the last days of a user are kept in memory, older months are archived on disk
+HOT_RETENTION_DAYS = int(os.getenv('FLAPI_HOT_RETENTION_DAYS', "90"))
+ARCHIVES_DIR = os.getenv('FLAPI_ARCHIVES_DIR', "users_archives")
+# Hot window set by the admins at runtime, shared by the server workers
+TIERING_SETTINGS_PATH = os.getenv('FLAPI_TIERING_SETTINGS_PATH', "tiering_settings.json")
+# Ingest order of the samples of each user, for the changes feed
+CHANGES_DIR = os.getenv('FLAPI_CHANGES_DIR', "users_changes")
+# Status of the ingest jobs, shared by the server workers
+INGEST_JOBS_DIR = os.getenv('FLAPI_INGEST_JOBS_DIR', "users_ingest_jobs")
+# Event streams of the users (SSE) : connections accepted by each server worker
+SSE_MAX_CONNECTIONS = int(os.getenv('FLAPI_SSE_MAX_CONNECTIONS', "1000"))
+SSE_MAX_CONNECTIONS_PER_USER = int(os.getenv('FLAPI_SSE_MAX_CONNECTIONS_PER_USER', "5"))
+# Events waiting for a slow client before it is disconnected, it resumes from its last event when it reconnects
+SSE_QUEUE_SIZE = int(os.getenv('FLAPI_SSE_QUEUE_SIZE', "100"))
+SSE_HEARTBEAT_S = float(os.getenv('FLAPI_SSE_HEARTBEAT_S', "15"))
+SSE_SAMPLES_PER_EVENT = int(os.getenv('FLAPI_SSE_SAMPLES_PER_EVENT', "1000"))
+# Windows returned by one rolling stats request
+ROLLING_MAX_WINDOWS = int(os.getenv('FLAPI_ROLLING_MAX_WINDOWS', "10000"))
+# Production server (server.py) : workers forked from a process which preloaded the application
+SERVER_WORKERS = int(os.getenv('FLAPI_SERVER_WORKERS', "1"))
+# Requests served by a worker before it is replaced (0 : never), with a random jitter so they don't restart together
+SERVER_MAX_REQUESTS = int(os.getenv('FLAPI_SERVER_MAX_REQUESTS', "0"))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv('FLAPI_SERVER_MAX_REQUESTS_JITTER', "0"))
+SERVER_GRACEFUL_TIMEOUT_S = float(os.getenv('FLAPI_SERVER_GRACEFUL_TIMEOUT_S', "30"))
@@ -0,0 +1,64 @@
+from datetime import datetime
+from typing import Dict, Tuple
+
+import numpy as np
+
+import env
+from series import SampleSeries, to_ns
+
+EPISODE_KINDS = ["hypo", "hyper"]
+
+class EpisodeIndex:
+    """Episodes of one kind sorted by start date.
+
+    Episodes never overlap, so their ends are sorted too and the episodes
+    overlapping a date range are found with two binary searches.
+    """
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, extremes: np.ndarray, samples_sizes: np.ndarray) -> None:
+        self.starts = starts
+        self.ends = ends
+        # Nadir of hypo episodes, peak of hyper episodes
+        self.extremes = extremes
+        self.samples_sizes = samples_sizes
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def range_bounds(self, start: datetime = None, end: datetime = None) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.ends, to_ns(start), side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.starts, to_ns(end), side="right"))
+        return lo, max(lo, hi)
+
+def runs(mask: np.ndarray, breaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Run-length encoding of the True values of mask, also split wherever breaks is True
+    # (breaks[i] : sample i does not follow sample i - 1). Returns [start, stop) indices.
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    split = np.flatnonzero(mask & breaks)
+    split = split[~np.isin(split, starts)]
+    return np.sort(np.concatenate((starts, split))), np.sort(np.concatenate((stops, split)))
+
+def detect_episodes(series: SampleSeries, low: float = None, high: float = None,
+                    min_duration_minutes: int = None, max_gap_minutes: int = None) -> Dict[str, EpisodeIndex]:
+    low = env.EPISODE_LOW_THRESHOLD if low is None else low
+    high = env.EPISODE_HIGH_THRESHOLD if high is None else high
+    min_duration_ns = (env.EPISODE_MIN_DURATION_MINUTES if min_duration_minutes is None else min_duration_minutes) * 60 * 10**9
+    max_gap_ns = (env.EPISODE_MAX_GAP_MINUTES if max_gap_minutes is None else max_gap_minutes) * 60 * 10**9
+    timestamps, values = series.timestamps, series.values
+    # A sensor gap ends an episode
+    breaks = np.diff(timestamps, prepend=timestamps[:1]) > max_gap_ns
+    index = {}
+    for kind, mask, extreme in (("hypo", values < low, np.minimum), ("hyper", values > high, np.maximum)):
+        starts, stops = runs(mask, breaks)
+        ends = stops - 1
+        long_enough = timestamps[ends] - timestamps[starts] >= min_duration_ns
+        starts, stops, ends = starts[long_enough], stops[long_enough], ends[long_enough]
+        index[kind] = EpisodeIndex(
+            timestamps[starts],
+            timestamps[ends],
+            # Reduce over each [start, stop) slice, the padding keeps stop indices in bounds
+            extreme.reduceat(np.append(values, 0), np.ravel([starts, stops], order="F"))[::2] if len(starts) else np.empty(0),
+            stops - starts
+        )
+    return index
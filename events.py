@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from series import SampleSeries, to_ns
+
+# Record columns turned into event streams, see csv_data.RECORD_COLUMNS
+NUMERIC_STREAMS = [
+    "glucose_history", "glucose_scan", "strip_glucose", "ketone",
+    "rapid_insulin", "long_insulin", "meal_insulin", "correction_insulin", "user_modified_insulin",
+    "carbohydrates", "carbohydrate_portions",
+]
+TEXT_STREAMS = ["rapid_insulin_no_value", "long_insulin_no_value", "food_no_value", "notes"]
+
+class EventStream:
+    """Events of one record type : sorted int64 nanoseconds timestamps and their values."""
+    def __init__(self, timestamps: np.ndarray, values: np.ndarray) -> None:
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def range_bounds(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.timestamps, to_ns(start), side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.timestamps, to_ns(end), side="right"))
+        return lo, hi
+
+def concat_streams(first: Dict[str, EventStream], second: Dict[str, EventStream]) -> Dict[str, EventStream]:
+    # Streams of consecutive date ranges, first before second
+    return {
+        name: EventStream(np.concatenate((first[name].timestamps, stream.timestamps)), np.concatenate((first[name].values, stream.values)))
+        for name, stream in second.items()
+    }
+
+def event_streams_from_records(records: pd.DataFrame) -> Dict[str, EventStream]:
+    # Records are sorted by date, so is every stream
+    timestamps = records["sampling_date"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    streams = {}
+    for name in NUMERIC_STREAMS + TEXT_STREAMS:
+        present = records[name].notna().to_numpy()
+        column = records[name][present]
+        values = column.to_numpy(dtype=np.float64) if name in NUMERIC_STREAMS else column.astype(str).to_numpy(dtype=object)
+        streams[name] = EventStream(timestamps[present], values)
+    return streams
+
+def meal_responses(carbohydrates: EventStream, glucose: SampleSeries, insulin: EventStream,
+                   hours: float, baseline_tolerance_minutes: int = 30, insulin_window_minutes: int = 30) -> Dict[str, np.ndarray]:
+    """Glucose response to each carbohydrate entry, all meals at once.
+
+    - baseline : last glucose value at most `baseline_tolerance_minutes` before the meal (as-of join)
+    - peak : highest glucose value in (meal, meal + hours]
+    - rapid insulin : units injected within `insulin_window_minutes` around the meal
+    """
+    minute_ns = 60 * 10**9
+    meals = carbohydrates.timestamps
+    g_ts, g_values = glucose.timestamps, glucose.values
+    # As-of join : index of the last glucose value at or before each meal
+    before = np.searchsorted(g_ts, meals, side="right") - 1
+    has_baseline = (before >= 0) & (meals - g_ts[np.maximum(before, 0)] <= baseline_tolerance_minutes * minute_ns)
+    baseline = np.where(has_baseline, g_values[np.maximum(before, 0)], np.nan)
+    # Post-meal windows gathered as a (meals x longest window) matrix
+    lo = before + 1
+    hi = np.searchsorted(g_ts, meals + int(hours * 60 * minute_ns), side="right")
+    width = int((hi - lo).max()) if len(meals) else 0
+    offsets = lo[:, None] + np.arange(max(width, 1))[None, :]
+    in_window = offsets < hi[:, None]
+    window_values = np.where(in_window, g_values[np.minimum(offsets, len(g_values) - 1)], -np.inf)
+    peak_position = np.argmax(window_values, axis=1)
+    has_peak = hi > lo
+    peak = np.where(has_peak, window_values[np.arange(len(meals)), peak_position], np.nan)
+    peak_ts = g_ts[np.minimum(lo + peak_position, len(g_ts) - 1)]
+    peak_delay = np.where(has_peak, (peak_ts - meals) / minute_ns, np.nan)
+    # Insulin total around each meal from the cumulative sum of injections
+    insulin_sums = np.concatenate(([0.0], np.cumsum(insulin.values)))
+    insulin_lo = np.searchsorted(insulin.timestamps, meals - insulin_window_minutes * minute_ns, side="left")
+    insulin_hi = np.searchsorted(insulin.timestamps, meals + insulin_window_minutes * minute_ns, side="right")
+    return {
+        "meal_dates": meals,
+        "carbohydrates": carbohydrates.values,
+        "baseline": baseline,
+        "peak": peak,
+        "delta": peak - baseline,
+        "peak_delay_minutes": peak_delay,
+        "rapid_insulin": insulin_sums[insulin_hi] - insulin_sums[insulin_lo],
+    }
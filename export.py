@@ -0,0 +1,75 @@
+from io import BytesIO, StringIO
+from typing import Iterator
+
+import pandas as pd
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+class MissingExportDependency(Exception):
+    def __init__(self, message) -> None:
+        super().__init__(message)
+
+def ndjson_chunks(records: pd.DataFrame, chunk_size: int) -> Iterator[bytes]:
+    for i in range(0, len(records), chunk_size):
+        yield records.iloc[i:i + chunk_size].to_json(orient="records", lines=True, date_format="iso").encode("utf-8")
+
+def csv_chunks(records: pd.DataFrame, chunk_size: int) -> Iterator[bytes]:
+    for i in range(0, len(records), chunk_size):
+        buffer = StringIO()
+        records.iloc[i:i + chunk_size].to_csv(buffer, header=(i == 0), index=False, date_format="%Y-%m-%dT%H:%M:%S")
+        yield buffer.getvalue().encode("utf-8")
+    if len(records) == 0:
+        yield (",".join(records.columns) + "\n").encode("utf-8")
+
+def arrow_table(records: pd.DataFrame):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise MissingExportDependency("Parquet and Arrow exports require the pyarrow package.")
+    return pa.Table.from_pandas(records, preserve_index=False)
+
+def arrow_chunks(records: pd.DataFrame, chunk_size: int) -> Iterator[bytes]:
+    import pyarrow as pa
+    table = arrow_table(records)
+    buffer = BytesIO()
+    # Each record batch is sent as soon as it is written
+    with pa.ipc.new_stream(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            writer.write_batch(batch)
+            yield pop_buffer(buffer)
+    yield pop_buffer(buffer)
+
+def parquet_chunks(records: pd.DataFrame, chunk_size: int) -> Iterator[bytes]:
+    import pyarrow.parquet as pq
+    table = arrow_table(records)
+    buffer = BytesIO()
+    # One row group per chunk, the footer is written when the writer is closed
+    with pq.ParquetWriter(buffer, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            writer.write_batch(batch)
+            yield pop_buffer(buffer)
+    yield pop_buffer(buffer)
+
+def pop_buffer(buffer: BytesIO) -> bytes:
+    content = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return content
+
+EXPORTERS = {
+    "ndjson": ndjson_chunks,
+    "csv": csv_chunks,
+    "parquet": parquet_chunks,
+    "arrow": arrow_chunks,
+}
+
+def export_chunks(records: pd.DataFrame, export_format: str, chunk_size: int) -> Iterator[bytes]:
+    if export_format in ("parquet", "arrow"):
+        # Fails before the response starts rather than in the middle of the stream
+        arrow_table(records.iloc[:0])
+    return EXPORTERS[export_format](records, chunk_size)
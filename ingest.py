@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from router_dependencies import store_user_data, forget_user_data, refresh_tiering_settings
+from models import resources
+import notifications, tiering, workers
+import env
+
+# Number of finished jobs kept per user for status polling
+FINISHED_JOBS_KEPT = 20
+
+user_locks: Dict[str, asyncio.Lock] = {}
+running_tasks: Set[asyncio.Task] = set()
+
+# Jobs are stored as files : the status of a job may be polled from any server worker
+def job_path(username: str, job_id: str) -> str:
+    return os.path.join(env.INGEST_JOBS_DIR, username, job_id + ".json")
+
+def save_job(job: resources.IngestJob) -> None:
+    path = job_path(job.username, job.job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(job.json())
+    os.replace(tmp_path, path)
+
+def get_ingest_job(username: str, job_id: str) -> Optional[resources.IngestJob]:
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return None
+    try:
+        return resources.IngestJob.parse_file(job_path(username, job_id))
+    except FileNotFoundError:
+        return None
+
+def get_user_jobs(username: str) -> List[resources.IngestJob]:
+    try:
+        filenames = os.listdir(os.path.join(env.INGEST_JOBS_DIR, username))
+    except FileNotFoundError:
+        return []
+    jobs = [get_ingest_job(username, f[:-len(".json")]) for f in filenames if f.endswith(".json")]
+    return sorted((job for job in jobs if job), key=lambda job: job.submitted_at)
+
+def forget_finished_jobs(username: str, jobs: List[resources.IngestJob]) -> None:
+    finished = [job for job in jobs if job.status not in (resources.IngestStatus.pending, resources.IngestStatus.running)]
+    for job in finished[:max(len(finished) - FINISHED_JOBS_KEPT, 0)]:
+        try:
+            os.remove(job_path(username, job.job_id))
+        except FileNotFoundError:
+            pass
+
+def submit_ingest_job(username: str, bytes_data: bytes) -> resources.IngestJob:
+    content_hash = hashlib.sha256(bytes_data).hexdigest()
+    jobs = get_user_jobs(username)
+    for job in jobs:
+        if job.status in (resources.IngestStatus.pending, resources.IngestStatus.running) and job.content_hash == content_hash:
+            # Same file already on its way : no need to process it twice
+            return job
+    for job in jobs:
+        if job.status == resources.IngestStatus.pending:
+            # Each upload replaces the whole file so an older pending upload would be overwritten anyway
+            job.status = resources.IngestStatus.superseded
+            job.finished_at = datetime.now()
+            save_job(job)
+    job = resources.IngestJob(
+        job_id=uuid.uuid4().hex,
+        username=username,
+        status=resources.IngestStatus.pending,
+        content_hash=content_hash,
+        submitted_at=datetime.now()
+    )
+    save_job(job)
+    forget_finished_jobs(username, jobs)
+    task = asyncio.get_running_loop().create_task(run_ingest_job(job, bytes_data))
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+    return job
+
+async def run_ingest_job(job: resources.IngestJob, bytes_data: bytes) -> None:
+    # Uploads of the same user are processed one at a time, in submission order
+    async with user_locks.setdefault(job.username, asyncio.Lock()):
+        # Superseded in the meantime, possibly by an upload to another server worker
+        stored_job = get_ingest_job(job.username, job.job_id)
+        if stored_job is None or stored_job.status != resources.IngestStatus.pending:
+            return
+        job.status = resources.IngestStatus.running
+        job.started_at = datetime.now()
+        save_job(job)
+        refresh_tiering_settings()
+        try:
+            res: resources.IngestResult = await workers.run_in_executor(
+                workers.ingest_user_file,
+                workers.user_data_path(job.username), bytes_data,
+                workers.user_archives_path(job.username), tiering.retention_days, workers.user_changes_path(job.username)
+            )
+        except Exception as e:
+            job.status = resources.IngestStatus.failed
+            job.validation_errors = {"errors": [str(e)]}
+            job.finished_at = datetime.now()
+            save_job(job)
+            return
+        job.rows_count = res.rows_count
+        if res.validation_errors:
+            job.status = resources.IngestStatus.failed
+            job.validation_errors = res.validation_errors
+        else:
+            job.status = resources.IngestStatus.completed
+            job.samples_count = len(res.data.samples) + (res.data.cold.samples_size if res.data.cold else 0)
+            if res.data.samples:
+                store_user_data(job.username, res.data)
+                notifications.notify_update(job.username)
+            else:
+                forget_user_data(job.username)
+        job.finished_at = datetime.now()
+        save_job(job)
+
+async def wait_for_pending_jobs() -> None:
+    if running_tasks:
+        await asyncio.gather(*running_tasks, return_exceptions=True)
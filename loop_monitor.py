@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+from datetime import datetime
+from typing import Deque, Optional, Tuple
+
+from models import resources
+import env
+
+logger = logging.getLogger("flapi.loop_monitor")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a heartbeat task.
+
+    A watchdog thread notices a heartbeat which is overdue while the loop is still blocked,
+    so it can tell which request and which line of code are holding it.
+    """
+    def __init__(self, threshold_ms: int, history_size: int) -> None:
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 2
+        self.spans: Deque[resources.LoopLagSpan] = deque(maxlen=history_size)
+        self.task_routes: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.last_beat = time.monotonic()
+        self.suspect: Optional[Tuple[Optional[str], Optional[str]]] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        if self.heartbeat_task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.stopped.clear()
+        self.heartbeat_task = self.loop.create_task(self.heartbeat())
+        threading.Thread(target=self.watchdog, name="loop_lag_watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+
+    def track_current_task(self, route: str) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.task_routes[task] = route
+
+    async def heartbeat(self) -> None:
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_beat = time.monotonic()
+            lag = self.last_beat - before - self.interval
+            suspect, self.suspect = self.suspect, None
+            if lag >= self.threshold:
+                route, location = suspect if suspect else (None, None)
+                span = resources.LoopLagSpan(
+                    detected_at=datetime.now(),
+                    duration_ms=round(lag * 1000, 1),
+                    route=route,
+                    location=location
+                )
+                self.spans.append(span)
+                logger.warning("Event loop blocked for %.1f ms by %s (%s)", span.duration_ms, route, location)
+
+    def watchdog(self) -> None:
+        while not self.stopped.wait(self.interval):
+            if self.suspect is None and time.monotonic() - self.last_beat > self.interval + self.threshold:
+                self.suspect = (self.blocking_route(), self.blocking_location())
+
+    def blocking_route(self) -> Optional[str]:
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return None
+        return self.task_routes.get(task) if task is not None else None
+
+    def blocking_location(self) -> Optional[str]:
+        frame = sys._current_frames().get(self.loop_thread_id)
+        # Innermost frame belonging to the application code rather than to a library
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(APP_DIR) and filename != __file__:
+                return f"{os.path.relpath(filename, APP_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+            frame = frame.f_back
+        return None
+
+class LoopMonitorMiddleware:
+    def __init__(self, app, monitor: LoopLagMonitor) -> None:
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.monitor.track_current_task(f"{scope['method']} {scope['path']}")
+        await self.app(scope, receive, send)
+
+loop_lag_monitor = LoopLagMonitor(env.LOOP_LAG_THRESHOLD_MS, env.LOOP_LAG_HISTORY)
@@ -1,9 +1,13 @@
-import uvicorn
+import os
 
 from router_dependencies import *
-import env
+import env, ingest, maintenance, warmup, workers
+from loop_monitor import LoopMonitorMiddleware, loop_lag_monitor
+from tracing import TracingMiddleware
+from query_stats import QueryStatsMiddleware
+from series import DateOutOfRange
 
-from routers import user, stats, auth, doc, pages
+from routers import user, stats, auth, doc, pages, health, admin
 
 app = FastAPI()
 
@@ -12,6 +16,12 @@ app.include_router(stats.router)
 app.include_router(auth.router)
 app.include_router(doc.router)
 app.include_router(pages.router)
+app.include_router(health.router)
+app.include_router(admin.router)
+
+@app.exception_handler(DateOutOfRange)
+async def date_out_of_range_handler(request: Request, exc: DateOutOfRange):
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +31,27 @@ app.add_middleware(
     allow_methods=['*'],
     allow_headers=['*']
 )
+app.add_middleware(LoopMonitorMiddleware, monitor=loop_lag_monitor)
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(TracingMiddleware)
+
+@app.on_event("startup")
+async def start_background_loading():
+    loop_lag_monitor.start()
+    # Only one worker of a multi-worker server runs the purge
+    if os.getenv("FLAPI_WORKER_ID", "0") == "0":
+        maintenance.start_purge_schedule()
+    if env.WARMUP_ENABLED:
+        warmup.start_warm_up()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    loop_lag_monitor.stop()
+    maintenance.stop_purge_schedule()
+    await ingest.wait_for_pending_jobs()
+    workers.shutdown_process_pool(wait=False)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=int(env.PORT))
\ No newline at end of file
+    # FLAPI_SERVER_WORKERS > 1 : preforked workers, see server.py
+    import server
+    server.serve()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from datetime import datetime as dt
+from typing import Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.orm import Session
+
+from router_dependencies import SessionLocal
+import models.database as db_models
+import models.resources as resources
+import env
+
+logger = logging.getLogger("flapi.maintenance")
+
+last_purge_report: Optional[resources.PurgeReport] = None
+purge_task: Optional[asyncio.Task] = None
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+def delete_in_batches(db: Session, model, condition, batch_size: int) -> int:
+    # Short transactions so that logins are not blocked for the whole purge
+    deleted = 0
+    while True:
+        ids = db.scalars(select(model.id).where(condition).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        db.execute(delete(model).where(model.id.in_(ids)), execution_options={"synchronize_session": False})
+        db.commit()
+        deleted += len(ids)
+
+def incremental_vacuum(db: Session, report: resources.PurgeReport, max_pages: int) -> None:
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    page_size = db.execute(text("PRAGMA page_size")).scalar()
+    free_pages = db.execute(text("PRAGMA freelist_count")).scalar()
+    report.auto_vacuum = AUTO_VACUUM_MODES.get(db.execute(text("PRAGMA auto_vacuum")).scalar())
+    # Other modes can not give pages back without a full VACUUM
+    if report.auto_vacuum != "incremental":
+        logger.warning("SQLite auto_vacuum is %s, free pages are not given back (run alembic upgrade head)", report.auto_vacuum)
+    else:
+        db.commit()
+        # A plain execute stops after the first page, executescript runs the pragma to completion
+        db.connection().connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        remaining_pages = db.execute(text("PRAGMA freelist_count")).scalar()
+        report.freed_pages = free_pages - remaining_pages
+        free_pages = remaining_pages
+    report.freed_bytes = report.freed_pages * page_size
+    report.reclaimable_bytes = free_pages * page_size
+
+def purge_expired_rows(db: Session, batch_size: int = env.PURGE_BATCH_SIZE, vacuum_pages: int = env.PURGE_VACUUM_PAGES) -> resources.PurgeReport:
+    global last_purge_report
+    now = dt.now()
+    report = resources.PurgeReport(started_at=now)
+    report.tokens_deleted = delete_in_batches(db, db_models.Auth, db_models.Auth.expiration_date < now, batch_size)
+    report.password_requests_deleted = delete_in_batches(
+        db, db_models.NewPasswordReq,
+        (db_models.NewPasswordReq.expiration_date < now) | (db_models.NewPasswordReq.change_applied == True),
+        batch_size
+    )
+    incremental_vacuum(db, report, vacuum_pages)
+    report.finished_at = dt.now()
+    last_purge_report = report
+    logger.info(
+        "Purged %d expired tokens and %d password requests, %d bytes freed",
+        report.tokens_deleted, report.password_requests_deleted, report.freed_bytes
+    )
+    return report
+
+def run_purge() -> resources.PurgeReport:
+    db = SessionLocal()
+    try:
+        return purge_expired_rows(db)
+    finally:
+        db.close()
+
+async def purge_periodically(interval_hours: float) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(run_purge)
+        except Exception:
+            logger.exception("Purge of expired rows failed")
+        await asyncio.sleep(interval_hours * 3600)
+
+def start_purge_schedule() -> None:
+    global purge_task
+    if purge_task is None and env.PURGE_INTERVAL_HOURS > 0:
+        purge_task = asyncio.get_running_loop().create_task(purge_periodically(env.PURGE_INTERVAL_HOURS))
+
+def stop_purge_schedule() -> None:
+    global purge_task
+    if purge_task is not None:
+        purge_task.cancel()
+        purge_task = None
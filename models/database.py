@@ -60,7 +60,7 @@ class Auth(Base):
     signature_used = Column(Integer, ForeignKey("secret_signature.id"), nullable=False)
     creation_date = Column(DateTime, nullable=False)
     token_value = Column(String, nullable=False, unique=True)
-    expiration_date = Column(DateTime, nullable=False)
+    expiration_date = Column(DateTime, nullable=False, index=True)
     last_time_used = Column(DateTime, nullable=False)
     user_profile_access = Column(Boolean, nullable=False, default=False)
     samples_access = Column(Boolean, nullable=False, default=False)
@@ -75,7 +75,7 @@ class NewPasswordReq(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("user.id"), nullable=False)
     change_req_id = Column(String, nullable=False)
-    expiration_date = Column(DateTime, nullable=False)
+    expiration_date = Column(DateTime, nullable=False, index=True)
     change_applied = Column(Boolean, nullable=False, default=False)
 
     user = relationship("User", back_populates="new_password_requests")
@@ -1,9 +1,11 @@
-from typing import Union, Callable, List, Optional, Tuple, Dict
+from typing import Any, Union, Callable, List, Optional, Set, Tuple, Dict
 from datetime import datetime, time, date
 from enum import Enum
 import statistics as stats
 
-from pydantic import BaseModel
+from pydantic import BaseModel, StrictFloat, validator
+
+import tracing
 
 class User(BaseModel):
     user_id: str
@@ -23,6 +25,10 @@ class UserDataStored(BaseModel):
     user_data_exists: bool
     last_update: Optional[datetime]
 
+class UserDataVersion(BaseModel):
+    etag: str
+    last_modified: datetime
+
 class UserDataFileUpdateResponse(BaseModel):
     message: str
 
@@ -91,11 +97,19 @@ class Trend(BaseModel):
     state: TrendState
     delta: float
 
+    @staticmethod
+    def computed(fields: Optional[Set[str]] = None) -> bool:
+        # The state and the delta are the only fields computed from the samples
+        return fields is None or bool(fields & {"state", "delta"})
+
 class HourTrend(Trend):
     hours_intervals: Tuple[datetime, datetime]
 
     @classmethod
-    def from_hours(cls, h1: datetime, h2: datetime, samples_collection: List[BloodGlucoseSample], error: int):
+    def from_hours(cls, h1: datetime, h2: datetime, samples_collection: List[BloodGlucoseSample], error: int, fields: Optional[Set[str]] = None):
+        if not cls.computed(fields):
+            # Only the interval was asked for, left unvalidated as the state and the delta are missing
+            return cls.construct(hours_intervals=(h1, h2))
         filtered_elements = list(filter(lambda e: h1 <= e.sampling_date <= h2, samples_collection))
         first_el, last_el = filtered_elements[0], filtered_elements[len(filtered_elements)-1]
         state = TrendState.steady
@@ -127,7 +141,9 @@ class MonthTrend(Trend):
     are_same_year: bool
 
     @classmethod
-    def from_months(cls, mth1: int, yr1: int, mth2: int, yr2: int, samples_collection: List[BloodGlucoseSample], error: int):
+    def from_months(cls, mth1: int, yr1: int, mth2: int, yr2: int, samples_collection: List[BloodGlucoseSample], error: int, fields: Optional[Set[str]] = None):
+        if not cls.computed(fields):
+            return cls.construct(month_start=(mth1, yr1), month_end=(mth2, yr2), are_same_year=yr1==yr2)
         # Comparing month and year values
         interval_fun: Callable[[BloodGlucoseSample], bool] = lambda e: mth1 <= e.sampling_date.month <= mth2 and yr1 <= e.sampling_date.year <= yr2
         filtered_elements = list(filter(interval_fun, samples_collection))
@@ -155,31 +171,104 @@ class Stats(BaseModel):
     median: Optional[Union[float, int]]
 
     @classmethod
-    def from_sample_collection(cls, sample_collection: List[BloodGlucoseSample]):
+    @tracing.traced("stats.from_sample_collection")
+    def from_sample_collection(cls, sample_collection: List[BloodGlucoseSample], fields: Optional[Set[str]] = None):
+        # Only the requested fields are computed, the others are left to None
+        def wanted(*names: str) -> bool:
+            return fields is None or any(name in fields for name in names)
         values = [s.value for s in sample_collection]
-        qts: list = stats.quantiles(values, n=4)
-        return cls(
-            time_range=(sample_collection[0].sampling_date, sample_collection[len(sample_collection)-1].sampling_date),
-            minimum=min(values),
-            maximum=max(values),
-            stat_range=max(values)-min(values),
-            mean=round(stats.fmean(values), 2),
-            variance=round(stats.pvariance(values), 2),
-            standard_deviation=round(stats.pstdev(values), 2),
-            overall_samples_size=len(values),
-            first_quartile=qts[0],
-            second_quartile=qts[1],
-            third_quartile=qts[2],
-            median=stats.median(values)
-        )
+        res = {}
+        if wanted("time_range"):
+            res["time_range"] = (sample_collection[0].sampling_date, sample_collection[len(sample_collection)-1].sampling_date)
+        if wanted("minimum", "maximum", "stat_range"):
+            res["minimum"], res["maximum"] = min(values), max(values)
+            res["stat_range"] = res["maximum"] - res["minimum"]
+        if wanted("mean"):
+            res["mean"] = round(stats.fmean(values), 2)
+        if wanted("variance"):
+            res["variance"] = round(stats.pvariance(values), 2)
+        if wanted("standard_deviation"):
+            res["standard_deviation"] = round(stats.pstdev(values), 2)
+        if wanted("overall_samples_size"):
+            res["overall_samples_size"] = len(values)
+        if wanted("first_quartile", "second_quartile", "third_quartile"):
+            qts: list = stats.quantiles(values, n=4)
+            res["first_quartile"], res["second_quartile"], res["third_quartile"] = qts
+        if wanted("median"):
+            res["median"] = stats.median(values)
+        return cls(**res)
     
     @classmethod
-    def from_all_users_samples(cls, all_users_samples: Dict[str, List[BloodGlucoseSample]]):
+    def from_all_users_samples(cls, all_users_samples: Dict[str, List[BloodGlucoseSample]], fields: Optional[Set[str]] = None):
         # Flatten the users collections
         flatten_collection = [sample for user_collection in all_users_samples.values() for sample in user_collection]
-        return cls.from_sample_collection(flatten_collection) 
+        return cls.from_sample_collection(flatten_collection, fields) 
         
 
+class MonthRollup(BaseModel):
+    month: date
+    samples_size: int
+    minimum: float
+    maximum: float
+    mean: float
+    standard_deviation: float
+
+class TieringSettings(BaseModel):
+    retention_days: int
+
+class SamplesChanges(BaseModel):
+    # A sample whose value was corrected is sent again, it replaces the one of the same date and device
+    samples: List[BloodGlucoseSample]
+    # To be given as since to get the next changes
+    cursor: int
+    has_more: bool
+
+class UsersBatchRequest(BaseModel):
+    usernames: List[str]
+    n_latest: int = 5
+
+class UserBatchResult(BaseModel):
+    username: str
+    stats: Optional[Stats] = None
+    latest_samples: Optional[List[BloodGlucoseSample]] = None
+    error: Optional[str] = None
+
+class RollingStats(BaseModel):
+    window_days: int
+    step_hours: int
+    window_ends: List[datetime]
+    samples_size: List[int]
+    mean: List[Optional[float]]
+    standard_deviation: List[Optional[float]]
+    gmi: List[Optional[float]]
+
+class Event(BaseModel):
+    date: datetime
+    # Strict : a note such as "12" stays a string
+    value: Union[StrictFloat, str]
+
+class MealResponse(BaseModel):
+    meal_date: datetime
+    carbohydrates: float
+    baseline: Optional[float]
+    peak: Optional[float]
+    delta: Optional[float]
+    peak_delay_minutes: Optional[float]
+    rapid_insulin: float
+
+class EpisodeKind(str, Enum):
+    hypo = "hypo"
+    hyper = "hyper"
+
+class Episode(BaseModel):
+    kind: EpisodeKind
+    start: datetime
+    end: datetime
+    duration_minutes: float
+    # Nadir of a hypo episode, peak of a hyper episode
+    extreme_value: float
+    samples_size: int
+
 class GoalType(Enum):
     sample = 'sample'
     stats = 'stats'
@@ -218,6 +307,20 @@ class Goal(BaseModel):
     trend_target: Optional[TrendState]
     stats_target: Optional[Stats]
 
+class GoalUpdate(BaseModel):
+    id: int
+    title: Optional[str]
+    status: Optional[GoalStatus]
+    start_datetime: Optional[datetime]
+    end_datetime: Optional[datetime]
+
+    @validator("title")
+    def title_not_null(cls, title: Optional[str]) -> str:
+        # Left out to keep the current title, a goal always has one
+        if title is None:
+            raise ValueError("title cannot be null")
+        return title
+
 class GoalAttr(BaseModel):
     value: Union[int, str, datetime]
 
@@ -272,4 +375,79 @@ class SecretSignature(BaseModel):
 
 class UserRole(BaseModel):
     is_admin: bool = False
-    admin_roles: Optional[List[AdminRole]] = None
\ No newline at end of file
+    admin_roles: Optional[List[AdminRole]] = None
+
+class WarmUpStatus(BaseModel):
+    enabled: bool
+    ready: bool
+    users_total: int = 0
+    users_loaded: int = 0
+    users_failed: int = 0
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class IngestStatus(Enum):
+    pending = 'pending'
+    running = 'running'
+    completed = 'completed'
+    failed = 'failed'
+    superseded = 'superseded'
+
+class IngestJob(BaseModel):
+    job_id: str
+    username: str
+    status: IngestStatus
+    content_hash: str
+    submitted_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    rows_count: Optional[int] = None
+    samples_count: Optional[int] = None
+    validation_errors: Optional[Dict[str, list]] = None
+
+class LoadedUserData(BaseModel):
+    samples: List[BloodGlucoseSample]
+    stats: Optional[Stats]
+    # Normalized records (pandas DataFrame, see csv_data.RECORD_COLUMNS)
+    records: Any
+    # Event stream of each record type (events.EventStream by name)
+    events: Any
+    # Hypo/hyper episodes (episodes.EpisodeIndex by kind)
+    episodes: Any
+    # Archived months older than the samples above (tiering.ColdTier)
+    cold: Any = None
+    # Ingest order of the samples (changes.ChangeLog)
+    changes: Any = None
+
+class IngestResult(BaseModel):
+    rows_count: int
+    validation_errors: Optional[Dict[str, list]] = None
+    data: Optional[LoadedUserData] = None
+
+class LoopLagSpan(BaseModel):
+    detected_at: datetime
+    duration_ms: float
+    route: Optional[str]
+    location: Optional[str]
+
+class TraceSpan(BaseModel):
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_time: datetime
+    duration_ms: float
+    attributes: Dict[str, Any]
+    error: Optional[str]
+    pid: int
+
+class PurgeReport(BaseModel):
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    tokens_deleted: int = 0
+    password_requests_deleted: int = 0
+    freed_pages: int = 0
+    freed_bytes: int = 0
+    reclaimable_bytes: int = 0
+    # SQLite auto_vacuum mode, free pages are only given back in incremental mode
+    auto_vacuum: Optional[str] = None
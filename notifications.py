@@ -0,0 +1,178 @@
+"""Updates of the users' data pushed to their event streams (server-sent events).
+
+Each server worker publishes to the streams connected to it : the samples ingested since
+the last update and the fields of the stats which changed. Updates ingested by another worker
+are picked up by the heartbeat of the streams, which reloads data whose file was replaced.
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from fastapi import HTTPException, status
+from pydantic.json import pydantic_encoder
+
+from router_dependencies import changes_collection, lazy_load_user_data, samples_changes, stats_collection
+from models import resources
+import env
+
+# Put in the queue of a stream to end it
+CLOSED = None
+
+class Subscriber:
+    def __init__(self, username: str) -> None:
+        self.username = username
+        # Events not sent yet, as (event, cursor, message)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=env.SSE_QUEUE_SIZE)
+
+subscribers: Dict[str, Set[Subscriber]] = {}
+# Cursor and stats of the last update published to the subscribers of each user
+published_cursors: Dict[str, int] = {}
+published_stats: Dict[str, Optional[resources.Stats]] = {}
+user_locks: Dict[str, asyncio.Lock] = {}
+running_tasks: Set[asyncio.Task] = set()
+# Set once the server shuts down, the streams opened afterwards end right after their catch-up
+closing = False
+
+def format_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    lines = [] if event_id is None else [f"id: {event_id}"]
+    lines += [f"event: {event}", "data: " + json.dumps(data, default=pydantic_encoder)]
+    return "\n".join(lines) + "\n\n"
+
+def check_capacity(username: str) -> None:
+    if sum(len(s) for s in subscribers.values()) >= env.SSE_MAX_CONNECTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many event streams open, please retry later.",
+            headers={"Retry-After": "5"}
+        )
+    if len(subscribers.get(username, ())) >= env.SSE_MAX_CONNECTIONS_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"At most {env.SSE_MAX_CONNECTIONS_PER_USER} event streams can be open per user"
+        )
+
+def subscribe(username: str) -> Subscriber:
+    subscriber = Subscriber(username)
+    if username not in subscribers:
+        subscribers[username] = set()
+        published_cursors[username] = changes_collection[username].cursor
+        published_stats[username] = stats_collection.get(username)
+    subscribers[username].add(subscriber)
+    if closing:
+        subscriber.queue.put_nowait(CLOSED)
+    return subscriber
+
+def unsubscribe(subscriber: Subscriber) -> None:
+    user_subscribers = subscribers.get(subscriber.username)
+    if user_subscribers is None:
+        return
+    user_subscribers.discard(subscriber)
+    if not user_subscribers:
+        del subscribers[subscriber.username]
+        published_cursors.pop(subscriber.username, None)
+        published_stats.pop(subscriber.username, None)
+
+def close(subscriber: Subscriber, message: Optional[str] = None) -> None:
+    unsubscribe(subscriber)
+    while not subscriber.queue.empty():
+        subscriber.queue.get_nowait()
+    if message is not None:
+        subscriber.queue.put_nowait(("closed", None, message))
+    subscriber.queue.put_nowait(CLOSED)
+
+def close_all() -> None:
+    global closing
+    # Streams never end by themselves, they would hold the graceful shutdown of the server
+    closing = True
+    for user_subscribers in list(subscribers.values()):
+        for subscriber in list(user_subscribers):
+            close(subscriber)
+
+def publish(username: str, event: str, data: Any, cursor: int) -> None:
+    # Serialized once for all the streams of the user
+    message = format_event(event, data, cursor)
+    for subscriber in list(subscribers.get(username, ())):
+        try:
+            subscriber.queue.put_nowait((event, cursor, message))
+        except asyncio.QueueFull:
+            # The events it missed are sent again when it reconnects with its last event id
+            close(subscriber, format_event("lagged", {"cursor": cursor}))
+
+def stats_delta(previous: Optional[resources.Stats], current: resources.Stats) -> Dict[str, Any]:
+    current_fields = current.dict()
+    if previous is None:
+        return current_fields
+    previous_fields = previous.dict()
+    return {k: v for k, v in current_fields.items() if previous_fields.get(k) != v}
+
+async def publish_update(username: str) -> None:
+    """Publishes the samples and stats of the user which changed since its last update."""
+    async with user_locks.setdefault(username, asyncio.Lock()):
+        if username not in subscribers:
+            return
+        # Loads the data again if its file was replaced, by another server worker for instance
+        await lazy_load_user_data(username)
+        cursor = published_cursors[username]
+        while cursor < changes_collection[username].cursor:
+            page = await samples_changes(username, cursor, env.SSE_SAMPLES_PER_EVENT)
+            cursor = page.cursor
+            if page.samples:
+                publish(username, "samples", page, cursor)
+        stats = stats_collection.get(username)
+        if username in subscribers:
+            published_cursors[username] = cursor
+            if stats is not None and stats is not published_stats[username]:
+                delta = stats_delta(published_stats[username], stats)
+                published_stats[username] = stats
+                if delta:
+                    publish(username, "stats", delta, cursor)
+
+async def publish_update_quietly(username: str) -> None:
+    try:
+        await publish_update(username)
+    except HTTPException:
+        # User data removed : its streams end at their next heartbeat
+        pass
+
+def notify_update(username: str) -> None:
+    # Called once new data of the user is stored, the streams are updated in the background
+    if username in subscribers:
+        task = asyncio.get_running_loop().create_task(publish_update_quietly(username))
+        running_tasks.add(task)
+        task.add_done_callback(running_tasks.discard)
+
+async def event_stream(subscriber: Subscriber, since: Optional[int] = None) -> AsyncIterator[str]:
+    # The subscriber is taken by the route, so that the limits are checked against the streams being opened too
+    username = subscriber.username
+    try:
+        await lazy_load_user_data(username)
+        cursor = changes_collection[username].cursor
+        stats = stats_collection.get(username)
+        # Samples missed since the last event received, before the current stats and the live events
+        while since is not None and since < cursor:
+            page = await samples_changes(username, since, min(env.SSE_SAMPLES_PER_EVENT, cursor - since))
+            since = page.cursor
+            if page.samples:
+                yield format_event("samples", page, since)
+        if stats is not None:
+            yield format_event("stats", stats, cursor)
+        while True:
+            try:
+                item = await asyncio.wait_for(subscriber.queue.get(), env.SSE_HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                try:
+                    await publish_update(username)
+                except HTTPException:
+                    return
+                # Comment line, keeps the connection open through proxies
+                yield ": heartbeat\n\n"
+                continue
+            if item is CLOSED:
+                return
+            event, event_cursor, message = item
+            if event == "samples" and event_cursor <= cursor:
+                # Already sent by the catch-up
+                continue
+            yield message
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+import env
+
+logger = logging.getLogger("flapi.query_stats")
+
+class QueryStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.duration_ms = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, duration_ms: float) -> None:
+        self.count += 1
+        self.duration_ms += duration_ms
+        self.statements[statement] += 1
+
+    def repeated_statements(self, threshold: int = env.N_PLUS_ONE_THRESHOLD) -> List[str]:
+        return [statement for statement, count in self.statements.items() if count >= threshold]
+
+# Queries of the current request
+request_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_stats", default=None)
+# Collectors of count_queries(), they see the queries of every thread
+global_collectors: List[QueryStats] = []
+collectors_lock = threading.Lock()
+
+def instrument_engine(engine) -> None:
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context._query_start) * 1000
+        stats = request_stats.get()
+        if stats is not None:
+            stats.record(statement, duration_ms)
+        if global_collectors:
+            with collectors_lock:
+                for collector in global_collectors:
+                    collector.record(statement, duration_ms)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    stats = QueryStats()
+    with collectors_lock:
+        global_collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with collectors_lock:
+            global_collectors.remove(stats)
+
+@contextmanager
+def assert_max_queries(max_count: int) -> Iterator[QueryStats]:
+    """For tests : fails when the block runs more than `max_count` queries.
+
+        with assert_max_queries(3):
+            client.get("/user/john_doe/goals", headers=headers)
+    """
+    with count_queries() as stats:
+        yield stats
+    if stats.count > max_count:
+        details = "\n".join(f"{count} x {statement}" for statement, count in stats.statements.most_common())
+        raise AssertionError(f"{stats.count} queries run, {max_count} expected at most :\n{details}")
+
+class QueryStatsMiddleware:
+    """Counts the queries of each request.
+
+    The count and the time spent in the database are sent in `X-DB-Queries` and `Server-Timing`,
+    statements repeated within a request are logged as likely N+1 patterns.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not env.QUERY_STATS_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = request_stats.set(stats)
+
+        async def send_with_stats(message) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-queries", str(stats.count).encode()),
+                    (b"server-timing", f'db;dur={stats.duration_ms:.2f};desc="{stats.count} queries"'.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            request_stats.reset(token)
+            route = f"{scope['method']} {scope['path']}"
+            logger.debug("%s : %d queries, %.2f ms", route, stats.count, stats.duration_ms)
+            for statement in stats.repeated_statements():
+                logger.warning("Likely N+1 in %s : statement run %d times : %s", route, stats.statements[statement], statement)
@@ -1,25 +1,45 @@
+import asyncio
+import json
 import os
-from typing import List, Dict
+from functools import partial
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Tuple, Type, Union
 from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Security, status, APIRouter
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Security, status, APIRouter, Request, Response, Query
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
 
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import create_engine
 from data_validation import validate_data_from_upload
 
 from models import resources
-from models.database import Base, User
+from models.database import User
+from admission import heavy_route
 
-import csv_data, utils
+import numpy as np
+import pandas as pd
+
+import csv_data, utils, workers, tracing, query_stats
+from db_engine import create_db_engine
+from series import SampleSeries, from_ns, to_ns
+from events import EventStream, concat_streams, event_streams_from_records
+from episodes import EpisodeIndex
+from changes import ChangeLog
+import changes
+from tiering import ColdTier
+import tiering
 import env
 
-engine = create_engine(env.SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# The schema is managed by Alembic : `alembic upgrade head` (also creates a fresh database)
+engine = create_db_engine(env.SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base.metadata.create_all(bind=engine)
+query_stats.instrument_engine(engine)
+if tracing.enabled:
+    tracing.instrument_engine(engine)
 
 def get_db():
     db = SessionLocal()
@@ -66,10 +86,10 @@ def map_access_form_inputs(
     return [mappings[inputs[i]] for i in range(len(inputs))]
 
 async def get_authorized_user(security_scopes: SecurityScopes, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
-    utils.update_token_last_used_date(db, token)
+    tk = utils.use_token(db, token)
     if security_scopes.scopes:
         authentificate_value = f'Bearer scope="{security_scopes.scope_str}"'
-        rights = utils.get_token_rights(db, token)
+        rights = utils.token_rights(tk)
         unauth_expection = HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not enough permission to perform any action on specified resource(s)",
@@ -88,7 +108,17 @@ async def get_authorized_user(security_scopes: SecurityScopes, db: Session = Dep
             )
     else:
         authentificate_value = 'Bearer'
-    user = utils.get_user_from_token(db, token)
+    if not tk:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Access token does not exist"
+        )
+    if tk.expiration_date < datetime.now():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token already expired, please generate a new one."
+        )
+    user = tk.user
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -99,34 +129,282 @@ async def get_authorized_user(security_scopes: SecurityScopes, db: Session = Dep
 
 samples_collection: Dict[str, List[resources.BloodGlucoseSample]] = {}
 stats_collection = {key: resources.Stats.from_sample_collection(samples_collection[key]) for key in samples_collection}
+# Normalized records (glucose, insulin and carbohydrates) from the same parse as the samples
+records_collection: Dict[str, pd.DataFrame] = {}
+events_collection: Dict[str, Dict[str, EventStream]] = {}
+episodes_collection: Dict[str, Dict[str, EpisodeIndex]] = {}
+# Archived months of the users whose history is longer than the hot window,
+# samples_collection only holds the hot samples
+cold_tiers: Dict[str, ColdTier] = {}
+changes_collection: Dict[str, ChangeLog] = {}
+# Version (ETag) of the users_data file each user was loaded from
+loaded_versions: Dict[str, Optional[str]] = {}
+# Columnar copies of samples_collection, built on demand
+series_collection: Dict[str, SampleSeries] = {}
+# Loads currently running, by kind of data ("samples", "stats" or "series") and username
+in_flight_loads: Dict[Tuple[str, str], asyncio.Task] = {}
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Dict[str, Any]]:
+    # `fields=a,b,c.d` as a pydantic include, None when every field is wanted
+    if not fields:
+        return None
+    include: Dict[str, Any] = {}
+    for name in (f.strip() for f in fields.split(",") if f.strip()):
+        top, _, sub = name.partition(".")
+        field = model.__fields__.get(top)
+        nested = field is not None and isinstance(field.type_, type) and issubclass(field.type_, BaseModel)
+        if field is None or (sub and not (nested and sub in field.type_.__fields__)):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown field {name}, available ones : {', '.join(model.__fields__)}"
+            )
+        if not sub:
+            include[top] = ...
+        elif include.get(top) is not ...:
+            include.setdefault(top, set()).add(sub)
+    return include
+
+def sparse_response(content: Union[BaseModel, List[BaseModel]], include: Dict[str, Any], response: Optional[Response] = None) -> Response:
+    # Serializes the selected fields only, skipping the validation against the response model
+    data = [c.dict(include=include) for c in content] if isinstance(content, list) else content.dict(include=include)
+    return Response(
+        json.dumps(data, default=pydantic_encoder),
+        media_type="application/json",
+        headers=dict(response.headers) if response is not None else None
+    )
 
 def check_username(username: str, user: User) -> None:
     if username != user.firstname + '_' + user.lastname:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token with username")
 
-def lazy_load_user_data(username: str):
+def user_data_version_headers(version: resources.UserDataVersion) -> Dict[str, str]:
+    return {
+        "ETag": version.etag,
+        "Last-Modified": format_datetime(version.last_modified, usegmt=True)
+    }
+
+def is_not_modified(request: Request, version: resources.UserDataVersion) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    # If-Modified-Since is ignored when If-None-Match is provided (RFC 9110)
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return version.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return version.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def check_user_data_not_modified(username: str, request: Request, response: Response) -> Optional[resources.UserDataVersion]:
+    version = utils.get_user_data_version(username)
+    if not version:
+        return None
+    headers = user_data_version_headers(version)
+    if is_not_modified(request, version):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return version
+
+def forget_load(key: Tuple[str, str], task: asyncio.Task) -> None:
+    in_flight_loads.pop(key, None)
+    # Marks the exception as retrieved even if every waiter went away
+    if not task.cancelled():
+        task.exception()
+
+async def single_flight(key: Tuple[str, str], load: Callable[[], Awaitable[None]]) -> None:
+    # Concurrent misses on the same key all wait for one load instead of running their own
+    task = in_flight_loads.get(key)
+    if task is None:
+        task = asyncio.get_running_loop().create_task(load())
+        in_flight_loads[key] = task
+        task.add_done_callback(partial(forget_load, key))
+    # A cancelled request (client gone) must not cancel the load shared with other requests
+    await asyncio.shield(task)
+
+def current_data_version(username: str) -> Optional[str]:
+    version = utils.get_user_data_version(username)
+    return version.etag if version else None
+
+def store_user_data(username: str, data: resources.LoadedUserData, replace: bool = True, version: Optional[str] = None):
+    if not replace and username in samples_collection:
+        # Data stored by an ingest job which finished in the meantime is newer
+        return
+    loaded_versions[username] = version or current_data_version(username)
+    samples_collection[username] = data.samples
+    stats_collection[username] = data.stats
+    records_collection[username] = data.records
+    events_collection[username] = data.events
+    episodes_collection[username] = data.episodes
+    changes_collection[username] = data.changes
+    if data.cold is not None:
+        cold_tiers[username] = data.cold
+    else:
+        cold_tiers.pop(username, None)
+    forget_derived_user_data(username)
+
+def forget_user_data(username: str):
+    samples_collection.pop(username, None)
+    stats_collection.pop(username, None)
+    records_collection.pop(username, None)
+    events_collection.pop(username, None)
+    episodes_collection.pop(username, None)
+    changes_collection.pop(username, None)
+    cold_tiers.pop(username, None)
+    loaded_versions.pop(username, None)
+    forget_derived_user_data(username)
+
+async def load_user_data(username: str):
     e = HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User data not found."
             )
+    # Taken first : a file replaced while it is read is loaded again by the next request
+    version = current_data_version(username)
+    # Parsing and validation are run by a worker process to keep the event loop available
+    try:
+        user_data = await workers.run_cpu_bound(
+            workers.load_user_data, workers.user_data_path(username),
+            workers.user_archives_path(username), tiering.retention_days, workers.user_changes_path(username)
+        )
+    except FileNotFoundError:
+        raise e
+    if user_data:
+        store_user_data(username, user_data, replace=False, version=version)
+    else:
+        raise e
+
+async def load_user_stats(username: str):
+    stats_collection[username] = await workers.run_cpu_bound(resources.Stats.from_sample_collection, samples_collection[username], use_process_pool=False)
+
+def refresh_tiering_settings() -> None:
+    if tiering.refresh_settings():
+        # Users are split again with the new window when they are next loaded
+        for username in list(samples_collection):
+            forget_user_data(username)
+
+async def lazy_load_user_data(username: str):
+    refresh_tiering_settings()
+    # The file may have been replaced by another server worker
+    if username in samples_collection and loaded_versions.get(username) != current_data_version(username):
+        forget_user_data(username)
     if username not in samples_collection:
-        try:
-            user_data = csv_data.samples_from_csv(filepath=os.path.join("users_data", f"{username}.csv"))
-        except FileNotFoundError:
-            raise e
-        if user_data:
-            samples_collection[username] = user_data
-        else:
-            raise e
+        await single_flight(("samples", username), partial(load_user_data, username))
         
-def lazy_load_user_stats(username):
+async def lazy_load_user_stats(username):
     e =  HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="User data not found."
     )
     if username not in stats_collection:
         if username in samples_collection:
-            stats_collection[username] = resources.Stats.from_sample_collection(samples_collection[username])
+            await single_flight(("stats", username), partial(load_user_stats, username))
         else:
             raise e
-        
\ No newline at end of file
+
+async def load_user_series(username: str):
+    series_collection[username] = await workers.run_cpu_bound(SampleSeries.from_samples, samples_collection[username], use_process_pool=False)
+
+async def lazy_load_user_series(username: str) -> SampleSeries:
+    await lazy_load_user_data(username)
+    if username not in series_collection:
+        await single_flight(("series", username), partial(load_user_series, username))
+    return series_collection[username]
+
+def forget_derived_user_data(username: str):
+    # To be called whenever the samples of a user are replaced
+    series_collection.pop(username, None)
+
+
+async def lazy_load_user_episodes(username: str) -> Dict[str, EpisodeIndex]:
+    await lazy_load_user_data(username)
+    return episodes_collection[username]
+
+async def samples_between(username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[resources.BloodGlucoseSample]:
+    # Samples of both tiers, archived months are only read when the range reaches them
+    user_series = await lazy_load_user_series(username)
+    lo, hi = user_series.range_bounds(start, end)
+    user_samples = samples_collection[username]
+    res = [user_samples[i] for i in user_series.positions[lo:hi]]
+    if reaches_cold_tier(username, start):
+        res = await workers.run_cpu_bound(cold_tiers[username].samples_between, start, end, use_process_pool=False) + res
+    return res
+
+async def series_between(username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> SampleSeries:
+    # Timestamps and values of both tiers, the positions and devices are left out
+    user_series = await lazy_load_user_series(username)
+    lo, hi = user_series.range_bounds(start, end)
+    timestamps, values = user_series.timestamps[lo:hi], user_series.values[lo:hi]
+    if reaches_cold_tier(username, start):
+        cold_series = await workers.run_cpu_bound(cold_tiers[username].series_between, start, end, use_process_pool=False)
+        timestamps, values = np.concatenate((cold_series.timestamps, timestamps)), np.concatenate((cold_series.values, values))
+    return SampleSeries(timestamps, values, np.arange(len(timestamps)))
+
+async def records_between(username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+    # Records of both tiers, archived months are only read when the range reaches them
+    await lazy_load_user_data(username)
+    records = records_collection[username]
+    dates = records["sampling_date"]
+    lo = 0 if start is None else int(dates.searchsorted(start, side="left"))
+    hi = len(records) if end is None else int(dates.searchsorted(end, side="right"))
+    records = records.iloc[lo:hi]
+    if reaches_cold_tier(username, start):
+        cold_records = await workers.run_cpu_bound(cold_tiers[username].records_between, start, end, use_process_pool=False)
+        if cold_records is not None:
+            records = pd.concat((cold_records, records), ignore_index=True)
+    return records
+
+async def events_between(username: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, EventStream]:
+    # Event streams of both tiers, the archived ones are built from the archived records
+    await lazy_load_user_data(username)
+    user_events = {}
+    for name, stream in events_collection[username].items():
+        lo, hi = stream.range_bounds(start, end)
+        user_events[name] = EventStream(stream.timestamps[lo:hi], stream.values[lo:hi])
+    if reaches_cold_tier(username, start):
+        cold_records = await workers.run_cpu_bound(cold_tiers[username].records_between, start, end, use_process_pool=False)
+        if cold_records is not None:
+            cold_events = await workers.run_cpu_bound(event_streams_from_records, cold_records, use_process_pool=False)
+            user_events = concat_streams(cold_events, user_events)
+    return user_events
+
+def reaches_cold_tier(username: str, start: Optional[datetime]) -> bool:
+    cold = cold_tiers.get(username)
+    return cold is not None and (start is None or start < cold.hot_start)
+
+async def samples_changes(username: str, since: int, limit: Optional[int] = None) -> resources.SamplesChanges:
+    # Samples ingested after the cursor since, in ingest order
+    user_series = await lazy_load_user_series(username)
+    change_log = changes_collection[username]
+    if since > change_log.cursor:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Unknown cursor, the samples have to be synchronized again from 0"
+        )
+    entries = change_log.since(since, limit)
+    timestamps = entries.timestamps
+    res: List[Optional[resources.BloodGlucoseSample]] = [None] * len(timestamps)
+    user_samples = samples_collection[username]
+    hot = changes.lookup(user_series, entries)
+    for i in np.flatnonzero(hot >= 0).tolist():
+        res[i] = user_samples[user_series.positions[hot[i]]]
+    cold = cold_tiers.get(username)
+    if cold is not None:
+        # The samples not found in the hot tier may be archived
+        archived = np.flatnonzero((hot < 0) & (timestamps < to_ns(cold.hot_start)))
+        if len(archived):
+            start, end = from_ns(np.array([timestamps[archived].min(), timestamps[archived].max()]))
+            cold_series = await workers.run_cpu_bound(cold.series_between, start, end, use_process_pool=False)
+            found = changes.lookup(cold_series, ChangeLog(entries.keys[archived], entries.devices))
+            for i, sample in zip(archived[found >= 0].tolist(), tiering.samples_from_series(cold_series, found[found >= 0])):
+                res[i] = sample
+    cursor = since + len(timestamps)
+    # Samples removed or changed by a later upload are skipped, their sequence numbers included
+    return resources.SamplesChanges(
+        samples=[sample for sample in res if sample is not None],
+        cursor=cursor,
+        has_more=cursor < change_log.cursor
+    )
@@ -0,0 +1,53 @@
+from typing import List, Optional
+
+from fastapi import APIRouter
+
+from router_dependencies import *
+from loop_monitor import loop_lag_monitor
+import maintenance
+import tiering
+import tracing
+
+router = APIRouter(prefix='/admin', tags=["Admin"])
+
+def get_admin_user(db: Session = Depends(get_db), user: User = Security(get_authorized_user)) -> User:
+    utils.check_admin_is_allowed(db, user.id, resources.AdminRole.user)
+    return user
+
+@router.get("/loop_lag")
+async def read_loop_lag_spans(_: User = Depends(get_admin_user)) -> List[resources.LoopLagSpan]:
+    return list(loop_lag_monitor.spans)
+
+@router.get("/traces")
+async def read_trace_spans(
+        trace_id: Optional[str] = None, limit: int = Query(default=200, gt=0, le=env.TRACING_RING_SIZE),
+        _: User = Depends(get_admin_user)
+    ) -> List[resources.TraceSpan]:
+    if not tracing.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tracing is disabled (FLAPI_TRACING).")
+    spans = [s for s in tracing.ring if trace_id is None or s["trace_id"] == trace_id]
+    return [resources.TraceSpan(**s) for s in spans[-limit:]]
+
+@router.get("/purge")
+async def read_last_purge_report(_: User = Depends(get_admin_user)) -> resources.PurgeReport:
+    if not maintenance.last_purge_report:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No purge has been run yet.")
+    return maintenance.last_purge_report
+
+@router.post("/purge")
+def purge_expired_rows(db: Session = Depends(get_db), _: User = Depends(get_admin_user)) -> resources.PurgeReport:
+    return maintenance.purge_expired_rows(db)
+
+@router.get("/tiering")
+async def read_tiering_settings(_: User = Depends(get_admin_user)) -> resources.TieringSettings:
+    refresh_tiering_settings()
+    return resources.TieringSettings(retention_days=tiering.retention_days)
+
+@router.put("/tiering")
+async def update_tiering_settings(settings: resources.TieringSettings, _: User = Depends(get_admin_user)) -> resources.TieringSettings:
+    if settings.retention_days < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The retention window must be at least one day")
+    # Stored in a file for the other server workers, which pick it up at their next load
+    tiering.save_settings(settings)
+    refresh_tiering_settings()
+    return settings
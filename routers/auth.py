@@ -16,7 +16,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     firstname, lastname = form_data.username.split("_")
     # Scopes format -> profile samples goals stats
     access_rights = map_access_form_inputs(inputs=form_data.scopes, in_place=True)
-    tk = utils.add_new_token(db, firstname, lastname, form_data.password, access_rights[0], access_rights[1], access_rights[2], access_rights[3])
+    tk = utils.add_new_token(db, firstname, lastname, form_data.password, access_rights[0], access_rights[1], access_rights[2], access_rights[3], user=user)
     if not tk:
         raise HTTPException(
             status_code=status.HTTP_501_NOT_IMPLEMENTED,
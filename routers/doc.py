@@ -59,6 +59,11 @@ async def get_resources_data(db: Session = Depends(get_db), user: User = Securit
 async def get_secret_signatures(db: Session = Depends(get_db), user: User = Security(get_authorized_user)):
     return utils.get_signatures(db, user.id)
 
+@router.post("/signatures")
+async def rotate_secret_signature(db: Session = Depends(get_db), user: User = Security(get_authorized_user)):
+    utils.check_admin_is_allowed(db, user.id, resources.AdminRole.doc)
+    return utils.rotate_signature(db)
+
 # @app.get("/doc/db_metadata")
 # async def get_db_versioning(db: Session = Depends(get_db), user: User = Security(get_authorized_user)):
 #     pass
\ No newline at end of file
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+
+from router_dependencies import *
+import warmup
+
+router = APIRouter(prefix='/health', tags=["Health"])
+
+@router.get("/live")
+async def read_liveness():
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def read_readiness(response: Response) -> resources.WarmUpStatus:
+    if not warmup.warm_up_status.ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return warmup.warm_up_status
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from fastapi.responses import HTMLResponse
 
 from router_dependencies import *
+import ingest
 
 router = APIRouter(include_in_schema=False)
 
@@ -134,17 +135,12 @@ async def upload_csv_data(
     try:
         if firstname == '' or lastname == '':
             return render_html_error_message("No firstname or lastname input", status.HTTP_404_NOT_FOUND)
-        # Creating the CSV file for data storing
-        p = f"{firstname}_{lastname}.csv"
-        f_data = open(os.path.join("users_data", p), "wb")
-        file_content = await validate_data_from_upload(personal_data)
-        f_data.write(file_content)
-        f_data.close()
-        samples_collection[f'{firstname}_{lastname}'] = csv_data.samples_from_csv(filepath=os.path.join("users_data", p))
-        stats_collection[f'{firstname}_{lastname}'] = resources.Stats.from_sample_collection(samples_collection[f"{firstname}_{lastname}"])
+        # Validation, storing and parsing of the file are done by an ingest job
+        file_content = await personal_data.read()
+        job = ingest.submit_ingest_job(f"{firstname}_{lastname}", file_content)
         # Web page
         f = open("pages/file_uploaded.html", "r")
-        content = f.read().replace("[[content]]", personal_data.filename)
+        content = f.read().replace("[[content]]", personal_data.filename).replace("[[job_id]]", job.job_id)
         f.close()
         return HTMLResponse(content=content, status_code=200)
     except IOError:
@@ -1,18 +1,128 @@
+from datetime import timedelta
+from typing import AsyncIterator, Optional
+
 from fastapi import APIRouter
 
 from router_dependencies import *
+import series
+from export import MEDIA_TYPES
 
 router = APIRouter(tags=["Stats"])
 
 @router.get("/user/{username}/stats")
-def read_user_stats(username: str, user: User = Security(get_authorized_user, scopes=['profile'])):
+async def read_user_stats(username: str, request: Request, response: Response, fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['profile'])):
+    check_username(username, user)
+    include = parse_fields(fields, resources.Stats)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
+    await lazy_load_user_stats(username)
+    return sparse_response(stats_collection[username], include, response) if include else stats_collection[username]
+
+@router.get("/user/{username}/stats/rolling", dependencies=[Depends(heavy_route)])
+async def read_user_rolling_stats(
+        username: str, request: Request, response: Response,
+        window_days: int = Query(default=14, ge=1, le=365), step_hours: int = Query(default=24, ge=1),
+        start: Optional[str] = None, end: Optional[str] = None,
+        user: User = Security(get_authorized_user, scopes=['profile'])
+    ) -> resources.RollingStats:
     check_username(username, user)
-    lazy_load_user_data(username)
-    lazy_load_user_stats(username)
-    return stats_collection[username]
+    check_user_data_not_modified(username, request, response)
+    try:
+        start_date = datetime.strptime(start, "%d/%m/%Y") if start else None
+        end_date = datetime.strptime(end, "%d/%m/%Y") if end else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Dates format not respected : DD/MM/YYYY"
+        )
+    hour_ns = 3600 * 10**9
+    # Windows ending outside of the user's data would be empty
+    user_series = await lazy_load_user_series(username)
+    cold = cold_tiers.get(username)
+    data_start = datetime.combine(cold.rollups[0].month, datetime.min.time()) if cold else series.from_ns(user_series.timestamps[:1])[0]
+    data_end = series.from_ns(user_series.timestamps[-1:])[0]
+    start_date = min(max(start_date, data_start), data_end) if start_date else None
+    end_date = max(min(end_date, data_end), data_start) if end_date else None
+    first_end = start_date or data_start + timedelta(days=window_days)
+    windows = max((end_date or data_end) - first_end, timedelta(0)) // timedelta(hours=step_hours) + 1
+    if windows > env.ROLLING_MAX_WINDOWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{windows} windows requested, at most {env.ROLLING_MAX_WINDOWS} : raise step_hours or narrow start and end"
+        )
+    window_start = start_date - timedelta(days=window_days) if start_date else None
+    if reaches_cold_tier(username, window_start):
+        user_series = await workers.run_cpu_bound(SampleSeries.from_samples, await samples_between(username, window_start, end_date), use_process_pool=False)
+    rolling = series.rolling_stats(user_series, window_days * 24 * hour_ns, step_hours * hour_ns, start_date, end_date)
+    return resources.RollingStats(
+        window_days=window_days,
+        step_hours=step_hours,
+        window_ends=series.from_ns(rolling["window_ends"]),
+        samples_size=rolling["samples_size"].tolist(),
+        mean=series.rounded_list(rolling["mean"]),
+        standard_deviation=series.rounded_list(rolling["standard_deviation"]),
+        gmi=series.rounded_list(rolling["gmi"])
+    )
 
-@router.get("/users/stats")
-def read_stats(_: User = Security(get_authorized_user, scopes=['profile'])):
+@router.get("/users/stats", dependencies=[Depends(heavy_route)])
+def read_stats(fields: Optional[str] = None, _: User = Security(get_authorized_user, scopes=['profile'])):
+    include = parse_fields(fields, resources.Stats)
     # Load data from all users
     samples = {data.split('_')[0]+"_"+data.split('_')[1]: csv_data.samples_from_csv(filepath=os.path.join("users_data", f"{data}")) for data in os.listdir("users_data")}
-    return resources.Stats.from_all_users_samples(samples)
\ No newline at end of file
+    if include:
+        return sparse_response(resources.Stats.from_all_users_samples(samples, set(include)), include)
+    return resources.Stats.from_all_users_samples(samples)
+
+async def load_batch_result(username: str, n_latest: int, slots: asyncio.Semaphore) -> resources.UserBatchResult:
+    try:
+        async with slots:
+            await lazy_load_user_data(username)
+            await lazy_load_user_stats(username)
+        user_samples = samples_collection[username]
+        return resources.UserBatchResult(
+            username=username,
+            stats=stats_collection[username],
+            latest_samples=user_samples[max(len(user_samples) - n_latest, 0):]
+        )
+    except HTTPException as e:
+        return resources.UserBatchResult(username=username, error=str(e.detail))
+    except Exception:
+        # A corrupted file or a failed worker only fails the line of its user, not the whole batch
+        return resources.UserBatchResult(username=username, error="The data of this user could not be loaded")
+
+async def batch_results(usernames: List[str], allowed: bool, n_latest: int, current_username: str) -> AsyncIterator[bytes]:
+    slots = asyncio.Semaphore(env.BATCH_LOAD_CONCURRENCY)
+    tasks = []
+    for username in dict.fromkeys(usernames):
+        if allowed or username == current_username:
+            tasks.append(asyncio.create_task(load_batch_result(username, n_latest, slots)))
+        else:
+            yield resources.UserBatchResult(username=username, error="Not allowed to read this user data").json().encode() + b"\n"
+    try:
+        # Each user is sent as soon as it is ready, cached users first
+        for next_result in asyncio.as_completed(tasks):
+            yield (await next_result).json().encode() + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@router.post("/users/batch", dependencies=[Depends(heavy_route)])
+def read_users_batch(
+        batch: resources.UsersBatchRequest, db: Session = Depends(get_db),
+        user: User = Security(get_authorized_user, scopes=['profile', 'samples'])
+    ):
+    if len(batch.usernames) > env.BATCH_MAX_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {env.BATCH_MAX_USERS} users can be requested at once"
+        )
+    # User administrators can read every user, other users only themselves
+    try:
+        utils.check_admin_is_allowed(db, user.id, resources.AdminRole.user)
+        allowed = True
+    except HTTPException:
+        allowed = False
+    return StreamingResponse(
+        batch_results(batch.usernames, allowed, max(batch.n_latest, 0), user.firstname + '_' + user.lastname),
+        media_type=MEDIA_TYPES["ndjson"]
+    )
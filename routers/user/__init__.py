@@ -1,11 +1,14 @@
 from router_dependencies import *
-from routers.user import samples, trend, goal, raw_data
+from routers.user import samples, trend, goal, raw_data, events, episodes, updates
 
 router = APIRouter(prefix='/user', tags=["User"])
 router.include_router(samples.router)
 router.include_router(trend.router)
 router.include_router(goal.router)
 router.include_router(raw_data.router)
+router.include_router(events.router)
+router.include_router(episodes.router)
+router.include_router(updates.router)
 
 @router.get("")
 async def get_user_infos(user: User = Security(get_authorized_user, scopes=['profile'])):
@@ -15,14 +18,14 @@ async def get_user_infos(user: User = Security(get_authorized_user, scopes=['pro
         lastname=user.lastname,
         username=user.firstname+"_"+user.lastname,
         email=user.email,
-        devices_list=utils.get_user_devices(user)
+        devices_list=await workers.run_cpu_bound(utils.get_user_devices, user, use_process_pool=False)
     )
 
 @router.post("")
 async def new_user(user: resources.CreateUser, db: Session = Depends(get_db)):
     new_user = utils.add_new_user(db, user.firstname, user.lastname, user.email, user.password)
     if new_user:
-        tk = utils.add_new_token(db, user.firstname, user.lastname, user.password, True, True, True, True)
+        tk = utils.add_new_token(db, user.firstname, user.lastname, user.password, True, True, True, True, user=new_user)
         return tk
     else:
         raise HTTPException(
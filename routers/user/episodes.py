@@ -0,0 +1,38 @@
+from typing import List, Optional
+
+from router_dependencies import *
+import series
+
+router = APIRouter(tags=["Episodes"])
+
+@router.get("/{username}/episodes")
+async def read_episodes(
+        username: str, request: Request, response: Response,
+        kind: Optional[resources.EpisodeKind] = None, start: Optional[str] = None, end: Optional[str] = None,
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> List[resources.Episode]:
+    check_username(username, user)
+    check_user_data_not_modified(username, request, response)
+    try:
+        start_date = datetime.strptime(start, "%d/%m/%Y-%H:%M") if start else None
+        end_date = datetime.strptime(end, "%d/%m/%Y-%H:%M") if end else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Dates format not respected : DD/MM/YYYY-HH:MM"
+        )
+    user_episodes = await lazy_load_user_episodes(username)
+    res = []
+    for episode_kind in ([kind] if kind else list(resources.EpisodeKind)):
+        index = user_episodes[episode_kind.value]
+        lo, hi = index.range_bounds(start_date, end_date)
+        for episode_start, episode_end, extreme, size in zip(
+                series.from_ns(index.starts[lo:hi]), series.from_ns(index.ends[lo:hi]),
+                index.extremes[lo:hi].tolist(), index.samples_sizes[lo:hi].tolist()):
+            res.append(resources.Episode(
+                kind=episode_kind, start=episode_start, end=episode_end,
+                duration_minutes=(episode_end - episode_start).total_seconds() / 60,
+                extreme_value=extreme, samples_size=size
+            ))
+    res.sort(key=lambda e: e.start)
+    return res
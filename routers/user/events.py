@@ -0,0 +1,62 @@
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from router_dependencies import *
+import events
+import series
+
+router = APIRouter(tags=["Events"])
+
+def parse_date_range(start: Optional[str], end: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    try:
+        start_date = datetime.strptime(start, "%d/%m/%Y-%H:%M") if start else None
+        end_date = datetime.strptime(end, "%d/%m/%Y-%H:%M") if end else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Dates format not respected : DD/MM/YYYY-HH:MM"
+        )
+    return start_date, end_date
+
+@router.get("/{username}/events/meal_responses", dependencies=[Depends(heavy_route)])
+async def read_meal_responses(
+        username: str, request: Request, response: Response,
+        hours: float = Query(default=2, gt=0, le=12), start: Optional[str] = None, end: Optional[str] = None,
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> List[resources.MealResponse]:
+    check_username(username, user)
+    check_user_data_not_modified(username, request, response)
+    start_date, end_date = parse_date_range(start, end)
+    # Wide enough for the insulin around the meals, the baseline before them and the glucose after them
+    margin = timedelta(minutes=30)
+    user_events = await events_between(username, start_date and start_date - margin, end_date and end_date + margin)
+    user_series = await series_between(username, start_date and start_date - margin, end_date and end_date + timedelta(hours=hours))
+    carbohydrates = user_events["carbohydrates"]
+    lo, hi = carbohydrates.range_bounds(start_date, end_date)
+    meals = events.EventStream(carbohydrates.timestamps[lo:hi], carbohydrates.values[lo:hi])
+    responses = events.meal_responses(meals, user_series, user_events["rapid_insulin"], hours)
+    columns = {name: series.rounded_list(values) for name, values in responses.items() if name != "meal_dates"}
+    return [
+        resources.MealResponse(meal_date=meal_date, **{name: values[i] for name, values in columns.items()})
+        for i, meal_date in enumerate(series.from_ns(responses["meal_dates"]))
+    ]
+
+@router.get("/{username}/events/{stream}")
+async def read_events(
+        username: str, stream: str, request: Request, response: Response,
+        start: Optional[str] = None, end: Optional[str] = None,
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> List[resources.Event]:
+    check_username(username, user)
+    if stream not in events.NUMERIC_STREAMS + events.TEXT_STREAMS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown event stream, available ones : {', '.join(events.NUMERIC_STREAMS + events.TEXT_STREAMS)}"
+        )
+    check_user_data_not_modified(username, request, response)
+    start_date, end_date = parse_date_range(start, end)
+    event_stream = (await events_between(username, start_date, end_date))[stream]
+    return [
+        resources.Event(date=d, value=v)
+        for d, v in zip(series.from_ns(event_stream.timestamps), event_stream.values.tolist())
+    ]
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 from fastapi import APIRouter
 
@@ -7,10 +7,40 @@ from router_dependencies import *
 router = APIRouter(tags=["Goals"])
 
 @router.get("/{username}/goals")
-def get_all_goals(username: str, db: Session = Depends(get_db), user: User = Security(get_authorized_user, scopes=['goals'])) -> List[resources.Goal]:
+def get_all_goals(username: str, fields: Optional[str] = None, db: Session = Depends(get_db), user: User = Security(get_authorized_user, scopes=['goals'])) -> List[resources.Goal]:
     check_username(username, user)
+    include = parse_fields(fields, resources.Goal)
+    if include:
+        return sparse_response(utils.get_user_goals(db, user, with_stats_target="stats_target" in include), include)
     return utils.get_user_goals(db, user)
 
+@router.post("/{username}/goals")
+def add_new_goals(username: str, goals: List[resources.Goal], user: User = Security(get_authorized_user, scopes=['goals']), db: Session = Depends(get_db)) -> List[resources.Goal]:
+    check_username(username, user)
+    return utils.add_new_goals(db, user, goals)
+
+@router.patch("/{username}/goals")
+def update_goals(username: str, updates: List[resources.GoalUpdate], user: User = Security(get_authorized_user, scopes=['goals']), db: Session = Depends(get_db)) -> List[resources.Goal]:
+    check_username(username, user)
+    goals = utils.update_goals(db, user, updates)
+    if goals is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="One or more identifiers do not match any of your goals"
+        )
+    return goals
+
+@router.delete("/{username}/goals")
+def remove_goals(username: str, ids: List[int] = Query(), user: User = Security(get_authorized_user, scopes=['goals']), db: Session = Depends(get_db)) -> List[resources.Goal]:
+    check_username(username, user)
+    goals = utils.remove_goals(db, user, ids)
+    if goals is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="One or more identifiers do not match any of your goals"
+        )
+    return goals
+
 @router.post("/{username}/goal/")
 def add_new_goal(username: str, goal: resources.Goal, user: User = Security(get_authorized_user, scopes=['goals']), db: Session = Depends(get_db)) -> resources.Goal:
     check_username(username, user)
@@ -1,6 +1,9 @@
+from typing import Literal, Optional, Tuple
+
 from fastapi import APIRouter
 
 from router_dependencies import *
+import export, ingest
 
 router = APIRouter(tags=["Raw data"])
 
@@ -9,15 +12,115 @@ async def check_user_has_data(username: str, user: User = Security(get_authorize
     check_username(username, user)
     return utils.check_user_has_data(username)
 
+def parse_byte_range(range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+    # Only a single "bytes=start-end" range is honoured, anything else falls back to the whole file
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in byte_range:
+        return None
+    start_value, _, end_value = byte_range.strip().partition("-")
+    try:
+        if start_value == "":
+            suffix_length = int(end_value)
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+            if suffix_length == 0:
+                start = file_size
+        else:
+            start = int(start_value)
+            end = min(int(end_value), file_size - 1) if end_value else file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
+def read_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
 @router.get("/{username}/raw_data")
-async def get_user_data_file(username: str, user: User = Security(get_authorized_user, scopes=['samples'])):
+async def get_user_data_file(username: str, request: Request, user: User = Security(get_authorized_user, scopes=['samples'])):
+    check_username(username, user)
+    version = utils.get_user_data_version(username)
+    if not version:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User data not found.")
+    headers = user_data_version_headers(version)
+    if is_not_modified(request, version):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    headers["Accept-Ranges"] = "bytes"
+    path = os.path.join("users_data", f"{username}.csv")
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A stale If-Range validator means the client has to download the whole new file
+    if range_header and (if_range is None or if_range in (version.etag, headers["Last-Modified"])):
+        file_size = os.path.getsize(path)
+        byte_range = parse_byte_range(range_header, file_size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                read_file_range(path, start, end),
+                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                media_type="text/csv",
+                headers=headers
+            )
+    return FileResponse(path, media_type="text/csv", headers=headers)
+
+@router.post("/{username}/raw_data", status_code=status.HTTP_202_ACCEPTED)
+async def add_or_update_user_data_file(username: str, file: UploadFile, user: User = Security(get_authorized_user, scopes=['samples'])) -> resources.IngestJob:
+    check_username(username, user)
+    content_bytes = await file.read()
+    return ingest.submit_ingest_job(username, content_bytes)
+
+@router.get("/{username}/ingest/{job_id}")
+async def read_ingest_job(username: str, job_id: str, user: User = Security(get_authorized_user, scopes=['samples'])) -> resources.IngestJob:
     check_username(username, user)
-    return FileResponse(os.path.join("users_data", f"{username}.csv"))
+    job = ingest.get_ingest_job(username, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="There is no ingest job with this identifier"
+        )
+    return job
 
-@router.post("/{username}/raw_data")
-async def add_or_update_user_data_file(username: str, file: UploadFile, user: User = Security(get_authorized_user, scopes=['samples'])):
+@router.get("/{username}/export")
+async def export_user_records(
+        username: str, request: Request,
+        format: Literal["ndjson", "csv", "parquet", "arrow"] = "ndjson",
+        start: Optional[str] = None, end: Optional[str] = None,
+        chunk_size: int = Query(default=5000, ge=1, le=100000),
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ):
     check_username(username, user)
-    content_bytes = await validate_data_from_upload(file)
-    f = open(os.path.join("users_data", f"{username}.csv"), "wb")
-    f.write(content_bytes)
-    return resources.UserDataFileUpdateResponse(message="User data file was successfully updated.")
\ No newline at end of file
+    version = utils.get_user_data_version(username)
+    if not version:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User data not found.")
+    headers = user_data_version_headers(version)
+    if is_not_modified(request, version):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    try:
+        start_date = datetime.strptime(start, "%d/%m/%Y-%H:%M") if start else None
+        end_date = datetime.strptime(end, "%d/%m/%Y-%H:%M") if end else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Dates format not respected : DD/MM/YYYY-HH:MM"
+        )
+    records = await records_between(username, start_date, end_date)
+    try:
+        chunks = export.export_chunks(records, format, chunk_size)
+    except export.MissingExportDependency as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+    headers["Content-Disposition"] = f'attachment; filename="{username}.{format}"'
+    # Chunks are serialized one at a time in the thread pool while being sent
+    return StreamingResponse(chunks, media_type=export.MEDIA_TYPES[format], headers=headers)
@@ -1,41 +1,122 @@
-from typing import List, Optional
+from datetime import timedelta
+from typing import List, Literal, Optional
 
 from router_dependencies import *
+from sample_filters import FilterError, SampleFilter
+import sample_filters
+import series
 
 router = APIRouter(tags=["Samples"])
 
 @router.get("/{username}/samples")
-async def read_samples(username: str, day: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])) -> List[resources.BloodGlucoseSample]:
+async def read_samples(username: str, request: Request, response: Response, day: Optional[str] = None, fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])) -> List[resources.BloodGlucoseSample]:
     check_username(username, user)
-    lazy_load_user_data(username)
+    include = parse_fields(fields, resources.BloodGlucoseSample)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
     if day is None:
-        res = list(filter(lambda d: d.sampling_date.date() == datetime.today().date(), samples_collection[username]))
+        day_start = datetime.combine(datetime.today().date(), datetime.min.time())
+        res = await samples_between(username, day_start, day_start + timedelta(days=1) - timedelta(microseconds=1))
         if len(res) == 0:
             raise HTTPException(status_code=404)
-        return res
+    else:
+        try:
+            day_start = datetime.strptime(day, "%d/%m/%Y")
+        except ValueError:
+            error_message = {
+                "resource_type": "sample",
+                "username": username,
+                "error_description": "The date input is invalid" 
+            }
+            raise HTTPException(status_code=400, detail=error_message)
+        res = await samples_between(username, day_start, day_start + timedelta(days=1) - timedelta(microseconds=1))
+    return sparse_response(res, include, response) if include else res
+
+@router.get("/{username}/samples/latest")
+async def read_latest_samples(username: str, request: Request, response: Response, n_latest: Optional[int] = Query(default=None, ge=1), fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])):
+    check_username(username, user)
+    include = parse_fields(fields, resources.BloodGlucoseSample)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
+    n_latest = n_latest or 5
+    user_samples = samples_collection[username]
+    if n_latest > len(user_samples) and username in cold_tiers:
+        # More samples than the hot window holds
+        user_samples = await samples_between(username)
+    res = user_samples[max(len(user_samples) - n_latest, 0):]
+    return sparse_response(res, include, response) if include else res
+
+@router.get("/{username}/samples/changes")
+async def read_samples_changes(
+        username: str, since: int = Query(default=0, ge=0), limit: int = Query(default=1000, ge=1, le=10000),
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> resources.SamplesChanges:
+    check_username(username, user)
+    return await samples_changes(username, since, limit)
+
+@router.get("/{username}/samples/range", dependencies=[Depends(heavy_route)])
+async def read_samples_range(
+        username: str, start: str, end: str, request: Request, response: Response,
+        max_points: Optional[int] = Query(default=None, ge=2), method: Literal["lttb", "minmax"] = "lttb",
+        fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> List[resources.BloodGlucoseSample]:
+    check_username(username, user)
+    include = parse_fields(fields, resources.BloodGlucoseSample)
+    check_user_data_not_modified(username, request, response)
     try:
-        return list(filter(lambda d: datetime.strptime(day, "%d/%m/%Y").date() == d.sampling_date.date(), samples_collection[username]))
+        start_date = datetime.strptime(start, "%d/%m/%Y-%H:%M")
+        end_date = datetime.strptime(end, "%d/%m/%Y-%H:%M")
     except ValueError:
-        error_message = {
-            "resource_type": "sample",
-            "username": username,
-            "error_description": "The date input is invalid" 
-        }
-        raise HTTPException(status_code=400, detail=error_message)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Dates format not respected : DD/MM/YYYY-HH:MM"
+        )
+    if reaches_cold_tier(username, start_date):
+        user_samples = await samples_between(username, start_date, end_date)
+        user_series = await workers.run_cpu_bound(SampleSeries.from_samples, user_samples, use_process_pool=False)
+    else:
+        user_series = await lazy_load_user_series(username)
+        user_samples = samples_collection[username]
+    lo, hi = user_series.range_bounds(start_date, end_date)
+    if max_points is None or hi - lo <= max_points:
+        res = [user_samples[i] for i in user_series.positions[lo:hi]]
+    else:
+        # Shape preserving reduction, so that the payload never exceeds max_points samples
+        kept = series.downsample_indices(user_series, lo, hi, max_points, method)
+        res = [user_samples[i] for i in user_series.positions[kept]]
+    return sparse_response(res, include, response) if include else res
 
-@router.get("/{username}/samples/latest")
-async def read_latest_samples(username: str, n_latest: Optional[int] = None, user: User = Security(get_authorized_user, scopes=['samples'])):
+@router.get("/{username}/samples/query", dependencies=[Depends(heavy_route)])
+async def query_samples(
+        username: str, request: Request, response: Response, expression: str = Query(alias="filter"),
+        limit: Optional[int] = Query(default=None, ge=1), fields: Optional[str] = None,
+        user: User = Security(get_authorized_user, scopes=['samples'])
+    ) -> List[resources.BloodGlucoseSample]:
     check_username(username, user)
-    lazy_load_user_data(username)
-    n = len(samples_collection[username])
-    if n_latest:
-        return samples_collection[username][n-(n_latest-1):n]
-    return samples_collection[username][n-5:n]
+    include = parse_fields(fields, resources.BloodGlucoseSample)
+    try:
+        sample_filter = SampleFilter(expression)
+    except FilterError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid filter : {e}")
+    check_user_data_not_modified(username, request, response)
+    user_series = await lazy_load_user_series(username)
+    user_samples = samples_collection[username]
+    total, res = 0, []
+    if reaches_cold_tier(username, sample_filter.start):
+        total, res = await workers.run_cpu_bound(sample_filters.cold_matches, cold_tiers[username], sample_filter, limit, use_process_pool=False)
+    indices = sample_filter.indices(user_series)
+    total += len(indices)
+    if limit:
+        indices = indices[:max(limit - len(res), 0)]
+    res += [user_samples[i] for i in user_series.positions[indices]]
+    # Matching samples before the limit
+    response.headers["X-Total-Count"] = str(total)
+    return sparse_response(res, include, response) if include else res
 
-@router.post("/{username}/samples/average_day")
+@router.post("/{username}/samples/average_day", dependencies=[Depends(heavy_route)])
 async def get_user_samples_as_average_day(username: str, req_params: resources.AverageDayParams, user: User = Security(get_authorized_user, scopes=['samples'])):
     check_username(username, user)
-    lazy_load_user_data(username)
+    await lazy_load_user_data(username)
     try:
         hours = [datetime.strptime(h, "%H:%M").time() for h in req_params.hours]
     except ValueError:
@@ -43,4 +124,14 @@ async def get_user_samples_as_average_day(username: str, req_params: resources.A
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Hours format not respected : HH:MM"
         )
-    return utils.get_user_average_day_user_samples(user, samples_collection, hours, req_params.error)
\ No newline at end of file
+    all_samples = {username: await samples_between(username)} if username in cold_tiers else samples_collection
+    return await workers.run_cpu_bound(utils.get_user_average_day_user_samples, user, all_samples, hours, req_params.error, use_process_pool=False)
+
+@router.get("/{username}/samples/monthly")
+async def read_monthly_rollups(username: str, request: Request, response: Response, user: User = Security(get_authorized_user, scopes=['samples'])) -> List[resources.MonthRollup]:
+    check_username(username, user)
+    check_user_data_not_modified(username, request, response)
+    user_series = await lazy_load_user_series(username)
+    # Archived months come with their rollup, hot months are computed from the series
+    cold = cold_tiers.get(username)
+    return (cold.rollups if cold else []) + tiering.month_rollups(user_series.timestamps, user_series.values)
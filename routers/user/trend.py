@@ -1,28 +1,55 @@
+from datetime import timedelta
+from typing import Optional
+
 from fastapi import APIRouter
 
 from router_dependencies import *
 
 router = APIRouter(tags=["Trends"])
 
-@router.get("/{username}/trend/hours_interval")
-def read_trend_hours(username: str, h1_string: str, h2_string: str, error: int, user: User = Security(get_authorized_user, scopes=['samples'])):
+@router.get("/{username}/trend/hours_interval", dependencies=[Depends(heavy_route)])
+async def read_trend_hours(username: str, h1_string: str, h2_string: str, error: int, request: Request, response: Response, fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])):
     check_username(username, user)
-    lazy_load_user_data(username)
+    include = parse_fields(fields, resources.HourTrend)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
     h1 = datetime.strptime(h1_string, "%d/%m/%Y-%H:%M")
     h2 = datetime.strptime(h2_string, "%d/%m/%Y-%H:%M")
-    return resources.HourTrend.from_hours(h1,h2,samples_collection[username], error)
+    fields = set(include) if include else None
+    # The samples are not even read when only the interval is asked for
+    samples = await samples_between(username, h1, h2) if resources.Trend.computed(fields) else []
+    trend = await workers.run_cpu_bound(resources.HourTrend.from_hours, h1, h2, samples, error, fields, use_process_pool=False)
+    return sparse_response(trend, include, response) if include else trend
 
-@router.get("/{username}/trend/days_interval")
-def read_trend_days(username: str, day1_string: str, day2_string: str, error: int, user: User = Security(get_authorized_user, scopes=['samples'])):
-    check_username(username)
-    lazy_load_user_data(username)
+@router.get("/{username}/trend/days_interval", dependencies=[Depends(heavy_route)])
+async def read_trend_days(username: str, day1_string: str, day2_string: str, error: int, request: Request, response: Response, fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])):
+    check_username(username, user)
+    include = parse_fields(fields, resources.HourTrend)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
     username = user.firstname + '_' + user.lastname
     day1 = datetime.strptime(day1_string, "%d/%m/%Y")
     day2 = datetime.strptime(day2_string, "%d/%m/%Y")
-    return resources.HourTrend.from_hours(day1,day2,samples_collection[username], error)
+    fields = set(include) if include else None
+    samples = await samples_between(username, day1, day2) if resources.Trend.computed(fields) else []
+    trend = await workers.run_cpu_bound(resources.HourTrend.from_hours, day1, day2, samples, error, fields, use_process_pool=False)
+    return sparse_response(trend, include, response) if include else trend
 
-@router.get("/{username}/trend/months_interval")
-def read_trend_months(username: str, month1: int, year1: int, month2: int, year2: int, error: int, user: User = Security(get_authorized_user, scopes=['samples'])):
+@router.get("/{username}/trend/months_interval", dependencies=[Depends(heavy_route)])
+async def read_trend_months(username: str, month1: int, year1: int, month2: int, year2: int, error: int, request: Request, response: Response, fields: Optional[str] = None, user: User = Security(get_authorized_user, scopes=['samples'])):
     check_username(username, user)
-    lazy_load_user_data(username)
-    return resources.MonthTrend.from_months(month1, year1, month2, year2, samples_collection[username], error)
+    include = parse_fields(fields, resources.MonthTrend)
+    check_user_data_not_modified(username, request, response)
+    await lazy_load_user_data(username)
+    # Superset of the months matched by from_months
+    try:
+        start = datetime(year1, month1, 1)
+        end = datetime(year2 + month2 // 12, month2 % 12 + 1, 1) - timedelta(microseconds=1)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid month or year")
+    fields = set(include) if include else None
+    samples = await samples_between(username, start, end) if resources.Trend.computed(fields) else []
+    trend = await workers.run_cpu_bound(
+        resources.MonthTrend.from_months, month1, year1, month2, year2, samples, error, fields, use_process_pool=False
+    )
+    return sparse_response(trend, include, response) if include else trend
@@ -0,0 +1,37 @@
+from typing import Optional
+
+from starlette.background import BackgroundTask
+
+from router_dependencies import *
+import notifications
+
+router = APIRouter(tags=["Updates"])
+
+@router.get("/{username}/updates")
+async def stream_user_updates(
+        username: str, request: Request, since: Optional[int] = Query(default=None, ge=0),
+        user: User = Security(get_authorized_user, scopes=['samples', 'stats'])
+    ):
+    # Server-sent events : "samples" with the samples ingested (as /samples/changes, the event id is the cursor)
+    # and "stats" with the fields of the stats which changed, the whole stats first
+    check_username(username, user)
+    await lazy_load_user_data(username)
+    # Sent back by the browsers when they reconnect
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    if since is not None and since > changes_collection[username].cursor:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Unknown cursor, the samples have to be synchronized again from 0"
+        )
+    # Checked and taken with no await in between, concurrent connections cannot exceed the limits
+    notifications.check_capacity(username)
+    subscriber = notifications.subscribe(username)
+    return StreamingResponse(
+        notifications.event_stream(subscriber, since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Released by the stream when it ends, or here when the client left before it started
+        background=BackgroundTask(notifications.unsubscribe, subscriber)
+    )
@@ -0,0 +1,415 @@
+"""Filter expressions over the glucose samples of a user, e.g.
+
+    value > 180 and time in 22:00..06:00 and weekday in mon..fri and month = mar
+
+Predicates :
+    value <op> 180, value in 70..180                    (mg/dL)
+    time <op> 22:00, time in 22:00..06:00               (a range wraps around midnight)
+    date <op> 2023-03-01, date in 2023-03-01..2023-03-31, date >= 2023-03-01T12:00
+    weekday = sat, weekday in mon..fri, weekday in sat, sun, weekday in weekend
+    month = mar, month in 11..2, month in jan, jul
+    device = "FreeStyle LibreLink", device in "ABC123", "DEF456"   (name or serial number)
+with <op> one of = != < <= > >=, combined with not, and, or and parentheses.
+
+An expression is parsed once, never evaluated by Python, and compiles to boolean masks
+over the columns of a SampleSeries : a scan is a few vectorized operations per predicate.
+"""
+import operator
+import re
+from datetime import datetime
+from functools import cached_property
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from models.resources import BloodGlucoseSample
+from series import DateOutOfRange, SampleSeries, from_ns, to_ns
+from tiering import ColdTier
+import tiering
+
+MAX_LENGTH = 1000
+MAX_DEPTH = 32
+
+MINUTE_NS = 60 * 10**9
+DAY_NS = 24 * 60 * MINUTE_NS
+INT64_MAX = np.iinfo(np.int64).max
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+WEEKDAY_SETS = {"weekdays": list(range(5)), "weekend": [5, 6]}
+
+OPERATORS: Dict[str, Callable] = {
+    "=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge
+}
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<date>\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2})?)
+    |(?P<time>\d{1,2}:\d{2})
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<string>"[^"]*"|'[^']*')
+    |(?P<range>\.\.)
+    |(?P<op><=|>=|!=|=|<|>)
+    |(?P<punct>[(),])
+    |(?P<word>[A-Za-z_]+)
+)""", re.VERBOSE)
+
+class FilterError(ValueError):
+    def __init__(self, message: str, position: int) -> None:
+        super().__init__(f"{message} (position {position})")
+        self.position = position
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    position: int
+
+def tokenize(expression: str) -> List[Token]:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN.match(expression, position)
+        if match is None or match.lastgroup is None:
+            rest = expression[position:].lstrip()
+            raise FilterError(f"Unexpected character {rest[:1]!r}", len(expression) - len(rest))
+        text = match.group(match.lastgroup)
+        if match.lastgroup == "word":
+            text = text.lower()
+        elif match.lastgroup == "string":
+            text = text[1:-1]
+        tokens.append(Token(match.lastgroup, text, match.start(match.lastgroup)))
+        position = match.end()
+    tokens.append(Token("end", "", len(expression)))
+    return tokens
+
+class Columns:
+    """Columns of series[lo:hi], the derived ones are computed once per evaluation."""
+    def __init__(self, series: SampleSeries, lo: int, hi: int) -> None:
+        self.series = series
+        self.timestamps = series.timestamps[lo:hi]
+        self.values = series.values[lo:hi]
+        self.device_codes = series.device_codes[lo:hi]
+
+    @cached_property
+    def minute(self) -> np.ndarray:
+        return self.timestamps // MINUTE_NS % (24 * 60)
+
+    @cached_property
+    def weekday(self) -> np.ndarray:
+        # 1970-01-01 was a Thursday
+        return (self.timestamps // DAY_NS + 3) % 7
+
+    @cached_property
+    def month(self) -> np.ndarray:
+        return self.timestamps.astype("datetime64[ns]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+class Node:
+    def mask(self, columns: Columns) -> np.ndarray:
+        raise NotImplementedError
+
+    def date_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        # [start, end) in ns containing every matching sample, None when unbounded
+        return None, None
+
+class Compare(Node):
+    def __init__(self, column: str, op: str, value: float) -> None:
+        self.column, self.op, self.value = column, op, value
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        return OPERATORS[self.op](getattr(columns, self.column), self.value)
+
+class Interval(Node):
+    """column in [lo, hi], or outside of ]hi, lo[ for cyclic columns when lo > hi."""
+    def __init__(self, column: str, lo: float, hi: float) -> None:
+        self.column, self.lo, self.hi = column, lo, hi
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        values = getattr(columns, self.column)
+        if self.lo <= self.hi:
+            return (values >= self.lo) & (values <= self.hi)
+        return (values >= self.lo) | (values <= self.hi)
+
+class Members(Node):
+    def __init__(self, column: str, values: List[int]) -> None:
+        self.column, self.values = column, values
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        return np.isin(getattr(columns, self.column), self.values)
+
+class DateRange(Node):
+    def __init__(self, start: Optional[int], end: Optional[int]) -> None:
+        self.start, self.end = start, end
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        res = np.ones(len(columns.timestamps), dtype=bool)
+        if self.start is not None:
+            res &= columns.timestamps >= self.start
+        if self.end is not None:
+            res &= columns.timestamps < self.end
+        return res
+
+    def date_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        return self.start, self.end
+
+class Device(Node):
+    def __init__(self, names: List[str]) -> None:
+        self.names = set(names)
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        codes = [i for i, (name, serial) in enumerate(columns.series.devices) if name in self.names or serial in self.names]
+        return np.isin(columns.device_codes, codes)
+
+class Not(Node):
+    def __init__(self, operand: Node) -> None:
+        self.operand = operand
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        return ~self.operand.mask(columns)
+
+class And(Node):
+    def __init__(self, operands: List[Node]) -> None:
+        self.operands = operands
+
+    def mask(self, columns: Columns) -> np.ndarray:
+        res = self.operands[0].mask(columns)
+        for operand in self.operands[1:]:
+            res &= operand.mask(columns)
+        return res
+
+    def date_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        starts, ends = zip(*(operand.date_bounds() for operand in self.operands))
+        return max((s for s in starts if s is not None), default=None), min((e for e in ends if e is not None), default=None)
+
+class Or(And):
+    def mask(self, columns: Columns) -> np.ndarray:
+        res = self.operands[0].mask(columns)
+        for operand in self.operands[1:]:
+            res |= operand.mask(columns)
+        return res
+
+    def date_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        starts, ends = zip(*(operand.date_bounds() for operand in self.operands))
+        return (
+            None if None in starts else min(starts),
+            None if None in ends else max(ends)
+        )
+
+def parse_number(token: Token) -> float:
+    if token.kind != "number":
+        raise FilterError("A number was expected", token.position)
+    return float(token.text)
+
+def parse_minute(token: Token) -> int:
+    try:
+        if token.kind != "time":
+            raise ValueError
+        t = datetime.strptime(token.text, "%H:%M").time()
+    except ValueError:
+        raise FilterError("A time HH:MM was expected", token.position)
+    return t.hour * 60 + t.minute
+
+def parse_date(token: Token) -> Tuple[int, int]:
+    # The day, or the minute, the date stands for as [start, end) in ns
+    try:
+        if token.kind != "date":
+            raise ValueError
+        minute = "T" in token.text
+        d = datetime.strptime(token.text, "%Y-%m-%dT%H:%M" if minute else "%Y-%m-%d")
+    except ValueError:
+        raise FilterError("A date YYYY-MM-DD or YYYY-MM-DDTHH:MM was expected", token.position)
+    try:
+        start = to_ns(d)
+    except DateOutOfRange as e:
+        raise FilterError(str(e), token.position)
+    # The end of the last day may not fit in int64 ns
+    return start, min(start + (MINUTE_NS if minute else DAY_NS), INT64_MAX)
+
+def parse_name(names: List[str], first: int, numeric: bool) -> Callable[[Token], int]:
+    def parse(token: Token) -> int:
+        if numeric and token.kind == "number" and token.text.isdigit() and first <= int(token.text) < first + len(names):
+            return int(token.text)
+        if token.kind == "word" and token.text in names:
+            return names.index(token.text) + first
+        raise FilterError(f"One of {', '.join(names)} was expected", token.position)
+    return parse
+
+def parse_string(token: Token) -> str:
+    if token.kind != "string":
+        raise FilterError("A quoted string was expected", token.position)
+    return token.text
+
+def cyclic_range(lo: int, hi: int, size: int, first: int) -> List[int]:
+    # lo..hi may wrap around, e.g. fri..mon
+    return [(lo - first + i) % size + first for i in range((hi - lo) % size + 1)]
+
+class Parser:
+    def __init__(self, expression: str) -> None:
+        if len(expression) > MAX_LENGTH:
+            raise FilterError(f"The expression exceeds {MAX_LENGTH} characters", MAX_LENGTH)
+        self.tokens = tokenize(expression)
+        self.i = 0
+
+    @property
+    def token(self) -> Token:
+        return self.tokens[self.i]
+
+    def next(self) -> Token:
+        token = self.tokens[self.i]
+        if token.kind != "end":
+            self.i += 1
+        return token
+
+    def accept(self, kind: str, text: Optional[str] = None) -> Optional[Token]:
+        if self.token.kind == kind and (text is None or self.token.text == text):
+            return self.next()
+        return None
+
+    def expect(self, kind: str, text: str) -> Token:
+        token = self.accept(kind, text)
+        if token is None:
+            raise FilterError(f"{text!r} was expected", self.token.position)
+        return token
+
+    def parse(self) -> Node:
+        if self.token.kind == "end":
+            raise FilterError("The expression is empty", 0)
+        node = self.disjunction(0)
+        if self.token.kind != "end":
+            raise FilterError(f"Unexpected {self.token.text!r}", self.token.position)
+        return node
+
+    def disjunction(self, depth: int) -> Node:
+        operands = [self.conjunction(depth)]
+        while self.accept("word", "or"):
+            operands.append(self.conjunction(depth))
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def conjunction(self, depth: int) -> Node:
+        operands = [self.negation(depth)]
+        while self.accept("word", "and"):
+            operands.append(self.negation(depth))
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def negation(self, depth: int) -> Node:
+        if depth > MAX_DEPTH:
+            raise FilterError("The expression is nested too deeply", self.token.position)
+        if self.accept("word", "not"):
+            return Not(self.negation(depth + 1))
+        if self.accept("punct", "("):
+            node = self.disjunction(depth + 1)
+            self.expect("punct", ")")
+            return node
+        return self.predicate()
+
+    def literals(self, parse: Callable[[Token], object]) -> Tuple[List, bool]:
+        # Either lo..hi or a list of values, the flag tells a range
+        first = parse(self.next())
+        if self.accept("range"):
+            return [first, parse(self.next())], True
+        values = [first]
+        while self.accept("punct", ","):
+            values.append(parse(self.next()))
+        return values, False
+
+    def predicate(self) -> Node:
+        field = self.next()
+        if field.kind != "word" or field.text not in FIELDS:
+            raise FilterError(f"One of {', '.join(FIELDS)} was expected", field.position)
+        if self.accept("word", "in"):
+            op = "in"
+        else:
+            token = self.next()
+            if token.kind != "op":
+                raise FilterError("An operator or 'in' was expected", token.position)
+            op = token.text
+        return FIELDS[field.text](self, op, field)
+
+    def value_predicate(self, op: str, field: Token) -> Node:
+        if op != "in":
+            return Compare("values", op, parse_number(self.next()))
+        values, is_range = self.literals(parse_number)
+        if is_range and values[0] > values[1]:
+            raise FilterError("The range is empty", field.position)
+        return Interval("values", *values) if is_range else Or([Compare("values", "=", v) for v in values])
+
+    def time_predicate(self, op: str, field: Token) -> Node:
+        if op != "in":
+            return Compare("minute", op, parse_minute(self.next()))
+        values, is_range = self.literals(parse_minute)
+        return Interval("minute", *values) if is_range else Members("minute", values)
+
+    def date_predicate(self, op: str, field: Token) -> Node:
+        if op == "in":
+            values, is_range = self.literals(parse_date)
+            if is_range:
+                if values[0][0] > values[1][0]:
+                    raise FilterError("The range is empty", field.position)
+                return DateRange(values[0][0], values[1][1])
+            return Or([DateRange(*v) for v in values])
+        start, end = parse_date(self.next())
+        return {
+            "=": lambda: DateRange(start, end),
+            "!=": lambda: Or([DateRange(None, start), DateRange(end, None)]),
+            "<": lambda: DateRange(None, start),
+            "<=": lambda: DateRange(None, end),
+            ">": lambda: DateRange(end, None),
+            ">=": lambda: DateRange(start, None),
+        }[op]()
+
+    def cyclic_predicate(self, column: str, names: List[str], first: int, op: str, field: Token) -> Node:
+        # Months may be given by number, weekdays only by name
+        parse = parse_name(names, first, numeric=column == "month")
+        if op == "in":
+            if column == "weekday" and self.token.kind == "word" and self.token.text in WEEKDAY_SETS:
+                return Members(column, WEEKDAY_SETS[self.next().text])
+            values, is_range = self.literals(parse)
+            return Members(column, cyclic_range(values[0], values[1], len(names), first) if is_range else values)
+        return Compare(column, op, parse(self.next()))
+
+    def device_predicate(self, op: str, field: Token) -> Node:
+        if op == "in":
+            return Device(self.literals(parse_string)[0])
+        if op not in ("=", "!="):
+            raise FilterError("Devices can only be compared with = and !=", field.position)
+        node = Device([parse_string(self.next())])
+        return node if op == "=" else Not(node)
+
+FIELDS: Dict[str, Callable[[Parser, str, Token], Node]] = {
+    "value": Parser.value_predicate,
+    "time": Parser.time_predicate,
+    "date": Parser.date_predicate,
+    "weekday": lambda parser, op, field: parser.cyclic_predicate("weekday", WEEKDAYS, 0, op, field),
+    "month": lambda parser, op, field: parser.cyclic_predicate("month", MONTHS, 1, op, field),
+    "device": Parser.device_predicate,
+}
+
+class SampleFilter:
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self.root = Parser(expression).parse()
+        self.start_ns, self.end_ns = self.root.date_bounds()
+
+    @property
+    def start(self) -> Optional[datetime]:
+        return None if self.start_ns is None else from_ns(np.array([self.start_ns]))[0]
+
+    @property
+    def end(self) -> Optional[datetime]:
+        # Inclusive, like the end of SampleSeries.range_bounds
+        return None if self.end_ns is None else from_ns(np.array([self.end_ns - 1]))[0]
+
+    def indices(self, series: SampleSeries) -> np.ndarray:
+        """Indices of the matching points of the series, in date order."""
+        lo, hi = series.range_bounds(self.start, self.end)
+        if lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        return lo + np.flatnonzero(self.root.mask(Columns(series, lo, hi)))
+
+def cold_matches(cold: ColdTier, sample_filter: SampleFilter, limit: Optional[int] = None) -> Tuple[int, List[BloodGlucoseSample]]:
+    """Number of matching archived samples, and the first limit ones.
+
+    Only the archived months within the date bounds of the filter are read.
+    """
+    cold_series = cold.series_between(sample_filter.start, sample_filter.end)
+    indices = sample_filter.indices(cold_series)
+    return len(indices), tiering.samples_from_series(cold_series, indices[:limit])
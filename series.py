@@ -0,0 +1,141 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.resources import BloodGlucoseSample
+
+class SampleSeries:
+    """Glucose samples of a user as columns sorted by sampling date.
+
+    Timestamps are stored as int64 nanoseconds (naive datetimes, like the samples),
+    which makes range lookups a binary search.
+    """
+    def __init__(
+            self, timestamps: np.ndarray, values: np.ndarray, positions: np.ndarray,
+            device_codes: Optional[np.ndarray] = None, devices: Optional[List[Tuple[str, str]]] = None
+        ) -> None:
+        self.timestamps = timestamps
+        self.values = values
+        # Index in the samples list of each point
+        self.positions = positions
+        # Index in devices, the (device name, serial number) pairs, of each point
+        self.device_codes = np.zeros(len(timestamps), dtype=np.int32) if device_codes is None else device_codes
+        self.devices = devices or []
+        self._prefix_sums: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_samples(cls, samples: List[BloodGlucoseSample]):
+        timestamps = np.array([s.sampling_date for s in samples], dtype="datetime64[ns]").astype(np.int64)
+        values = np.array([s.value for s in samples], dtype=np.float64)
+        codes: Dict[Tuple[str, str], int] = {}
+        device_codes = np.array([codes.setdefault((s.device_name, s.device_serial_number), len(codes)) for s in samples], dtype=np.int32)
+        # Samples are already sorted, a stable sort keeps it cheap
+        order = np.argsort(timestamps, kind="stable")
+        return cls(timestamps[order], values[order], order, device_codes[order], list(codes))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def range_bounds(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.timestamps, to_ns(start), side="left"))
+        hi = len(self) if end is None else int(np.searchsorted(self.timestamps, to_ns(end), side="right"))
+        return lo, hi
+
+    @property
+    def prefix_sums(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Sums and sums of squares of values[:i] at index i
+        if self._prefix_sums is None:
+            self._prefix_sums = (
+                np.concatenate(([0.0], np.cumsum(self.values))),
+                np.concatenate(([0.0], np.cumsum(self.values * self.values)))
+            )
+        return self._prefix_sums
+
+# Dates which fit in int64 nanoseconds, numpy silently wraps around outside of them
+MIN_DATE = datetime(1677, 9, 22)
+MAX_DATE = datetime(2262, 4, 11, 23, 47, 16, 854775)
+
+class DateOutOfRange(ValueError):
+    pass
+
+def to_ns(d: datetime) -> int:
+    if not MIN_DATE <= d <= MAX_DATE:
+        raise DateOutOfRange(f"Dates must be between {MIN_DATE:%Y-%m-%d} and {MAX_DATE:%Y-%m-%d}")
+    return int(np.datetime64(d, "ns").astype(np.int64))
+
+def from_ns(timestamps: np.ndarray) -> List[datetime]:
+    return timestamps.astype("datetime64[ns]").astype("datetime64[us]").tolist()
+
+def rolling_stats(series: SampleSeries, window_ns: int, step_ns: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+    """Statistics over the windows (window end - window, window end] every step.
+
+    Each window is answered in constant time from the prefix sums, whatever its size.
+    """
+    first_end = series.timestamps[0] + window_ns if start is None else to_ns(start)
+    last_end = series.timestamps[-1] if end is None else to_ns(end)
+    window_ends = np.arange(first_end, last_end + 1, step_ns, dtype=np.int64)
+    hi = np.searchsorted(series.timestamps, window_ends, side="right")
+    lo = np.searchsorted(series.timestamps, window_ends - window_ns, side="right")
+    sums, squares_sums = series.prefix_sums
+    sizes = hi - lo
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (sums[hi] - sums[lo]) / sizes
+        variance = np.maximum((squares_sums[hi] - squares_sums[lo]) / sizes - mean * mean, 0)
+    return {
+        "window_ends": window_ends,
+        "samples_size": sizes,
+        "mean": mean,
+        "standard_deviation": np.sqrt(variance),
+        # Glucose management indicator (%) from the mean glucose in mg/dL
+        "gmi": 3.31 + 0.02392 * mean,
+    }
+
+def rounded_list(values: np.ndarray, digits: int = 2) -> List[Optional[float]]:
+    return [None if np.isnan(v) else v for v in np.round(values, digits).tolist()]
+
+def lttb_indices(timestamps: np.ndarray, values: np.ndarray, max_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets : keeps in each bucket the point forming the largest
+    triangle with the point kept in the previous bucket and the average of the next one."""
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 3:
+        # Not enough points for triangles, the ends of the range are kept
+        return np.array([0, n - 1][:max(max_points, 0)], dtype=np.int64)
+    x = (timestamps - timestamps[0]) / 1e9
+    # Bucket k covers [edges[k], edges[k+1]), first and last points are always kept
+    edges = np.floor(np.linspace(1, n - 1, max_points - 1)).astype(np.int64)
+    bucket_x = np.add.reduceat(x[:n - 1], edges[:-1]) / np.diff(edges)
+    bucket_y = np.add.reduceat(values[:n - 1], edges[:-1]) / np.diff(edges)
+    next_x = np.append(bucket_x[1:], x[-1])
+    next_y = np.append(bucket_y[1:], values[-1])
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for k in range(max_points - 2):
+        lo, hi = edges[k], edges[k + 1]
+        areas = np.abs((x[a] - next_x[k]) * (values[lo:hi] - values[a]) - (x[a] - x[lo:hi]) * (next_y[k] - values[a]))
+        a = lo + int(np.argmax(areas))
+        kept[k + 1] = a
+    return kept
+
+def min_max_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    """Keeps the lowest and highest point of max_points / 2 buckets of equal size."""
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 2:
+        return np.zeros(max(max_points, 0), dtype=np.int64)
+    n_buckets = max_points // 2
+    buckets = np.arange(n) * n_buckets // n
+    # Sorting by (bucket, value) puts each bucket's minimum first and maximum last
+    order = np.lexsort((values, buckets))
+    starts = np.searchsorted(buckets[order], np.arange(n_buckets), side="left")
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+def downsample_indices(series: SampleSeries, lo: int, hi: int, max_points: int, method: str) -> np.ndarray:
+    if method == "minmax":
+        return lo + min_max_indices(series.values[lo:hi], max_points)
+    return lo + lttb_indices(series.timestamps[lo:hi], series.values[lo:hi], max_points)
@@ -0,0 +1,159 @@
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from functools import partial
+from multiprocessing import Array
+from typing import Callable, Dict, Optional
+
+import uvicorn
+
+import env
+
+logger = logging.getLogger("flapi.server")
+
+# A worker exiting sooner than this after its start is restarted with a delay
+MIN_WORKER_LIFETIME_S = 1
+
+def bind_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", int(env.PORT)))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+class Server(uvicorn.Server):
+    def __init__(self, config: uvicorn.Config, on_shutdown: Optional[Callable[[], None]] = None) -> None:
+        super().__init__(config)
+        self.on_shutdown = on_shutdown
+
+    async def shutdown(self, sockets=None) -> None:
+        # Run on every way out : signal, or requests limit of the worker reached
+        if self.on_shutdown is not None:
+            self.on_shutdown()
+        # Event streams never end by themselves, they would hold the graceful shutdown until its timeout
+        import notifications
+        notifications.close_all()
+        await super().shutdown(sockets)
+
+def run_worker(worker_id: int, sock: socket.socket, on_shutdown: Optional[Callable[[], None]] = None) -> None:
+    # Executed in the forked process, the application is already imported
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    # Own process group, shared with its process pool : a worker killed by the arbiter takes it along
+    os.setpgid(0, 0)
+    os.environ["FLAPI_WORKER_ID"] = str(worker_id)
+    from main import app
+    from router_dependencies import engine
+    # Connections opened before the fork belong to the parent
+    engine.dispose(close=False)
+    max_requests = env.SERVER_MAX_REQUESTS + random.randint(0, env.SERVER_MAX_REQUESTS_JITTER) if env.SERVER_MAX_REQUESTS else None
+    config = uvicorn.Config(app, limit_max_requests=max_requests, lifespan="on")
+    # Uvicorn stops accepting connections on SIGTERM, waits for the requests in flight and runs the shutdown hooks
+    Server(config, on_shutdown).run(sockets=[sock])
+
+class Arbiter:
+    """Forks and supervises the workers of the production server.
+
+    The application and the most active users are loaded once before the workers are forked,
+    so that they share this memory copy-on-write.
+    """
+    def __init__(self, workers_count: int) -> None:
+        self.workers_count = workers_count
+        self.workers: Dict[int, int] = {}
+        self.started_at: Dict[int, float] = {}
+        # Start of the graceful shutdown of each worker (0 while it serves), written by the workers
+        self.draining_since = Array("d", workers_count, lock=False)
+        self.stopping = False
+        self.sock = None
+
+    def preload(self) -> None:
+        from main import app
+        from router_dependencies import engine
+        from db_engine import upgrade_schema
+        import warmup
+        upgrade_schema(engine)
+        if env.WARMUP_ENABLED:
+            warmup.preload_users()
+        engine.dispose()
+        # Objects allocated so far are never collected, the collector does not write to their pages
+        gc.freeze()
+
+    def mark_draining(self, worker_id: int) -> None:
+        # Monotonic clock of the system, comparable between processes
+        self.draining_since[worker_id] = time.monotonic()
+
+    def spawn(self, worker_id: int) -> None:
+        self.draining_since[worker_id] = 0
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(worker_id, self.sock, partial(self.mark_draining, worker_id))
+            finally:
+                os._exit(0)
+        self.workers[pid] = worker_id
+        self.started_at[pid] = time.monotonic()
+
+    def stop(self, signum, frame) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("Stopping %d workers", len(self.workers))
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        self.preload()
+        self.sock = bind_socket()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker_id in range(self.workers_count):
+            self.spawn(worker_id)
+        stop_deadline = None
+        while self.workers:
+            now = time.monotonic()
+            if self.stopping and stop_deadline is None:
+                stop_deadline = now + env.SERVER_GRACEFUL_TIMEOUT_S
+            for pid, worker_id in self.workers.items():
+                # Workers recycled after their requests limit shut down by themselves, with the same timeout
+                draining_since = self.draining_since[worker_id]
+                if (stop_deadline is not None and now > stop_deadline) or (draining_since and now > draining_since + env.SERVER_GRACEFUL_TIMEOUT_S):
+                    # Requests still running after the graceful timeout are abandoned
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            worker_id = self.workers.pop(pid, None)
+            lifetime = time.monotonic() - self.started_at.pop(pid, 0)
+            if worker_id is None or self.stopping:
+                continue
+            # Worker which reached its requests limit or crashed
+            logger.info("Worker %d (pid %d) exited, restarting it", worker_id, pid)
+            if lifetime < MIN_WORKER_LIFETIME_S:
+                time.sleep(MIN_WORKER_LIFETIME_S)
+            self.spawn(worker_id)
+        self.sock.close()
+
+def serve() -> None:
+    if env.SERVER_WORKERS <= 1 or not hasattr(os, "fork"):
+        from main import app
+        from router_dependencies import engine
+        from db_engine import upgrade_schema
+        upgrade_schema(engine)
+        Server(uvicorn.Config(app, host="0.0.0.0", port=int(env.PORT))).run()
+        return
+    Arbiter(env.SERVER_WORKERS).run()
+
+if __name__ == "__main__":
+    serve()
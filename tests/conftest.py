@@ -0,0 +1,66 @@
+import csv
+import os
+from datetime import datetime
+from typing import List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from benchmarks.loadtest import USERS_DATA_COLUMNS
+from models.database import Base, SecretSignature
+import query_stats
+import utils
+
+USERNAME = "John_Doe"
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    query_stats.instrument_engine(engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session.add(SecretSignature(secret_value="test", generation_date=datetime.now()))
+    session.commit()
+    utils.invalidate_signature_cache()
+    utils.add_new_user(session, "John", "Doe", "john.doe@example.com", "password")
+    yield session
+    session.close()
+
+def new_token(db, samples_access: bool = True) -> str:
+    return utils.add_new_token(db, "John", "Doe", "password", True, samples_access, True, True).access_token
+
+@pytest.fixture
+def client(db, tmp_path, monkeypatch):
+    # User files are written relatively to the working directory
+    monkeypatch.chdir(tmp_path)
+    from main import app
+    from router_dependencies import get_db
+    app.dependency_overrides[get_db] = lambda: db
+    # Not entered as a context manager : the startup hooks (warm-up, purge schedule) are not run
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {new_token(db)}"
+    yield client
+    app.dependency_overrides.clear()
+    from router_dependencies import forget_user_data
+    forget_user_data(USERNAME)
+    # Worker processes keep the working directory they were started in
+    import workers
+    workers.shutdown_process_pool()
+
+def write_samples(samples: List[Tuple[str, str, datetime, int]], retention_days: int = 90) -> None:
+    """Writes the data file of the test user, samples as (device name, serial number, date, value)."""
+    os.makedirs("users_data", exist_ok=True)
+    with open(os.path.join("users_data", USERNAME + ".csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Données de glycémie", "Date de création", datetime.now().strftime("%d-%m-%Y %H:%M"), "Créé par", "test"])
+        writer.writerow(USERS_DATA_COLUMNS)
+        for device_name, serial, sampling_date, value in samples:
+            row = [""] * len(USERS_DATA_COLUMNS)
+            row[0], row[1], row[2], row[3], row[4] = device_name, serial, sampling_date.strftime("%d-%m-%Y %H:%M"), "0", str(value)
+            writer.writerow(row)
+    # Months before the hot window are archived when the file is loaded
+    with open("tiering_settings.json", "w") as f:
+        f.write(f'{{"retention_days": {retention_days}}}')
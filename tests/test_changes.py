@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import USERNAME, write_samples
+from router_dependencies import cold_tiers, samples_collection
+
+LIBRE, DEXCOM = ("FreeStyle LibreLink", "ABC123"), ("Dexcom G6", "DEF456")
+START = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+
+def at(minutes: int) -> datetime:
+    return START + timedelta(minutes=minutes)
+
+def changes(client, since=0, limit=None):
+    r = client.get(f"/user/{USERNAME}/samples/changes", params={"since": since, **({"limit": limit} if limit else {})})
+    assert r.status_code == 200, r.text
+    res = r.json()
+    return [(s["device_serial_number"], datetime.fromisoformat(s["sampling_date"]), s["value"]) for s in res["samples"]], res["cursor"], res["has_more"]
+
+def latest(client, n_latest=None):
+    r = client.get(f"/user/{USERNAME}/samples/latest", params={"n_latest": n_latest} if n_latest else {})
+    assert r.status_code == 200, r.text
+    return [(datetime.fromisoformat(s["sampling_date"]), s["value"]) for s in r.json()]
+
+def test_changes_since_a_cursor(client):
+    write_samples([(*LIBRE, at(0), 100), (*LIBRE, at(15), 110), (*LIBRE, at(30), 120)])
+    assert changes(client) == ([("ABC123", at(0), 100), ("ABC123", at(15), 110), ("ABC123", at(30), 120)], 3, False)
+    assert changes(client, limit=2) == ([("ABC123", at(0), 100), ("ABC123", at(15), 110)], 2, True)
+    assert changes(client, since=2) == ([("ABC123", at(30), 120)], 3, False)
+    assert changes(client, since=3) == ([], 3, False)
+
+@pytest.mark.parametrize("since", [4, 1000])
+def test_cursor_beyond_the_log(client, since):
+    write_samples([(*LIBRE, at(0), 100), (*LIBRE, at(15), 110), (*LIBRE, at(30), 120)])
+    r = client.get(f"/user/{USERNAME}/samples/changes", params={"since": since})
+    assert r.status_code == 410
+
+def test_devices_sharing_a_sampling_date(client):
+    write_samples([(*LIBRE, at(0), 100), (*DEXCOM, at(0), 105), (*LIBRE, at(15), 110), (*DEXCOM, at(15), 110)])
+    samples, cursor, _ = changes(client)
+    assert sorted(samples) == sorted([("ABC123", at(0), 100), ("DEF456", at(0), 105), ("ABC123", at(15), 110), ("DEF456", at(15), 110)])
+    assert cursor == 4
+
+def test_samples_removed_or_corrected_by_an_upload(client):
+    write_samples([(*LIBRE, at(0), 100), (*LIBRE, at(15), 110), (*LIBRE, at(30), 120)])
+    assert changes(client)[1] == 3
+    # The second sample is removed, the third one corrected and a fourth one added
+    write_samples([(*LIBRE, at(0), 100), (*LIBRE, at(30), 125), (*LIBRE, at(45), 130)])
+    assert changes(client) == ([("ABC123", at(0), 100), ("ABC123", at(30), 125), ("ABC123", at(45), 130)], 5, False)
+    # A client synchronized up to the former cursor only gets the new values
+    assert changes(client, since=3) == ([("ABC123", at(30), 125), ("ABC123", at(45), 130)], 5, False)
+    # Sequence numbers of the skipped samples are not reused
+    assert changes(client, since=1, limit=1) == ([], 2, True)
+
+def test_changes_of_archived_samples(client):
+    start = START - timedelta(days=200)
+    samples = [(*LIBRE, start + timedelta(hours=i), 40 + (i * 37) % 300) for i in range(200 * 24)]
+    write_samples(samples, retention_days=30)
+    res, cursor, has_more = changes(client, limit=10000)
+    assert res == [(serial, date, value) for _, serial, date, value in samples]
+    assert (cursor, has_more) == (len(samples), False)
+    # Pages starting in the cold tier and ending in the hot one
+    cold_end = next(i for i, s in enumerate(samples) if s[2] >= cold_tiers[USERNAME].hot_start)
+    assert 0 < cold_end < len(samples)
+    assert changes(client, since=cold_end - 5, limit=10)[0] == res[cold_end - 5:cold_end + 5]
+
+@pytest.mark.parametrize("n_latest, expected", [(None, 3), (1, 1), (2, 2), (3, 3), (10, 3)])
+def test_latest_samples_of_a_short_series(client, n_latest, expected):
+    write_samples([(*LIBRE, at(0), 100), (*LIBRE, at(15), 110), (*LIBRE, at(30), 120)])
+    assert latest(client, n_latest) == [(at(0), 100), (at(15), 110), (at(30), 120)][3 - expected:]
+
+def test_latest_samples_reaching_the_cold_tier(client):
+    start = START - timedelta(days=100)
+    samples = [(*LIBRE, start + timedelta(hours=i), 40 + (i * 37) % 300) for i in range(100 * 24)]
+    write_samples(samples, retention_days=30)
+    assert latest(client) == [(date, value) for _, _, date, value in samples[-5:]]
+    assert latest(client, 1) == [(samples[-1][2], samples[-1][3])]
+    assert len(samples_collection[USERNAME]) < 2000
+    assert latest(client, 2000) == [(date, value) for _, _, date, value in samples[-2000:]]
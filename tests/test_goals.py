@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import USERNAME
+from models.database import Goal
+import utils
+
+GOALS_URL = f"/user/{USERNAME}/goals"
+
+@pytest.fixture
+def goals(client):
+    r = client.post(GOALS_URL, json=[{"title": "A"}, {"title": "B"}, {"title": "C"}])
+    assert r.status_code == 200
+    return {g["title"]: g["id"] for g in r.json()}
+
+def titles(db):
+    db.expire_all()
+    return {g.id: g.title for g in db.query(Goal).all()}
+
+def test_add_goals_rejects_duplicated_titles(client, goals, db):
+    r = client.post(GOALS_URL, json=[{"title": "D"}, {"title": "D"}])
+    assert r.status_code == 403
+    r = client.post(GOALS_URL, json=[{"title": "E"}, {"title": "A"}])
+    assert r.status_code == 403
+    # Nothing added, not even the goals with an available title
+    assert sorted(titles(db).values()) == ["A", "B", "C"]
+
+@pytest.mark.parametrize("updates, expected", [
+    # Title of another goal of the batch which keeps it
+    ([{"id": "A", "title": "B"}, {"id": "B"}], 403),
+    ([{"id": "A", "title": "B"}], 403),
+    # Same new title twice
+    ([{"id": "A", "title": "D"}, {"id": "B", "title": "D"}], 403),
+    # Foreign or unknown goal
+    ([{"id": "A", "title": "D"}, {"id": 1000}], 403),
+])
+def test_update_goals_is_all_or_nothing(client, goals, db, updates, expected):
+    before = titles(db)
+    body = [{**u, "id": goals.get(u["id"], u["id"])} for u in updates]
+    r = client.patch(GOALS_URL, json=body)
+    assert r.status_code == expected
+    assert titles(db) == before
+
+def test_update_goals_swaps_titles(client, goals, db):
+    r = client.patch(GOALS_URL, json=[
+        {"id": goals["A"], "title": "B"}, {"id": goals["B"], "title": "C"}, {"id": goals["C"], "title": "A", "status": "completed"}
+    ])
+    assert r.status_code == 200
+    assert titles(db) == {goals["A"]: "B", goals["B"]: "C", goals["C"]: "A"}
+    assert {g["title"]: g["status"] for g in r.json()}["A"] == "completed"
+
+def test_update_goals_rejects_a_null_title(client, goals):
+    r = client.patch(GOALS_URL, json=[{"id": goals["A"], "title": None}])
+    assert r.status_code == 422
+
+def test_update_goals_of_another_user(client, goals, db):
+    utils.add_new_user(db, "Jane", "Roe", "jane.roe@example.com", "password")
+    token = utils.add_new_token(db, "Jane", "Roe", "password", True, True, True, True).access_token
+    r = client.patch("/user/Jane_Roe/goals", json=[{"id": goals["A"], "title": "D"}], headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 403
+    assert titles(db)[goals["A"]] == "A"
+
+def test_remove_goals_is_all_or_nothing(client, goals, db):
+    r = client.delete(GOALS_URL, params={"ids": [goals["A"], 1000]})
+    assert r.status_code == 403
+    assert len(titles(db)) == 3
+    r = client.delete(GOALS_URL, params={"ids": [goals["A"], goals["B"]]})
+    assert r.status_code == 200
+    assert list(titles(db).values()) == ["C"]
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import SecurityScopes
+
+from conftest import new_token
+from router_dependencies import get_authorized_user
+import query_stats
+
+def test_authorization_reads_the_token_once(db):
+    token = new_token(db)
+    with query_stats.assert_max_queries(2) as stats:
+        user = asyncio.run(get_authorized_user(SecurityScopes(["samples"]), db, token))
+    assert user.firstname == "John"
+    assert stats.repeated_statements(threshold=2) == []
+
+def test_authorization_checks_the_scopes(db):
+    token = new_token(db, samples_access=False)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_authorized_user(SecurityScopes(["samples"]), db, token))
+    assert e.value.status_code == 403
+
+def test_authorization_of_an_unknown_token(db):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_authorized_user(SecurityScopes([]), db, "unknown"))
+    assert e.value.status_code == 404
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import USERNAME, write_samples
+from models.resources import BloodGlucoseSample
+from router_dependencies import cold_tiers
+from sample_filters import FilterError, SampleFilter
+from series import SampleSeries, to_ns
+
+DEVICES = [("FreeStyle LibreLink", "ABC123"), ("Dexcom G6", "DEF456")]
+
+# Every 97 minutes over 400 days : every time of day, weekday and month is reached
+SAMPLES = [
+    BloodGlucoseSample(
+        device_name=DEVICES[i % 2][0], device_serial_number=DEVICES[i % 2][1],
+        sampling_date=datetime(2023, 1, 1) + timedelta(minutes=97 * i), value=(i * 37) % 300 + 40
+    )
+    for i in range(400 * 24 * 60 // 97)
+]
+SERIES = SampleSeries.from_samples(SAMPLES)
+
+def minutes(s: BloodGlucoseSample) -> int:
+    return s.sampling_date.hour * 60 + s.sampling_date.minute
+
+@pytest.mark.parametrize("expression, expected", [
+    # and binds tighter than or, not tighter than and
+    ("value > 300 or value < 70 and time >= 12:00", lambda s: s.value > 300 or (s.value < 70 and minutes(s) >= 720)),
+    ("not value > 180 and value > 100", lambda s: 100 < s.value <= 180),
+    ("not (value > 180 or value < 70)", lambda s: 70 <= s.value <= 180),
+    ("(value > 300 or value < 70) and weekday = sun", lambda s: (s.value > 300 or s.value < 70) and s.sampling_date.weekday() == 6),
+    ("not not value = 40", lambda s: s.value == 40),
+    ("value in 70..180", lambda s: 70 <= s.value <= 180),
+    ("value in 40, 77", lambda s: s.value in (40, 77)),
+    # Ranges wrapping around midnight and the end of the year
+    ("time in 22:00..06:00", lambda s: minutes(s) >= 22 * 60 or minutes(s) <= 6 * 60),
+    ("time in 06:00..22:00", lambda s: 6 * 60 <= minutes(s) <= 22 * 60),
+    ("month in 11..2", lambda s: s.sampling_date.month in (11, 12, 1, 2)),
+    ("month in dec..feb", lambda s: s.sampling_date.month in (12, 1, 2)),
+    ("month in jan, jul", lambda s: s.sampling_date.month in (1, 7)),
+    ("month != 3", lambda s: s.sampling_date.month != 3),
+    # Weekday ranges and sets
+    ("weekday in weekend", lambda s: s.sampling_date.weekday() >= 5),
+    ("weekday in weekdays", lambda s: s.sampling_date.weekday() < 5),
+    ("weekday in fri..mon", lambda s: s.sampling_date.weekday() in (4, 5, 6, 0)),
+    ("weekday in mon, wed", lambda s: s.sampling_date.weekday() in (0, 2)),
+    ("weekday >= sat", lambda s: s.sampling_date.weekday() >= 5),
+    # Dates stand for the whole day, or minute
+    ("date = 2023-03-05", lambda s: s.sampling_date.date() == datetime(2023, 3, 5).date()),
+    ("date != 2023-03-05", lambda s: s.sampling_date.date() != datetime(2023, 3, 5).date()),
+    ("date > 2023-03-05", lambda s: s.sampling_date >= datetime(2023, 3, 6)),
+    ("date <= 2023-03-05", lambda s: s.sampling_date < datetime(2023, 3, 6)),
+    ("date >= 2023-03-05T12:00", lambda s: s.sampling_date >= datetime(2023, 3, 5, 12)),
+    ("date in 2023-03-01..2023-03-31", lambda s: datetime(2023, 3, 1) <= s.sampling_date < datetime(2023, 4, 1)),
+    ("date in 2023-03-01, 2023-06-01", lambda s: s.sampling_date.date() in (datetime(2023, 3, 1).date(), datetime(2023, 6, 1).date())),
+    ("device = \"Dexcom G6\"", lambda s: s.device_name == "Dexcom G6"),
+    ("device != 'ABC123'", lambda s: s.device_serial_number != "ABC123"),
+    ("device in 'ABC123', 'unknown'", lambda s: s.device_serial_number == "ABC123"),
+    ("VALUE > 300 AND Month = Jan", lambda s: s.value > 300 and s.sampling_date.month == 1),
+])
+def test_filter_matches(expression, expected):
+    indices = SampleFilter(expression).indices(SERIES)
+    assert indices.tolist() == [i for i, s in enumerate(SAMPLES) if expected(s)]
+
+def ns(*args: int) -> int:
+    return to_ns(datetime(*args))
+
+@pytest.mark.parametrize("expression, bounds", [
+    ("value > 180", (None, None)),
+    ("date = 2023-03-05", (ns(2023, 3, 5), ns(2023, 3, 6))),
+    ("date >= 2023-03-05 and date < 2023-04-01 and value > 180", (ns(2023, 3, 5), ns(2023, 4, 1))),
+    # Union of the bounds, unbounded as soon as one operand is
+    ("date = 2023-03-05 or date = 2023-06-01", (ns(2023, 3, 5), ns(2023, 6, 2))),
+    ("date = 2023-03-05 or value > 180", (None, None)),
+    ("date < 2023-03-05 or date = 2023-06-01", (None, ns(2023, 6, 2))),
+    # The complement of a range is not a range
+    ("not date = 2023-03-05", (None, None)),
+    ("date != 2023-03-05", (None, None)),
+    ("not date = 2023-03-05 and date >= 2023-01-01", (ns(2023, 1, 1), None)),
+])
+def test_date_bounds(expression, bounds):
+    assert SampleFilter(expression).root.date_bounds() == bounds
+
+@pytest.mark.parametrize("expression, position, message", [
+    ("", 0, "The expression is empty"),
+    ("value >", 7, "A number was expected"),
+    ("value > 180 and", 15, "One of value"),
+    ("tim > 10:00", 0, "One of value"),
+    ("value 180", 6, "An operator or 'in' was expected"),
+    ("value in 180..70", 0, "The range is empty"),
+    ("time = 25:00", 7, "A time HH:MM was expected"),
+    ("date >= 2023-02-30", 8, "A date YYYY-MM-DD"),
+    ("date >= 2300-01-01", 8, "Dates must be between"),
+    ("weekday = 1", 10, "One of mon"),
+    ("device > 'x'", 0, "Devices can only be compared"),
+    ("(value > 1", 10, "')' was expected"),
+    ("value > 1 )", 10, "Unexpected ')'"),
+    ("value > 1 $", 10, "Unexpected character '$'"),
+    ("(" * 40 + "value > 1" + ")" * 40, 33, "nested too deeply"),
+    ("value > 1 or " * 100 + "value > 1", 1000, "exceeds 1000 characters"),
+])
+def test_filter_errors(expression, position, message):
+    with pytest.raises(FilterError) as e:
+        SampleFilter(expression)
+    assert e.value.position == position
+    assert message in str(e.value)
+
+def test_filter_outside_of_the_series():
+    assert len(SampleFilter("date >= 2262-04-10").indices(SERIES)) == 0
+    assert len(SampleFilter("date < 2000-01-01").indices(SERIES)) == 0
+
+@pytest.fixture
+def tiered_samples(client):
+    # Both tiers : the months before the last 30 days are archived
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=200)
+    samples = [("FreeStyle LibreLink", "ABC123", start + timedelta(hours=i), 40 + (i * 37) % 300) for i in range(200 * 24)]
+    write_samples(samples, retention_days=30)
+    return samples
+
+def query(client, expression, limit=None):
+    r = client.get(f"/user/{USERNAME}/samples/query", params={"filter": expression, **({"limit": limit} if limit else {})})
+    assert r.status_code == 200, r.text
+    return int(r.headers["X-Total-Count"]), [(datetime.fromisoformat(s["sampling_date"]), s["value"]) for s in r.json()]
+
+@pytest.mark.parametrize("expression", ["value > 250", "value > 250 and weekday in weekend", "value = 1000"])
+@pytest.mark.parametrize("limit", [None, 1, 10, 100000])
+def test_query_merges_both_tiers(client, tiered_samples, expression, limit):
+    sample_filter = SampleFilter(expression)
+    series = SampleSeries.from_samples([
+        BloodGlucoseSample(device_name=d, device_serial_number=s, sampling_date=t, value=v) for d, s, t, v in tiered_samples
+    ])
+    expected = [(tiered_samples[i][2], tiered_samples[i][3]) for i in sample_filter.indices(series)]
+    total, res = query(client, expression, limit)
+    assert cold_tiers[USERNAME].hot_start > tiered_samples[0][2]
+    # Date order across the tiers, the total counts the samples beyond the limit
+    assert total == len(expected)
+    assert res == expected[:limit]
+
+def test_query_rejects_an_invalid_filter(client, tiered_samples):
+    r = client.get(f"/user/{USERNAME}/samples/query", params={"filter": "date >= 2300-01-01"})
+    assert r.status_code == 400
+    assert "position 8" in r.json()["detail"]
@@ -0,0 +1,241 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from models import resources
+from models.resources import BloodGlucoseSample
+from series import SampleSeries, from_ns, to_ns
+import env
+
+# Changed at runtime by the admins, see /admin/tiering
+retention_days = env.HOT_RETENTION_DAYS
+# Modification time of the settings file retention_days was read from
+settings_mtime: Optional[int] = None
+
+def refresh_settings() -> bool:
+    """Reads the settings file again if it was replaced, by another server worker for instance.
+
+    Returns True when the retention window changed.
+    """
+    global retention_days, settings_mtime
+    try:
+        mtime = os.stat(env.TIERING_SETTINGS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == settings_mtime:
+        return False
+    previous = retention_days
+    try:
+        with open(env.TIERING_SETTINGS_PATH) as f:
+            retention_days = resources.TieringSettings.parse_raw(f.read()).retention_days
+    except FileNotFoundError:
+        retention_days = env.HOT_RETENTION_DAYS
+    settings_mtime = mtime
+    return retention_days != previous
+
+def save_settings(settings: resources.TieringSettings) -> None:
+    tmp_path = f"{env.TIERING_SETTINGS_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(settings.json())
+    os.replace(tmp_path, env.TIERING_SETTINGS_PATH)
+
+MANIFEST = "manifest.json"
+
+@contextmanager
+def locked(directory: str, shared: bool = False) -> Iterator[None]:
+    # Server workers, ingest jobs and the warm-up may split the same user at once, readers wait for them
+    os.makedirs(os.path.dirname(directory) or ".", exist_ok=True)
+    with open(directory + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+class ColdTier:
+    """Months of samples and records of a user older than the hot window, archived on disk.
+
+    Only the monthly rollups stay in memory, a month is read back when a query reaches it.
+    """
+    def __init__(self, directory: str, rollups: List[resources.MonthRollup], hot_start: datetime, record_months: Optional[List[date]] = None) -> None:
+        self.directory = directory
+        self.rollups = rollups
+        # Months with archived records, some have records but no samples (notes, insulin only)
+        self.record_months = record_months or []
+        # Every archived sample is older than this date
+        self.hot_start = hot_start
+        self.month_starts = np.array([to_ns(datetime.combine(r.month, datetime.min.time())) for r in rollups], dtype=np.int64)
+
+    @property
+    def samples_size(self) -> int:
+        return sum(r.samples_size for r in self.rollups)
+
+    def months_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[date]:
+        # The month of start is included even if it starts before
+        lo = 0 if start is None else max(int(np.searchsorted(self.month_starts, to_ns(start), side="right")) - 1, 0)
+        hi = len(self.rollups) if end is None else int(np.searchsorted(self.month_starts, to_ns(end), side="right"))
+        return [r.month for r in self.rollups[lo:hi]]
+
+    def series_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> SampleSeries:
+        # Columns of the archived samples in the range, there is no samples list behind positions
+        devices: Dict[Tuple[str, str], int] = {}
+        parts = []
+        with locked(self.directory, shared=True):
+            months = []
+            for month in self.months_between(start, end):
+                try:
+                    months.append(read_month_archive(self.directory, month))
+                except FileNotFoundError:
+                    # Removed by a split of newer data, which is loaded again by the next request
+                    pass
+        for timestamps, values, device_codes, month_devices in months:
+            lo = 0 if start is None else int(np.searchsorted(timestamps, to_ns(start), side="left"))
+            hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, to_ns(end), side="right"))
+            # Each archive has its own device table
+            remap = np.array([devices.setdefault(pair, len(devices)) for pair in month_devices], dtype=np.int32)
+            parts.append((timestamps[lo:hi], values[lo:hi], remap[device_codes[lo:hi]]))
+        if not parts:
+            return SampleSeries(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64))
+        timestamps, values, device_codes = (np.concatenate(columns) for columns in zip(*parts))
+        return SampleSeries(timestamps, values.astype(np.float64), np.arange(len(timestamps)), device_codes, list(devices))
+
+    def samples_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[BloodGlucoseSample]:
+        cold_series = self.series_between(start, end)
+        return samples_from_series(cold_series, cold_series.positions)
+
+    def records_between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+        # None when the range reaches no archived record
+        first = None if start is None else date(start.year, start.month, 1)
+        months = [m for m in self.record_months if (first is None or m >= first) and (end is None or m <= end.date())]
+        frames = []
+        with locked(self.directory, shared=True):
+            for month in months:
+                try:
+                    frames.append(pd.read_pickle(records_archive_path(self.directory, month)))
+                except FileNotFoundError:
+                    pass
+        if not frames:
+            return None
+        records = pd.concat(frames, ignore_index=True)
+        dates = records["sampling_date"]
+        lo = 0 if start is None else int(dates.searchsorted(start, side="left"))
+        hi = len(records) if end is None else int(dates.searchsorted(end, side="right"))
+        return records.iloc[lo:hi]
+
+def samples_from_series(series: SampleSeries, indices: np.ndarray) -> List[BloodGlucoseSample]:
+    devices = [series.devices[code] for code in series.device_codes[indices].tolist()]
+    return [
+        BloodGlucoseSample(device_name=d, device_serial_number=s, sampling_date=t, value=v)
+        for t, v, (d, s) in zip(from_ns(series.timestamps[indices]), series.values[indices].astype(np.int64).tolist(), devices)
+    ]
+
+def month_rollups(timestamps: np.ndarray, values: np.ndarray) -> List[resources.MonthRollup]:
+    if len(timestamps) == 0:
+        return []
+    months = timestamps.astype("datetime64[ns]").astype("datetime64[M]")
+    starts = np.flatnonzero(np.concatenate(([True], months[1:] != months[:-1])))
+    sizes = np.diff(np.append(starts, len(values)))
+    means = np.add.reduceat(values, starts) / sizes
+    variances = np.maximum(np.add.reduceat(values * values, starts) / sizes - means * means, 0)
+    return [
+        resources.MonthRollup(
+            month=month, samples_size=size, minimum=minimum, maximum=maximum,
+            mean=round(mean, 2), standard_deviation=round(std, 2)
+        )
+        for month, size, minimum, maximum, mean, std in zip(
+            months[starts].astype("datetime64[D]").tolist(), sizes.tolist(),
+            np.minimum.reduceat(values, starts).tolist(), np.maximum.reduceat(values, starts).tolist(),
+            means.tolist(), np.sqrt(variances).tolist()
+        )
+    ]
+
+def month_archive_path(directory: str, month: date) -> str:
+    return os.path.join(directory, f"{month:%Y-%m}.npz")
+
+def records_archive_path(directory: str, month: date) -> str:
+    return os.path.join(directory, f"{month:%Y-%m}.records.pkl")
+
+def read_month_archive(directory: str, month: date) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Tuple[str, str]]]:
+    with np.load(month_archive_path(directory, month)) as archive:
+        return archive["timestamps"], archive["values"], archive["device_codes"], list(zip(archive["devices"].tolist(), archive["serials"].tolist()))
+
+def write_month_archive(directory: str, month: date, samples: List[BloodGlucoseSample]) -> None:
+    device_pairs = [(s.device_name, s.device_serial_number) for s in samples]
+    pairs = list(dict.fromkeys(device_pairs))
+    codes = {pair: i for i, pair in enumerate(pairs)}
+    path = month_archive_path(directory, month)
+    # Written aside then renamed, a reader never sees a partial archive
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(
+            f,
+            timestamps=np.array([s.sampling_date for s in samples], dtype="datetime64[ns]").astype(np.int64),
+            values=np.array([s.value for s in samples], dtype=np.int64),
+            device_codes=np.array([codes[pair] for pair in device_pairs], dtype=np.int32),
+            devices=np.array([p[0] for p in pairs], dtype=str),
+            serials=np.array([p[1] for p in pairs], dtype=str)
+        )
+    os.replace(tmp_path, path)
+
+def write_records_archive(directory: str, month: date, records: pd.DataFrame) -> None:
+    path = records_archive_path(directory, month)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    records.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+def remove_archives(directory: str, keep: Set[str] = frozenset()) -> None:
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename not in keep and (filename.endswith((".npz", ".pkl")) or filename == MANIFEST):
+            os.remove(os.path.join(directory, filename))
+
+def hot_window_start(last_sample_date: datetime, days: int) -> datetime:
+    # Whole months are archived : the hot window starts on the first day of a month
+    start = last_sample_date - timedelta(days=days)
+    return datetime(start.year, start.month, 1)
+
+def split_user_data(samples: List[BloodGlucoseSample], records: pd.DataFrame, directory: str, days: int) -> Tuple[List[BloodGlucoseSample], pd.DataFrame, Optional[ColdTier]]:
+    """Archives the months before the hot window, returns the hot samples, the hot records and the cold tier."""
+    hot_start = hot_window_start(samples[-1].sampling_date, days)
+    n_cold = next((i for i, s in enumerate(samples) if s.sampling_date >= hot_start), len(samples))
+    cold, hot = samples[:n_cold], samples[n_cold:]
+    if not cold:
+        with locked(directory):
+            remove_archives(directory)
+        return hot, records, None
+    n_cold_records = int(records["sampling_date"].searchsorted(hot_start, side="left"))
+    cold_records, hot_records = records.iloc[:n_cold_records], records.iloc[n_cold_records:].reset_index(drop=True)
+    record_months = cold_records["sampling_date"].dt.to_period("M")
+    record_month_starts = [period.start_time.date() for period in record_months.unique()]
+    timestamps = np.array([s.sampling_date for s in cold], dtype="datetime64[ns]").astype(np.int64)
+    values = np.array([s.value for s in cold], dtype=np.float64)
+    rollups = month_rollups(timestamps, values)
+    signature = {
+        "hot_start": hot_start.isoformat(), "samples_size": len(cold), "values_sum": float(values.sum()), "last": int(timestamps[-1]),
+        "records_size": len(cold_records), "records_hash": int(pd.util.hash_pandas_object(cold_records, index=False).sum())
+    }
+    manifest_path = os.path.join(directory, MANIFEST)
+    with locked(directory):
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                up_to_date = json.load(f) == signature
+        except (OSError, ValueError):
+            up_to_date = False
+        if not up_to_date:
+            os.makedirs(directory, exist_ok=True)
+            month_bounds = np.flatnonzero(np.concatenate(([True], np.diff(timestamps.astype("datetime64[ns]").astype("datetime64[M]").astype(np.int64)) != 0)))
+            for rollup, lo, hi in zip(rollups, month_bounds, np.append(month_bounds[1:], len(cold))):
+                write_month_archive(directory, rollup.month, cold[lo:hi])
+            for month, month_records in cold_records.groupby(record_months):
+                write_records_archive(directory, month.start_time.date(), month_records)
+            # Months back in the hot window since the last split
+            remove_archives(directory, keep={f"{r.month:%Y-%m}.npz" for r in rollups} | {f"{m:%Y-%m}.records.pkl" for m in record_month_starts})
+            tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(signature, f)
+            os.replace(tmp_path, manifest_path)
+    return hot, hot_records, ColdTier(directory, rollups, hot_start, record_month_starts)
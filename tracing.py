@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import env
+
+enabled = env.TRACING_ENABLED
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_time", "start", "duration_ms", "error", "token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        current_span.reset(self.token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.finish()
+
+    def finish(self) -> None:
+        self.duration_ms = round((time.perf_counter() - self.start) * 1000, 3)
+        collected = collected_spans.get()
+        if collected is not None:
+            collected.append(self.to_dict())
+        else:
+            export(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+            "pid": os.getpid(),
+        }
+
+class NoopSpan:
+    # Returned while tracing is disabled, so instrumented code does not have to check
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+# (trace id, span id) of the remote parent of the spans started in a worker process
+SpanContext = Tuple[str, Optional[str]]
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+remote_parent: ContextVar[Optional[SpanContext]] = ContextVar("remote_parent", default=None)
+# Set in worker processes, their spans are sent back to the application with the result
+collected_spans: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("collected_spans", default=None)
+
+ring: Deque[Dict[str, Any]] = deque(maxlen=env.TRACING_RING_SIZE)
+file_lock = threading.Lock()
+
+def export(span: Dict[str, Any]) -> None:
+    ring.append(span)
+    if env.TRACING_FILE:
+        line = json.dumps(span, default=str)
+        with file_lock, open(env.TRACING_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def span(name: str, trace_id: Optional[str] = None, **attributes: Any):
+    if not enabled:
+        return NOOP_SPAN
+    parent = current_span.get()
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+    remote = remote_parent.get()
+    if remote is not None:
+        return Span(name, remote[0], remote[1], attributes)
+    return Span(name, trace_id or os.urandom(16).hex(), None, attributes)
+
+def traced(name: str):
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_context() -> Optional[SpanContext]:
+    parent = current_span.get()
+    return (parent.trace_id, parent.span_id) if parent is not None else None
+
+def call_in_context(context: SpanContext, fn: Callable, *args: Any) -> Tuple[Any, List[Dict[str, Any]]]:
+    # Runs in a worker process : the spans are returned instead of being exported there
+    def run():
+        remote_parent.set(context)
+        collected_spans.set([])
+        try:
+            return fn(*args), collected_spans.get()
+        except Exception as e:
+            # The spans of a failed call are kept too
+            e.spans = collected_spans.get()
+            raise
+    return copy_context().run(run)
+
+def export_all(spans: List[Dict[str, Any]]) -> None:
+    for s in spans:
+        export(s)
+
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    match = TRACEPARENT.match(value.strip().lower()) if value else None
+    return (match.group(1), match.group(2)) if match else None
+
+class TracingMiddleware:
+    """Starts the root span of each request.
+
+    A W3C `traceparent` header continues the caller's trace, the trace id is sent back in `X-Trace-Id`.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        remote = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        token = remote_parent.set(remote)
+        request_span = span(f"{scope['method']} {scope['path']}", method=scope["method"], path=scope["path"])
+
+        async def send_with_trace_id(message) -> None:
+            if message["type"] == "http.response.start":
+                request_span.set_attribute("status_code", message["status"])
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", request_span.trace_id.encode())]
+            await send(message)
+
+        try:
+            with request_span:
+                await self.app(scope, receive, send_with_trace_id)
+        finally:
+            remote_parent.reset(token)
+
+def instrument_engine(engine) -> None:
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Queries run outside of a traced operation (background jobs) are not recorded
+        if current_span.get() is not None:
+            context._trace_span = span("sql", statement=statement[:200], executemany=executemany)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        s = getattr(context, "_trace_span", None)
+        if s is not None:
+            s.finish()
+
+    def handle_error(exception_context):
+        s = getattr(exception_context.execution_context, "_trace_span", None)
+        if s is not None:
+            s.error = type(exception_context.original_exception).__name__
+            s.finish()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
@@ -1,15 +1,19 @@
 import hashlib
+import secrets
 from typing import Literal, Optional, Tuple, Dict, List
 from pathlib import Path
 import os
-from datetime import datetime as dt, time, timedelta as tdelta
+from time import monotonic
+from datetime import datetime as dt, time, timedelta as tdelta, timezone
 from fastapi import HTTPException, status
 
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import desc, func, select, update, delete
+from sqlalchemy.exc import IntegrityError
 
 import models.database as db_models
 import models.resources as resources
+import env
 
 from statistics import mean
 import pandas as pd
@@ -50,22 +54,55 @@ def days_from_unit(value: int, unit: str) -> int:
     else:
         raise ValueError("Invalid time unit")
 
-def generate_token_value(db: Session, firstname: str, lastname: str) -> Optional[Tuple[str, int]]:
+# Process-local copy of the latest signature : (id, secret value, time it was read)
+active_signature_cache: Optional[Tuple[int, str, float]] = None
+
+def invalidate_signature_cache() -> None:
+    global active_signature_cache
+    active_signature_cache = None
+
+def get_active_signature(db: Session) -> Optional[Tuple[int, str]]:
+    global active_signature_cache
+    # The TTL bounds how long other processes keep using a signature rotated elsewhere
+    if active_signature_cache and monotonic() - active_signature_cache[2] < env.SIGNATURE_CACHE_TTL_S:
+        return active_signature_cache[0], active_signature_cache[1]
     last_signature = db.query(db_models.SecretSignature).order_by(
         desc(db_models.SecretSignature.generation_date)
         ).first()
+    if not last_signature:
+        active_signature_cache = None
+        return None
+    active_signature_cache = (last_signature.id, last_signature.secret_value, monotonic())
+    return last_signature.id, last_signature.secret_value
+
+def rotate_signature(db: Session) -> resources.SecretSignature:
+    signature = db_models.SecretSignature(secret_value=secrets.token_hex(32), generation_date=dt.now())
+    db.add(signature)
+    db.commit()
+    invalidate_signature_cache()
+    return resources.SecretSignature(
+        id=signature.id,
+        secret_value=signature.secret_value,
+        generation_date=signature.generation_date.strftime('%d/%m/%Y-%H:%M')
+    )
+
+def generate_token_value(db: Session, firstname: str, lastname: str) -> Optional[Tuple[str, int]]:
+    last_signature = get_active_signature(db)
     if last_signature:
-        return (encode_secret(firstname[:2]+lastname[-2:]+str(dt.now())+last_signature.secret_value), last_signature.id)
+        signature_id, secret_value = last_signature
+        return (encode_secret(firstname[:2]+lastname[-2:]+str(dt.now())+secret_value), signature_id)
     return None
 
 def add_new_token(
         db: Session, firstname: str, lastname: str, password: str,
         user_profile_access: bool, samples_access: bool, goals_access: bool, stats_access: bool,
         expiration_value: str = "3", expiration_unit: Literal["days", "months", "years"] = "months",
+        user: Optional[db_models.User] = None,
         ):
-    # Get the user
-    pw = encode_secret(password)
-    user = db.query(db_models.User).filter_by(firstname=firstname, lastname=lastname, password=pw).first()
+    # Get the user, unless the caller already authenticated them
+    if user is None:
+        pw = encode_secret(password)
+        user = db.query(db_models.User).filter_by(firstname=firstname, lastname=lastname, password=pw).first()
     if not user:
         return None
     tk_value = generate_token_value(db, firstname, lastname)
@@ -85,7 +122,8 @@ def add_new_token(
     )
     db.add(tk)
     db.commit()
-    return resources.Token(access_token=tk.token_value, token_type="Bearer")
+    # tk is expired by the commit, reading tk.token_value would reload the whole row
+    return resources.Token(access_token=tk_value[0], token_type="Bearer")
 
 def get_user_role(db: Session):
     check_admin_is_allowed
@@ -115,6 +153,24 @@ def check_user_has_data(username: str):
     last_update = dt.fromtimestamp(file_info.st_mtime)
     return resources.UserDataStored(user_data_exists=True, last_update=last_update)
 
+def get_user_data_version(username: str) -> Optional[resources.UserDataVersion]:
+    path = Path(os.path.join("users_data", username+".csv"))
+    if not path.exists():
+        return None
+    file_info = path.stat()
+    # Each write of the file produces a new generation (modification time + size)
+    return resources.UserDataVersion(
+        etag=f'"{file_info.st_mtime_ns:x}-{file_info.st_size:x}"',
+        last_modified=dt.fromtimestamp(int(file_info.st_mtime), tz=timezone.utc)
+    )
+
+def get_recently_active_usernames(db: Session, limit: int) -> List[str]:
+    last_use = func.max(db_models.Auth.last_time_used)
+    rows = db.query(db_models.User.firstname, db_models.User.lastname).join(
+        db_models.Auth, db_models.Auth.user_id == db_models.User.id
+    ).group_by(db_models.User.id).order_by(desc(last_use)).limit(limit).all()
+    return [firstname + "_" + lastname for firstname, lastname in rows]
+
 def get_user_data(username: str):
     return pd.read_csv(f"./users_data/{username}.csv", sep=',', header=1, parse_dates=[2], date_format="%d-%m-%Y %H:%M")
 
@@ -140,19 +196,25 @@ def get_user_tokens(db: Session, user_id: str):
         for tk in user_tokens
     ]
 
-def get_token_rights(db: Session, token: str) -> Optional[Dict[str, bool]]:
-    # Checks if token exists
-    tk = db.query(db_models.Auth).filter_by(token_value=token).first()
-    if tk:
-        if tk.expiration_date >= dt.now():
-            return {
-                "profile": tk.user_profile_access,
-                "goals": tk.goals_access,
-                "samples": tk.samples_access,
-                "stats": tk.stats_access
-            }
+def token_rights(tk: Optional[db_models.Auth]) -> Optional[Dict[str, bool]]:
+    if tk and tk.expiration_date >= dt.now():
+        return {
+            "profile": tk.user_profile_access,
+            "goals": tk.goals_access,
+            "samples": tk.samples_access,
+            "stats": tk.stats_access
+        }
     return None
 
+def get_token_rights(db: Session, token: str) -> Optional[Dict[str, bool]]:
+    return token_rights(db.query(db_models.Auth).filter_by(token_value=token).first())
+
+def use_token(db: Session, token: str) -> Optional[db_models.Auth]:
+    # Marks the token as used and loads it along with its user, one SELECT for the whole authorization
+    db.execute(update(db_models.Auth).where(db_models.Auth.token_value == token).values(last_time_used=dt.now()))
+    db.commit()
+    return db.query(db_models.Auth).options(joinedload(db_models.Auth.user)).filter_by(token_value=token).first()
+
 def update_token_last_used_date(db: Session, token: str) -> bool:
     tk = db.query(db_models.Auth).filter_by(token_value=token).first()
     if tk:
@@ -163,19 +225,7 @@ def update_token_last_used_date(db: Session, token: str) -> bool:
 
 def remove_user(db: Session, existing_user: db_models.User):
     user = db.merge(existing_user)
-    all_goals = db.query(db_models.Goal).filter_by(user_id=user.id).all()
-    all_goals = [resources.Goal(
-        id=g.id,
-        title=g.title,
-        average_target=g.average_target,
-        end_datetime=g.end_datetime,
-        start_datetime=g.start_datetime,
-        stats_target=None,
-        trend_target=resources.TrendState.from_integer(g.trend_target),
-        status=resources.GoalStatus.from_integer(g.status)
-    ) for g in all_goals]
-    for g in all_goals:
-        db.delete(g)
+    all_goals = remove_all_goals(db, user, commit=False)
     db.delete(user)
     
     db.commit()
@@ -251,7 +301,7 @@ def get_user_average_day_user_samples(user: db_models.User, all_samples: Dict[st
         for s in samples_average_by_time_interval
     ]
 
-def get_user_goals(db: Session, user: db_models.User):
+def get_user_goals(db: Session, user: db_models.User, with_stats_target: bool = True):
     goals: List[db_models.Goal] = db.query(db_models.Goal).filter_by(user_id=user.id).all()
     return [
         resources.Goal(
@@ -273,7 +323,7 @@ def get_user_goals(db: Session, user: db_models.User):
                 first_quartile=g.first_quart,
                 second_quartile=g.second_quart,
                 third_quartile=g.second_quart
-            )
+            ) if with_stats_target else None
         )
         for g in goals
     ]
@@ -343,22 +393,126 @@ def remove_goal(db: Session, goal_id: int) -> Optional[resources.Goal]:
     )
     return g
 
-def remove_all_goals(db: Session, user: db_models.User) -> List[resources.Goal]:
-    all_goals = db.query(db_models.Goal).filter_by(user_id=user.id).all()
-    for g in all_goals:
-        db.delete(g)
-    db.commit()
-    return [resources.Goal(
+def goal_from_model(g: db_models.Goal) -> resources.Goal:
+    return resources.Goal(
         id=g.id,
         title=g.title,
         average_target=g.average_target,
         end_datetime=g.end_datetime,
         start_datetime=g.start_datetime,
         stats_target=None,
-        trend_target=resources.TrendState.from_integer(g.trend_target),
-        status=resources.GoalStatus.from_integer(g.status)
-    ) for g in all_goals]
+        trend_target=resources.TrendState.from_integer(g.trend_target) if g.trend_target is not None else None,
+        status=resources.GoalStatus.from_integer(g.status) if g.status is not None else None
+    )
 
+def remove_all_goals(db: Session, user: db_models.User, commit: bool = True) -> List[resources.Goal]:
+    all_goals = db.query(db_models.Goal).filter_by(user_id=user.id).all()
+    removed_goals = [goal_from_model(g) for g in all_goals]
+    # One DELETE statement instead of one per goal
+    db.execute(
+        delete(db_models.Goal).where(db_models.Goal.user_id == user.id),
+        execution_options={"synchronize_session": False}
+    )
+    for g in all_goals:
+        db.expunge(g)
+    if commit:
+        db.commit()
+    return removed_goals
+
+def check_goal_titles_available(db: Session, titles: List[str], excluded_ids: Optional[List[int]] = None) -> None:
+    duplicated_titles = {t for t in titles if titles.count(t) > 1}
+    existing_titles = set(db.scalars(
+        select(db_models.Goal.title).where(db_models.Goal.title.in_(titles), db_models.Goal.id.not_in(excluded_ids or []))
+    ).all())
+    if duplicated_titles or existing_titles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Based on the title, goals already exist : {', '.join(sorted(duplicated_titles | existing_titles))}"
+        )
+
+def add_new_goals(db: Session, user: db_models.User, goals: List[resources.Goal]) -> List[resources.Goal]:
+    check_goal_titles_available(db, [g.title for g in goals])
+    new_goals = []
+    for goal in goals:
+        stats_target = goal.stats_target or resources.Stats()
+        new_goals.append(db_models.Goal(
+            user_id=user.id,
+            title=goal.title,
+            status=goal.status.to_integer() if goal.status else -1,
+            start_datetime=goal.start_datetime,
+            end_datetime=goal.end_datetime,
+            average_target=goal.average_target,
+            trend_target=goal.trend_target.to_integer() if goal.trend_target else None,
+            minimum=stats_target.minimum,
+            maximum=stats_target.maximum,
+            stat_range=stats_target.stat_range,
+            mean=stats_target.mean,
+            variance=stats_target.variance,
+            std_dev=stats_target.standard_deviation,
+            overall_samples_size=stats_target.overall_samples_size,
+            first_quart=stats_target.first_quartile,
+            second_quart=stats_target.second_quartile,
+            third_quart=stats_target.third_quartile,
+            median=stats_target.median
+        ))
+    # The flush inserts all the goals at once, ids included
+    db.add_all(new_goals)
+    db.commit()
+    for goal, g in zip(goals, new_goals):
+        goal.id = g.id
+    return goals
+
+def update_goals(db: Session, user: db_models.User, updates: List[resources.GoalUpdate]) -> Optional[List[resources.Goal]]:
+    ids = [u.id for u in updates]
+    current_titles: Dict[int, str] = dict(db.execute(
+        select(db_models.Goal.id, db_models.Goal.title).where(db_models.Goal.id.in_(ids), db_models.Goal.user_id == user.id)
+    ).all())
+    if set(current_titles) != set(ids):
+        return None
+    # Titles once the whole batch is applied : a goal may take the former title of another goal of the batch
+    final_titles = dict(current_titles)
+    for u in updates:
+        if u.title is not None:
+            final_titles[u.id] = u.title
+    renamed = {i: t for i, t in final_titles.items() if t != current_titles[i]}
+    if renamed:
+        check_goal_titles_available(db, list(final_titles.values()), excluded_ids=list(final_titles))
+    rows = []
+    for u in updates:
+        values = u.dict(exclude_unset=True)
+        if "status" in values:
+            values["status"] = u.status.to_integer() if u.status else -1
+        rows.append(values)
+    try:
+        if set(renamed.values()) & set(current_titles.values()):
+            # Titles are unique row by row : swapped titles go through temporary ones first
+            db.execute(update(db_models.Goal), [{"id": i, "title": secrets.token_hex(16)} for i in renamed])
+        # Bulk UPDATE by primary key, grouped by set of updated columns
+        db.execute(update(db_models.Goal), rows)
+        db.commit()
+    except IntegrityError:
+        # Title taken by a goal added in the meantime
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Based on the title, goals already exist"
+        )
+    goals = db.scalars(select(db_models.Goal).where(db_models.Goal.id.in_(ids))).all()
+    return [goal_from_model(g) for g in goals]
+
+def remove_goals(db: Session, user: db_models.User, ids: List[int]) -> Optional[List[resources.Goal]]:
+    goals = db.scalars(
+        select(db_models.Goal).where(db_models.Goal.id.in_(ids), db_models.Goal.user_id == user.id)
+    ).all()
+    if len(goals) != len(set(ids)):
+        return None
+    removed_goals = [goal_from_model(g) for g in goals]
+    db.execute(
+        delete(db_models.Goal).where(db_models.Goal.id.in_(ids), db_models.Goal.user_id == user.id),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return removed_goals
 
 def update_goal_attribute(db: Session, goal_id: int, updatedKey: resources.UpdatedKey, new_value: resources.GoalAttr) ->Optional[resources.Goal]:
     existing_goal = db.query(db_models.Goal).filter_by(id=goal_id).first()
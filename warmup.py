@@ -0,0 +1,74 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from router_dependencies import SessionLocal, samples_collection, store_user_data
+from models import resources
+import env, tiering, utils, workers
+
+warm_up_status = resources.WarmUpStatus(enabled=env.WARMUP_ENABLED, ready=not env.WARMUP_ENABLED)
+warm_up_task: Optional[asyncio.Task] = None
+
+async def load_user(username: str):
+    try:
+        res = await workers.run_in_executor(
+            workers.load_user_data, workers.user_data_path(username),
+            workers.user_archives_path(username), tiering.retention_days, workers.user_changes_path(username)
+        )
+    except Exception:
+        res = None
+    return username, res
+
+def users_to_warm_up() -> List[str]:
+    tiering.refresh_settings()
+    db = SessionLocal()
+    try:
+        usernames = utils.get_recently_active_usernames(db, env.WARMUP_USERS)
+    finally:
+        db.close()
+    # Users loaded by a request in the meantime or without any data are skipped
+    return [u for u in usernames if u not in samples_collection and os.path.exists(workers.user_data_path(u))]
+
+async def warm_up_users():
+    warm_up_status.started_at = datetime.now()
+    usernames = users_to_warm_up()
+    warm_up_status.users_total = len(usernames)
+    for loading in asyncio.as_completed([load_user(u) for u in usernames]):
+        username, res = await loading
+        if res:
+            store_user_data(username, res, replace=False)
+            warm_up_status.users_loaded += 1
+        else:
+            warm_up_status.users_failed += 1
+    warm_up_status.finished_at = datetime.now()
+    warm_up_status.ready = True
+
+def preload_users() -> None:
+    # Run by the server before it forks its workers, which share the loaded data copy-on-write
+    warm_up_status.started_at = datetime.now()
+    usernames = users_to_warm_up()
+    warm_up_status.users_total = len(usernames)
+    for username in usernames:
+        try:
+            res = workers.load_user_data(
+                workers.user_data_path(username), workers.user_archives_path(username),
+                tiering.retention_days, workers.user_changes_path(username)
+            )
+        except Exception:
+            res = None
+        if res:
+            store_user_data(username, res, replace=False)
+            warm_up_status.users_loaded += 1
+        else:
+            warm_up_status.users_failed += 1
+    warm_up_status.finished_at = datetime.now()
+    warm_up_status.ready = True
+
+def start_warm_up() -> None:
+    global warm_up_task
+    # Nothing to do in the workers of a server which preloaded the users
+    if warm_up_task is None and warm_up_status.finished_at is None:
+        warm_up_task = asyncio.get_running_loop().create_task(warm_up_users())
+        # The application must not stay unready forever if the warm-up crashes
+        warm_up_task.add_done_callback(lambda _: setattr(warm_up_status, "ready", True))
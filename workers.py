@@ -0,0 +1,134 @@
+import asyncio
+import os
+from contextvars import copy_context
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from fastapi import HTTPException, status
+
+import changes
+import csv_data
+import data_validation
+import events
+import episodes
+from series import SampleSeries
+import env
+import tiering
+import tracing
+from models import resources
+
+process_pool: Optional[ProcessPoolExecutor] = None
+thread_pool: Optional[ThreadPoolExecutor] = None
+# Tasks submitted by requests, running or waiting for a worker
+pending_tasks = 0
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=env.WORKER_PROCESSES)
+    return process_pool
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global thread_pool
+    if thread_pool is None:
+        thread_pool = ThreadPoolExecutor(max_workers=env.WORKER_PROCESSES, thread_name_prefix="cpu_bound")
+    return thread_pool
+
+def shutdown_process_pool(wait: bool = True) -> None:
+    global process_pool, thread_pool
+    if process_pool is not None:
+        process_pool.shutdown(wait=wait, cancel_futures=not wait)
+        process_pool = None
+    if thread_pool is not None:
+        thread_pool.shutdown(wait=wait, cancel_futures=not wait)
+        thread_pool = None
+
+async def run_cpu_bound(fn: Callable[..., Any], *args: Any, use_process_pool: bool = True) -> Any:
+    """Runs a CPU-heavy function outside of the event loop.
+
+    Functions working on data already held by the application (which would be costly to pickle)
+    should be given `use_process_pool=False` to run in a thread instead of a worker process.
+    """
+    global pending_tasks
+    if pending_tasks >= env.WORKER_PROCESSES + env.WORKER_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many computations in progress, please retry later.",
+            headers={"Retry-After": "1"}
+        )
+    pending_tasks += 1
+    try:
+        return await run_in_executor(fn, *args, use_process_pool=use_process_pool)
+    finally:
+        pending_tasks -= 1
+
+async def run_in_executor(fn: Callable[..., Any], *args: Any, use_process_pool: bool = True) -> Any:
+    # Without admission control, for background work (ingest jobs, warm-up), the spans of fn are kept
+    executor = get_process_pool() if use_process_pool else get_thread_pool()
+    loop = asyncio.get_running_loop()
+    if not tracing.enabled:
+        return await loop.run_in_executor(executor, fn, *args)
+    if not use_process_pool:
+        # Threads of an executor do not inherit the context of the request
+        return await loop.run_in_executor(executor, copy_context().run, fn, *args)
+    try:
+        result, spans = await loop.run_in_executor(executor, tracing.call_in_context, tracing.current_context(), fn, *args)
+    except Exception as e:
+        tracing.export_all(getattr(e, "spans", []))
+        raise
+    tracing.export_all(spans)
+    return result
+
+def user_data_path(username: str) -> str:
+    return os.path.join("users_data", f"{username}.csv")
+
+def user_archives_path(username: str) -> str:
+    return os.path.join(env.ARCHIVES_DIR, username)
+
+def user_changes_path(username: str) -> str:
+    return os.path.join(env.CHANGES_DIR, f"{username}.npz")
+
+# Functions below are executed inside the worker processes : arguments and results must be picklable
+
+@tracing.traced("workers.user_data_from_frame")
+def user_data_from_frame(df, archives_dir: Optional[str] = None, retention_days: Optional[int] = None, changes_path: Optional[str] = None) -> resources.LoadedUserData:
+    samples = csv_data.samples_from_frame(df)
+    records = csv_data.records_from_frame(df)
+    series = SampleSeries.from_samples(samples) if samples else None
+    data = resources.LoadedUserData(
+        samples=samples,
+        stats=resources.Stats.from_sample_collection(samples) if samples else None,
+        records=records,
+        episodes=episodes.detect_episodes(series) if samples else None
+    )
+    if samples and changes_path is not None:
+        data.changes = changes.update_change_log(changes_path, series)
+    # Stats and episodes cover the whole history, only the hot samples and records are sent back
+    if samples and archives_dir is not None:
+        with tracing.span("tiering.split_user_data"):
+            data.samples, data.records, data.cold = tiering.split_user_data(samples, records, archives_dir, retention_days)
+    data.events = events.event_streams_from_records(data.records)
+    return data
+
+def load_user_data(filepath: str, archives_dir: Optional[str] = None, retention_days: Optional[int] = None, changes_path: Optional[str] = None) -> Optional[resources.LoadedUserData]:
+    df = csv_data.read_user_frame(filepath)
+    if df is None:
+        return None
+    data = user_data_from_frame(df, archives_dir, retention_days, changes_path)
+    if not data.samples:
+        return None
+    return data
+
+def ingest_user_file(filepath: str, bytes_data: bytes, archives_dir: Optional[str] = None, retention_days: Optional[int] = None, changes_path: Optional[str] = None) -> resources.IngestResult:
+    # Parsed only once, for the validation as well as for the samples
+    df = csv_data.parse_user_frame(BytesIO(bytes_data))
+    errors = data_validation.validation_errors(df)
+    if errors:
+        return resources.IngestResult(rows_count=len(df), validation_errors=errors)
+    # Readers of the previous file never see a partially written one
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, "wb") as f:
+        f.write(bytes_data)
+    os.replace(tmp_filepath, filepath)
+    return resources.IngestResult(rows_count=len(df), data=user_data_from_frame(df, archives_dir, retention_days, changes_path))